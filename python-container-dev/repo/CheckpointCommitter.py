@@ -0,0 +1,180 @@
+"""Coalesced, forward-only commits of per-stream position pointers.
+
+KVS consumers remember the last processed fragment (or Kinesis sequence
+number) of each stream in one DynamoDB item. Writing that item after every
+fragment costs a write per fragment on a single hot key. The committer keeps
+the latest position per stream in memory and commits it at most once every
+`interval` seconds, plus synchronously on flush()/close()/interpreter exit.
+
+Every commit is an UpdateItem conditioned on the stored position being older,
+so the pointer only ever moves forward, also when several consumers or a
+restarted one commit concurrently. Positions are decimal strings longer than
+DynamoDB numbers allow, so they are compared as zero-padded strings stored in
+a FragmentOrder attribute next to the pointer.
+"""
+import atexit
+import logging
+import threading
+
+from botocore.exceptions import ClientError
+
+from Metrics import DYNAMODB_ITEMS_WRITTEN, stage
+
+log = logging.getLogger(__name__)
+
+ORDER_ATTRIBUTE = "FragmentOrder"
+ORDER_WIDTH = 128  # Fragment numbers have ~50 digits, Kinesis sequence numbers ~56
+
+
+def position_order(position):
+    """Zero-padded form of a decimal position that sorts like the number."""
+    position = str(position)
+    if not position.isdigit():
+        raise ValueError(f"Position {position!r} is not a decimal number")
+    return position.zfill(ORDER_WIDTH)
+
+
+class CheckpointCommitter:
+    """Keep the newest position per stream and commit it periodically with conditional writes."""
+
+    def __init__(self, dynamodb, table_name, key, pointer_attribute="FragmentNumber", interval=10.0,
+                 before_commit=None):
+        """
+        Args:
+            dynamodb: boto3 DynamoDB client (typed values) or resource (plain values).
+            table_name (str): Table holding the pointer items.
+            key (callable): Returns the item key for a stream name.
+            pointer_attribute (str): Attribute the position is stored in.
+            interval (float): Minimum seconds between commits of a stream.
+            before_commit (callable): Called before positions are committed, e.g. to
+                flush the rows they cover so the pointer never passes unwritten data.
+        """
+        self.dynamodb = dynamodb
+        self.table_name = table_name
+        self.key = key
+        self.pointer_attribute = pointer_attribute
+        self.interval = interval
+        self.before_commit = before_commit
+        self._typed = not hasattr(dynamodb, "Table")
+        self._table = None if self._typed else dynamodb.Table(table_name)
+
+        self._pending = {}    # stream -> (order, position, attributes)
+        self._committed = {}  # stream -> (order, position)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._closed = threading.Event()
+
+        # Counters for tuning
+        self.advances = 0
+        self.commits = 0
+        self.stale_commits = 0
+
+        self._committer = threading.Thread(target=self._commit_periodically, name="checkpoint-committer",
+                                           daemon=True)
+        self._committer.start()
+        atexit.register(self.close)
+
+    def advance(self, stream, position, attributes=None):
+        """Record `position` for a stream; ignored unless it is newer than what is pending or committed.
+
+        `attributes` are written along with the pointer, typed ({'S': ...}) for a client.
+        """
+        order = position_order(position)
+        with self._lock:
+            self.advances += 1
+            pending = self._pending.get(stream)
+            committed = self._committed.get(stream)
+            if pending is not None and pending[0] >= order or committed is not None and committed[0] >= order:
+                return
+            self._pending[stream] = (order, str(position), dict(attributes or {}))
+
+    def position(self, stream):
+        """Newest position this process has recorded for a stream, committed or not, or None."""
+        with self._lock:
+            entry = self._pending.get(stream) or self._committed.get(stream)
+        return entry[1] if entry is not None else None
+
+    def flush(self):
+        """Commit every pending position now."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return
+            if self.before_commit is not None:
+                try:
+                    self.before_commit()
+                except Exception:
+                    for stream, entry in pending.items():
+                        self._restore(stream, entry)
+                    raise
+
+            for stream, entry in pending.items():
+                try:
+                    self._commit(stream, *entry)
+                except Exception as e:
+                    log.error(f"Error committing checkpoint {entry[1]} of {stream}: {e}")
+                    self._restore(stream, entry)
+
+    def close(self):
+        """Stop the background committer and commit what is left."""
+        self._closed.set()
+        self.flush()
+
+    def stats(self):
+        return {"advances": self.advances, "commits": self.commits, "stale_commits": self.stale_commits}
+
+    def _commit(self, stream, order, position, attributes):
+        values = {self.pointer_attribute: position, ORDER_ATTRIBUTE: order}
+        values.update(attributes)
+        # Placeholders for every name, since attributes like TTL are reserved words
+        names, expression_values, assignments = {}, {":order": self._value(order)}, []
+        for i, (name, value) in enumerate(values.items()):
+            names[f"#a{i}"] = name
+            expression_values[f":a{i}"] = self._value(value)
+            assignments.append(f"#a{i} = :a{i}")
+        kwargs = {
+            "Key": self.key(stream),
+            "UpdateExpression": "SET " + ", ".join(assignments),
+            "ConditionExpression": f"attribute_not_exists({ORDER_ATTRIBUTE}) OR {ORDER_ATTRIBUTE} < :order",
+            "ExpressionAttributeNames": names,
+            "ExpressionAttributeValues": expression_values,
+        }
+
+        try:
+            with stage("dynamodb_write"):
+                if self._typed:
+                    self.dynamodb.update_item(TableName=self.table_name, **kwargs)
+                else:
+                    self._table.update_item(**kwargs)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") != "ConditionalCheckFailedException":
+                raise
+            # Another consumer already committed this position or a newer one
+            self.stale_commits += 1
+            log.info(f"Checkpoint {position} of {stream} is behind the stored one, not written")
+        else:
+            DYNAMODB_ITEMS_WRITTEN.inc(table=self.table_name)
+            self.commits += 1
+            log.info(f"Committed checkpoint {position} of {stream}")
+        with self._lock:
+            committed = self._committed.get(stream)
+            if committed is None or committed[0] < order:
+                self._committed[stream] = (order, position)
+
+    def _value(self, value):
+        return {"S": value} if self._typed and isinstance(value, str) else value
+
+    def _restore(self, stream, entry):
+        """Put a position that failed to commit back unless a newer one is pending."""
+        with self._lock:
+            pending = self._pending.get(stream)
+            if pending is None or pending[0] < entry[0]:
+                self._pending[stream] = entry
+
+    def _commit_periodically(self):
+        while not self._closed.wait(self.interval):
+            try:
+                self.flush()
+            except Exception as e:
+                log.error(f"Error committing checkpoints: {e}")
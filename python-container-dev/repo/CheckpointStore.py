@@ -0,0 +1,200 @@
+"""Per-file processing checkpoints for ProcessVI.
+
+Every completed file gets its own small item in the checkpoint table, so
+recording a file is O(1) no matter how many files have been processed, and
+no single item grows towards the 400 KB DynamoDB limit. The item is written
+before the file enters the local journal, so the local index never claims a
+file the table (and so every other host) does not know about.
+
+Locally the store keeps an index of 64-bit digests of the completed files:
+- `<path>.journal`: append-only text file, one hex digest per completed file
+- `<path>.idx.npy`: sorted uint64 array the journal is compacted into
+
+Startup loads the compacted index with one np.load plus the (short) journal
+tail, and lookups are a binary search, so millions of files stay cheap. When
+there is no local index yet it is rebuilt once from the table.
+
+Long videos also keep a resume marker (progress#<digest>) while they are
+being processed, so a restarted worker can continue where it stopped.
+"""
+import hashlib
+import logging
+import os
+from datetime import datetime
+
+import numpy as np
+from boto3.dynamodb.conditions import Attr
+
+log = logging.getLogger(__name__)
+
+ITEM_PREFIX = "file#"
+PROGRESS_PREFIX = "progress#"
+LEGACY_CHECKPOINT_ID = "checkpoint"  # Old single item holding every processed path
+
+
+def file_digest(kind, path):
+    """64-bit digest identifying a file of a given kind ("videos" or "images")."""
+    digest = hashlib.blake2b(f"{kind}\0{path}".encode("utf-8"), digest_size=8).hexdigest()
+    return int(digest, 16)
+
+
+def load_progress(table, path):
+    """Return the resume marker {"video_id", "position_ms"} saved for a video, or None."""
+    try:
+        item = table.get_item(Key={"id": f"{PROGRESS_PREFIX}{file_digest('videos', path):016x}"}).get("Item")
+    except Exception as e:
+        log.error(f"Error loading progress for {path}: {e}")
+        return None
+    if not item:
+        return None
+    return {"video_id": item["video_id"], "position_ms": int(item["position_ms"])}
+
+
+def save_progress(table, path, video_id, position_ms):
+    """Persist the position (ms) up to which a video has been analyzed and stored."""
+    try:
+        table.put_item(Item={
+            "id": f"{PROGRESS_PREFIX}{file_digest('videos', path):016x}",
+            "path": path,
+            "video_id": video_id,
+            "position_ms": int(position_ms),
+            "updated_at": datetime.utcnow().isoformat(),
+        })
+    except Exception as e:
+        log.error(f"Error saving progress for {path}: {e}")
+
+
+def clear_progress(table, path):
+    """Remove the resume marker of a video once it is fully processed."""
+    try:
+        table.delete_item(Key={"id": f"{PROGRESS_PREFIX}{file_digest('videos', path):016x}"})
+    except Exception as e:
+        log.error(f"Error clearing progress for {path}: {e}")
+
+
+class CheckpointStore:
+    """Set of completed files backed by per-file DynamoDB items and a local index."""
+
+    def __init__(self, dynamodb, table_name, local_path, compact_every=10000):
+        """
+        Args:
+            dynamodb: boto3 DynamoDB resource.
+            table_name (str): Checkpoint table, keyed by "id".
+            local_path (str): Base path for the local journal and index files.
+            compact_every (int): Journal entries to accumulate before compaction.
+        """
+        self.table = dynamodb.Table(table_name)
+        self.table_name = table_name
+        self.journal_path = f"{local_path}.journal"
+        self.index_path = f"{local_path}.idx.npy"
+        self.compact_every = compact_every
+
+        self._index = np.empty(0, dtype=np.uint64)
+        self._recent = set()
+
+        directory = os.path.dirname(self.journal_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # The index file only exists once the table has been read successfully;
+        # until then every start tries to rebuild from the table again
+        if os.path.exists(self.index_path):
+            self._index = np.load(self.index_path)
+            self._load_journal()
+        else:
+            rebuilt = self._rebuild_from_table()
+            self._load_journal()
+            if rebuilt:
+                self.compact()
+        log.info(f"Loaded {len(self)} checkpointed files")
+
+        self._journal = open(self.journal_path, "a")
+
+    def __len__(self):
+        return len(self._index) + len(self._recent)
+
+    def is_done(self, kind, path):
+        """True if the file has been recorded as completed."""
+        digest = file_digest(kind, path)
+        if digest in self._recent:
+            return True
+        position = np.searchsorted(self._index, np.uint64(digest))
+        return position < len(self._index) and int(self._index[position]) == digest
+
+    def mark_done(self, kind, path):
+        """Record a completed file in its own checkpoint item, then in the local journal.
+
+        Raises if the item cannot be written; the file is then not recorded at all.
+        """
+        digest = file_digest(kind, path)
+        # One write per completed file, so it is written right away rather than batched
+        self.table.put_item(Item={
+            "id": f"{ITEM_PREFIX}{digest:016x}",
+            "kind": kind,
+            "path": path,
+            "completed_at": datetime.utcnow().isoformat(),
+        })
+
+        self._journal.write(f"{digest:016x}\n")
+        self._journal.flush()
+        self._recent.add(digest)
+
+        if len(self._recent) >= self.compact_every:
+            self.compact()
+
+    def compact(self):
+        """Merge the journal into the sorted index file and truncate the journal."""
+        if self._recent:
+            recent = np.fromiter(self._recent, dtype=np.uint64, count=len(self._recent))
+            self._index = np.union1d(self._index, recent)
+            self._recent = set()
+
+        tmp_path = f"{self.index_path}.tmp.npy"
+        np.save(tmp_path, self._index)
+        os.replace(tmp_path, self.index_path)
+
+        # A crash before the truncate only leaves duplicates of indexed digests
+        journal = getattr(self, "_journal", None)
+        if journal is not None:
+            journal.seek(0)
+            journal.truncate()
+        else:
+            open(self.journal_path, "w").close()
+
+    def close(self):
+        self.compact()
+        self._journal.close()
+
+    def _load_journal(self):
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path) as journal:
+                self._recent.update(int(line, 16) for line in journal if line.strip())
+
+    def _rebuild_from_table(self):
+        """Populate the index from the per-file items and the legacy checkpoint item.
+
+        Returns False if the table could not be read, in which case nothing is
+        persisted locally and the next start tries again.
+        """
+        try:
+            scan_kwargs = {
+                "FilterExpression": Attr("id").begins_with(ITEM_PREFIX),
+                "ProjectionExpression": "id",
+            }
+            while True:
+                response = self.table.scan(**scan_kwargs)
+                for item in response.get("Items", []):
+                    self._recent.add(int(item["id"][len(ITEM_PREFIX):], 16))
+                if "LastEvaluatedKey" not in response:
+                    break
+                scan_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+            legacy = self.table.get_item(Key={"id": LEGACY_CHECKPOINT_ID}).get("Item", {})
+            for kind in ("videos", "images"):
+                for path in legacy.get(kind, []):
+                    self._recent.add(file_digest(kind, path))
+        except Exception as e:
+            log.error(f"Error rebuilding checkpoint index from {self.table_name}: {e}")
+            return False
+        log.info(f"Rebuilt checkpoint index with {len(self._recent)} files from {self.table_name}")
+        return True
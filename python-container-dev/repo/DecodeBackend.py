@@ -0,0 +1,213 @@
+"""Video decode backends for sampling frames.
+
+Both backends implement the same interface:
+
+    sample(source, interval_seconds, mode, start_ms, end_ms)
+        Yield (frame_index, position_ms, frame) for one BGR frame per interval
+        of a video file (see FrameSampler.sample_frames for the modes).
+    fragment_frames(fragment_bytes, one_in_frames_ratio)
+        Return every n-th frame of an in-memory MKV fragment as BGR ndarrays.
+
+OpenCVBackend goes through cv2.VideoCapture, which needs a file on disk, so
+fragments are written to a temporary file first. PyAVBackend decodes with the
+codec's own frame/slice threads (thread_type='AUTO'), reads fragments from a
+BytesIO, and only converts the frames it keeps from YUV to BGR; the frames in
+between are decoded (to keep the codec state) but never converted.
+"""
+import io
+import os
+import tempfile
+
+import av
+import cv2
+
+DECODE_BACKENDS = ("opencv", "pyav")
+
+
+def get_decode_backend(name, threads=0):
+    """Return a backend instance by name; `threads` caps PyAV's codec threads (0: one per core)."""
+    if name == "opencv":
+        return OpenCVBackend(keyframe_threads=threads)
+    if name == "pyav":
+        return PyAVBackend(thread_count=threads)
+    raise ValueError(f"Unknown decode backend {name!r}, expected one of {DECODE_BACKENDS}")
+
+
+def _first_grid_point(start_ms, interval_ms):
+    return -(-start_ms // interval_ms) * interval_ms
+
+
+class OpenCVBackend:
+    """Decode with cv2.VideoCapture (the keyframe mode always uses PyAV)."""
+
+    name = "opencv"
+
+    def __init__(self, keyframe_threads=0):
+        """
+        Args:
+            keyframe_threads (int): Codec threads of the PyAV decoder used for the
+                keyframe mode, 0 lets FFmpeg pick one per core.
+        """
+        self.keyframe_threads = keyframe_threads
+
+    def sample(self, source, interval_seconds=10, mode="grab", start_ms=0, end_ms=None):
+        if mode == "grab":
+            return self._sample_by_grab(source, interval_seconds, start_ms, end_ms)
+        if mode == "seek":
+            return self._sample_by_seek(source, interval_seconds, start_ms, end_ms)
+        if mode == "keyframe":
+            # cv2 cannot ask the codec to skip non-key frames
+            return PyAVBackend(thread_count=self.keyframe_threads).sample(source, interval_seconds, mode, start_ms, end_ms)
+        raise ValueError(f"Unknown sampling mode {mode!r}")
+
+    def fragment_frames(self, fragment_bytes, one_in_frames_ratio=1):
+        with tempfile.NamedTemporaryFile(suffix=".mkv", delete=False) as fragment_file:
+            fragment_file.write(fragment_bytes)
+        cap = cv2.VideoCapture(fragment_file.name)
+        try:
+            frames = []
+            frame_index = 0
+            while cap.grab():
+                if frame_index % one_in_frames_ratio == 0:
+                    ret, frame = cap.retrieve()
+                    if not ret:
+                        break
+                    frames.append(frame)
+                frame_index += 1
+            return frames
+        finally:
+            cap.release()
+            os.unlink(fragment_file.name)
+
+    def _sample_by_grab(self, file_path, interval_seconds, start_ms=0, end_ms=None):
+        """Walk every frame with grab() and only retrieve() the sampled ones."""
+        cap = cv2.VideoCapture(file_path)
+        try:
+            fps = cap.get(cv2.CAP_PROP_FPS)
+            if fps <= 0:
+                # Without a frame rate there is no frame grid to sample on
+                yield from self._sample_by_seek(file_path, interval_seconds, start_ms, end_ms)
+                return
+            frame_interval = max(1, round(fps * interval_seconds))
+
+            frame_index = 0
+            if start_ms > 0:
+                frame_index = round(start_ms * fps / 1000.0)
+                cap.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+            while cap.grab():
+                if frame_index % frame_interval == 0:
+                    position_ms = frame_index * 1000.0 / fps
+                    if end_ms is not None and position_ms >= end_ms:
+                        break
+                    ret, frame = cap.retrieve()
+                    if not ret:
+                        break
+                    yield frame_index, position_ms, frame
+                frame_index += 1
+        finally:
+            cap.release()
+
+    def _sample_by_seek(self, file_path, interval_seconds, start_ms=0, end_ms=None):
+        """Seek directly to each sample timestamp and decode a single frame there."""
+        interval_ms = interval_seconds * 1000.0
+        cap = cv2.VideoCapture(file_path)
+        try:
+            position_ms = _first_grid_point(start_ms, interval_ms)
+            while cap.isOpened() and (end_ms is None or position_ms < end_ms):
+                cap.set(cv2.CAP_PROP_POS_MSEC, position_ms)
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                frame_index = int(cap.get(cv2.CAP_PROP_POS_FRAMES)) - 1
+                yield frame_index, position_ms, frame
+                position_ms += interval_ms
+        finally:
+            cap.release()
+
+
+class PyAVBackend:
+    """Decode with PyAV (FFmpeg) using the codec's threading."""
+
+    name = "pyav"
+
+    def __init__(self, thread_type="AUTO", thread_count=0):
+        """
+        Args:
+            thread_type (str): Codec threading, "AUTO", "FRAME", "SLICE" or "NONE".
+            thread_count (int): Codec threads, 0 lets FFmpeg pick one per core.
+        """
+        self.thread_type = thread_type
+        self.thread_count = thread_count
+
+    def sample(self, source, interval_seconds=10, mode="grab", start_ms=0, end_ms=None):
+        if mode == "grab":
+            return self._sample_sequential(source, interval_seconds, start_ms, end_ms)
+        if mode == "seek":
+            return self._sample_by_seek(source, interval_seconds, start_ms, end_ms)
+        if mode == "keyframe":
+            return self._sample_sequential(source, interval_seconds, start_ms, end_ms, keyframes_only=True)
+        raise ValueError(f"Unknown sampling mode {mode!r}")
+
+    def fragment_frames(self, fragment_bytes, one_in_frames_ratio=1):
+        with av.open(io.BytesIO(fragment_bytes), format="matroska") as container:
+            stream = self._video_stream(container)
+            return [
+                frame.to_ndarray(format="bgr24")
+                for frame_index, frame in enumerate(container.decode(stream))
+                if frame_index % one_in_frames_ratio == 0
+            ]
+
+    def _video_stream(self, container, keyframes_only=False):
+        stream = container.streams.video[0]
+        stream.thread_type = self.thread_type
+        stream.codec_context.thread_count = self.thread_count
+        if keyframes_only:
+            stream.codec_context.skip_frame = "NONKEY"
+        return stream
+
+    def _sample_sequential(self, file_path, interval_seconds, start_ms=0, end_ms=None, keyframes_only=False):
+        """Decode forward and keep the first frame at or after each sample timestamp.
+
+        With `keyframes_only` the codec drops every non-key frame before it is
+        decoded, so samples land on the first keyframe after each timestamp.
+        """
+        interval_ms = interval_seconds * 1000.0
+        with av.open(file_path) as container:
+            stream = self._video_stream(container, keyframes_only)
+            rate = float(stream.average_rate) if stream.average_rate else 0.0
+
+            next_sample_ms = _first_grid_point(start_ms, interval_ms)
+            if next_sample_ms > 0:
+                container.seek(int(next_sample_ms / 1000.0 / stream.time_base), stream=stream)
+            for frame in container.decode(stream):
+                if frame.time is None:
+                    continue
+                position_ms = frame.time * 1000.0
+                if position_ms < next_sample_ms:
+                    continue
+                if end_ms is not None and next_sample_ms >= end_ms:
+                    break
+                frame_index = int(round(frame.time * rate)) if rate else None
+                yield frame_index, position_ms, frame.to_ndarray(format="bgr24")
+                next_sample_ms = (position_ms // interval_ms + 1) * interval_ms
+
+    def _sample_by_seek(self, file_path, interval_seconds, start_ms=0, end_ms=None):
+        """Seek to the keyframe before each sample timestamp and decode forward to it."""
+        interval_ms = interval_seconds * 1000.0
+        with av.open(file_path) as container:
+            stream = self._video_stream(container)
+            rate = float(stream.average_rate) if stream.average_rate else 0.0
+
+            position_ms = _first_grid_point(start_ms, interval_ms)
+            while end_ms is None or position_ms < end_ms:
+                container.seek(int(position_ms / 1000.0 / stream.time_base), stream=stream)
+                sample = None
+                for frame in container.decode(stream):
+                    if frame.time is not None and frame.time * 1000.0 >= position_ms - 0.5:
+                        sample = frame
+                        break
+                if sample is None:
+                    break
+                frame_index = int(round(sample.time * rate)) if rate else None
+                yield frame_index, position_ms, sample.to_ndarray(format="bgr24")
+                position_ms += interval_ms
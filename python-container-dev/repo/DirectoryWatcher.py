@@ -0,0 +1,167 @@
+"""Continuous discovery of new or changed files in ProcessVI's input directories.
+
+On Linux the directories are watched with inotify (through ctypes, no extra
+package). Elsewhere, or if inotify is unavailable, they are polled with
+os.scandir. Either way the watcher keeps a (size, mtime) index of the files it
+has handed out, so unchanged files are never reported twice, and a file is
+only reported once its size and mtime have been stable for `settle_seconds`,
+i.e. the recorder has stopped writing it.
+"""
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import time
+
+log = logging.getLogger(__name__)
+
+# inotify event masks (see inotify(7))
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+_EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+
+
+class _Inotify:
+    """Minimal inotify wrapper over libc."""
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self._directories = {}
+
+    def add_watch(self, directory, mask=WATCH_MASK):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), directory)
+        self._directories[wd] = directory
+
+    def read(self, timeout):
+        """Return [(directory, name, mask)] for events within `timeout` seconds."""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events, offset = [], 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0").decode("utf-8", "surrogateescape")
+            offset += length
+            events.append((self._directories.get(wd), name, mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class DirectoryWatcher:
+    """Report files that are new or changed and have stopped growing."""
+
+    def __init__(self, directories, settle_seconds=10.0, poll_interval=2.0, already_done=None, use_inotify=True):
+        """
+        Args:
+            directories (dict): Directory -> file suffix to watch in it, e.g. {"./videos": ".mkv"}.
+            settle_seconds (float): Time size and mtime must stay unchanged before a file is ready.
+            poll_interval (float): Seconds between scans when polling (and max wait per poll()).
+            already_done (callable): (directory, path) -> bool for files found on the first
+                scan; those are indexed as seen instead of being reported.
+            use_inotify (bool): Try inotify before falling back to polling.
+        """
+        self.directories = directories
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+
+        self._index = {}       # path -> (size, mtime_ns) when it was reported
+        self._candidates = {}  # path -> [directory, (size, mtime_ns), last change]
+        self._last_scan = 0.0
+
+        self._inotify = None
+        if use_inotify:
+            try:
+                inotify = _Inotify()
+                for directory in directories:
+                    inotify.add_watch(directory)
+                self._inotify = inotify
+            except (OSError, AttributeError) as e:
+                log.info(f"inotify unavailable ({e}), polling directories every {poll_interval}s")
+
+        self._scan(already_done)
+
+    @property
+    def mode(self):
+        return "inotify" if self._inotify is not None else "poll"
+
+    def poll(self, timeout=None):
+        """Wait up to `timeout` seconds for changes and return [(directory, path)] of ready files."""
+        timeout = self.poll_interval if timeout is None else timeout
+        if self._inotify is not None:
+            for directory, name, mask in self._inotify.read(timeout):
+                if mask & IN_Q_OVERFLOW or directory is None:
+                    self._scan()
+                elif name.endswith(self.directories[directory]):
+                    self._touch(directory, os.path.join(directory, name))
+        else:
+            time.sleep(max(0.0, self._last_scan + self.poll_interval - time.monotonic()))
+            self._scan()
+        return self._settled()
+
+    def close(self):
+        if self._inotify is not None:
+            self._inotify.close()
+
+    def _scan(self, already_done=None):
+        """Compare every watched file with the index and collect new or changed ones."""
+        self._last_scan = time.monotonic()
+        for directory, suffix in self.directories.items():
+            try:
+                entries = list(os.scandir(directory))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                if not entry.name.endswith(suffix) or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                signature = (stat.st_size, stat.st_mtime_ns)
+                if already_done is not None and already_done(directory, entry.path):
+                    self._index[entry.path] = signature
+                elif self._index.get(entry.path) != signature and entry.path not in self._candidates:
+                    self._candidates[entry.path] = [directory, signature, time.monotonic()]
+
+    def _touch(self, directory, path):
+        if path not in self._candidates:
+            self._candidates[path] = [directory, None, time.monotonic()]
+
+    def _settled(self):
+        now = time.monotonic()
+        ready = []
+        for path, candidate in list(self._candidates.items()):
+            directory, signature, changed_at = candidate
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                del self._candidates[path]
+                continue
+            current = (stat.st_size, stat.st_mtime_ns)
+            if current != signature:
+                candidate[1], candidate[2] = current, now
+            elif now - changed_at >= self.settle_seconds:
+                del self._candidates[path]
+                if self._index.get(path) != current:
+                    self._index[path] = current
+                    ready.append((directory, path))
+        return ready
@@ -0,0 +1,266 @@
+"""Buffered DynamoDB writer built on batch_write_item.
+
+Items are collected in memory and written 25 at a time (the batch_write_item
+maximum). A buffer is flushed when it holds a full batch, when its oldest item
+reaches `flush_interval` seconds, and on close()/interpreter exit. Items that
+DynamoDB returns as UnprocessedItems are retried with exponential backoff.
+
+Items that still could not be written because of a transient failure
+(throttling, a 5xx or connection error, or UnprocessedItems after
+`max_retries`) go back to the front of the buffer and are retried on the next
+flush. flush() raises BatchWriteError while any are left, so callers only
+move a checkpoint or pointer past rows once flush() has returned. A batch
+rejected for any other reason (e.g. a ValidationException) is split in halves
+until the items DynamoDB refuses are isolated; those are dropped, appended to
+`dead_letter_path` if set, so one bad item cannot block everything behind it.
+
+The buffer holds at most `max_buffered` items. put_item() on a full buffer
+flushes first and raises BatchWriteError if that does not make room.
+
+The writer works with both boto3 interfaces: pass a low-level client to write
+typed items ({'S': ...}) or a resource to write plain Python values.
+"""
+import atexit
+import json
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict
+from itertools import count
+
+from botocore.exceptions import ClientError, HTTPClientError
+from botocore.exceptions import ConnectionError as BotocoreConnectionError
+
+from Metrics import DYNAMODB_ITEMS_DROPPED, DYNAMODB_ITEMS_WRITTEN, stage
+
+log = logging.getLogger(__name__)
+
+MAX_BATCH_SIZE = 25  # batch_write_item limit
+
+# Error codes worth retrying; other client errors are caused by the items or the request
+RETRYABLE_ERRORS = {
+    "ProvisionedThroughputExceededException", "ThrottlingException", "RequestLimitExceeded",
+    "InternalServerError", "ServiceUnavailable",
+}
+
+
+class BatchWriteError(Exception):
+    """Raised by flush() when buffered items could not be written; they stay buffered."""
+
+
+class BatchWriter:
+    """Buffer put requests for one or more tables and write them in batches."""
+
+    def __init__(self, dynamodb, flush_interval=5.0, batch_size=MAX_BATCH_SIZE, max_retries=8,
+                 base_backoff=0.05, max_backoff=5.0, overwrite_by_pkeys=None, max_buffered=10000,
+                 dead_letter_path=None):
+        """
+        Args:
+            dynamodb: boto3 DynamoDB client or resource.
+            flush_interval (float): Maximum age in seconds of a buffered item.
+            batch_size (int): Items per batch_write_item call, at most 25.
+            max_retries (int): Retries for UnprocessedItems before they are re-buffered.
+            overwrite_by_pkeys (dict): Table name -> key attribute names. A newer
+                item with the same key replaces the buffered one, as a put_item
+                would, since one batch may not contain the same key twice.
+            max_buffered (int): Items the buffer may hold before put_item() fails.
+            dead_letter_path (str): JSON-lines file for items DynamoDB rejects; None only logs them.
+        """
+        self.dynamodb = dynamodb
+        self.flush_interval = flush_interval
+        self.batch_size = min(batch_size, MAX_BATCH_SIZE)
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.overwrite_by_pkeys = overwrite_by_pkeys or {}
+        self.max_buffered = max_buffered
+        self.dead_letter_path = dead_letter_path
+
+        self._buffer = OrderedDict()  # key -> (item, buffered_at)
+        self._sequence = count()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._closed = threading.Event()
+
+        # Counters for tuning
+        self.items_written = 0
+        self.batches_written = 0
+        self.write_failures = 0  # Batches put back into the buffer
+        self.items_dropped = 0   # Rejected by DynamoDB, or still unwritten at close()
+
+        self._flusher = threading.Thread(target=self._flush_periodically, name="dynamo-batch-writer", daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+
+    def put_item(self, table_name, item):
+        """Buffer an item for `table_name`; writes a batch once a full one is buffered.
+
+        Returns the item's buffer key (see discard). Raises BatchWriteError
+        when the buffer is full and cannot be written.
+        """
+        pkeys = self.overwrite_by_pkeys.get(table_name)
+        if pkeys:
+            key = (table_name, tuple(repr(item.get(name)) for name in pkeys))
+        else:
+            key = (table_name, next(self._sequence))
+
+        with self._lock:
+            room = key in self._buffer or len(self._buffer) < self.max_buffered
+        if not room:
+            # Blocks until the buffer is written, or fails while DynamoDB keeps failing
+            self._flush(full_batches_only=False)
+            with self._lock:
+                if key not in self._buffer and len(self._buffer) >= self.max_buffered:
+                    raise BatchWriteError(f"Buffer is full with {len(self._buffer)} unwritten items")
+
+        with self._lock:
+            self._buffer.pop(key, None)
+            self._buffer[key] = (item, time.monotonic())
+            full = len(self._buffer) >= self.batch_size
+
+        if full:
+            self._flush(full_batches_only=True)
+        return key
+
+    def discard(self, keys):
+        """Remove items put_item() returned these keys for, if they are still buffered."""
+        with self._lock:
+            for key in keys:
+                self._buffer.pop(key, None)
+
+    def flush(self):
+        """Write everything buffered so far; raises BatchWriteError if items are left unwritten."""
+        if not self._flush(full_batches_only=False):
+            raise BatchWriteError(f"{len(self)} items could not be written and are still buffered")
+
+    def close(self):
+        """Stop the background flusher and write any remaining items."""
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        try:
+            self.flush()
+        except BatchWriteError as e:
+            with self._lock:
+                entries = list(self._buffer.items())
+                self._buffer.clear()
+            self._drop(entries, f"unwritten on close: {e}")
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def _flush_periodically(self):
+        while not self._closed.wait(min(1.0, self.flush_interval)):
+            with self._lock:
+                oldest = next(iter(self._buffer.values()))[1] if self._buffer else None
+            if oldest is not None and time.monotonic() - oldest >= self.flush_interval:
+                # Failed items stay buffered and are retried on the next pass
+                self._flush(full_batches_only=False)
+
+    def _flush(self, full_batches_only):
+        """Write buffered batches; False if a batch failed and was put back into the buffer."""
+        # One flusher at a time keeps writes for the same key in order
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    if not self._buffer or (full_batches_only and len(self._buffer) < self.batch_size):
+                        return True
+                    batch = [self._buffer.popitem(last=False) for _ in range(min(self.batch_size, len(self._buffer)))]
+                unwritten = self._write_batch(batch)
+                if unwritten:
+                    self._restore(unwritten)
+                    return False
+
+    def _restore(self, entries):
+        """Put unwritten entries back in front of the buffer, unless a newer item with the same key arrived."""
+        self.write_failures += 1
+        with self._lock:
+            for key, entry in reversed(entries):
+                if key in self._buffer:
+                    continue
+                self._buffer[key] = entry
+                self._buffer.move_to_end(key, last=False)
+
+    def _write_batch(self, batch):
+        """Write a batch; returns the entries that could not be written but may be retried."""
+        request_items = {}
+        for (table_name, _), (item, _) in batch:
+            request_items.setdefault(table_name, []).append({"PutRequest": {"Item": item}})
+
+        attempt = 0
+        while request_items:
+            try:
+                with stage("dynamodb_write"):
+                    response = self.dynamodb.batch_write_item(RequestItems=request_items)
+            except Exception as e:
+                unwritten = _unwritten(batch, request_items)
+                if _retryable(e):
+                    log.error(f"batch_write_item failed, keeping {len(unwritten)} items buffered: {e}")
+                    return unwritten
+                if len(unwritten) == 1:
+                    self._drop(unwritten, e)
+                    return []
+                # Write the halves separately to isolate the items DynamoDB rejects
+                middle = len(unwritten) // 2
+                return self._write_batch(unwritten[:middle]) + self._write_batch(unwritten[middle:])
+
+            unprocessed = response.get("UnprocessedItems") or {}
+            self.items_written += _count_requests(request_items) - _count_requests(unprocessed)
+            for table_name, requests in request_items.items():
+                DYNAMODB_ITEMS_WRITTEN.inc(len(requests) - len(unprocessed.get(table_name, ())), table=table_name)
+            self.batches_written += 1
+            if not unprocessed:
+                return []
+            if attempt >= self.max_retries:
+                log.error(f"Keeping {_count_requests(unprocessed)} unprocessed items buffered after {attempt} retries")
+                return _unwritten(batch, unprocessed)
+
+            time.sleep(random.uniform(0, min(self.max_backoff, self.base_backoff * (2 ** attempt))))
+            request_items = unprocessed
+            attempt += 1
+        return []
+
+    def _drop(self, entries, reason):
+        """Give up on entries: count and log them, and append them to the dead-letter file."""
+        if not entries:
+            return
+        self.items_dropped += len(entries)
+        for (table_name, _), _ in entries:
+            DYNAMODB_ITEMS_DROPPED.inc(table=table_name)
+        log.error(f"Dropping {len(entries)} items: {reason}")
+        if not self.dead_letter_path:
+            return
+        try:
+            with open(self.dead_letter_path, "a") as dead_letter_file:
+                for (table_name, _), (item, _) in entries:
+                    dead_letter_file.write(json.dumps({"Table": table_name, "Item": item}, default=str) + "\n")
+        except OSError as e:
+            log.error(f"Error writing dead-letter items: {e}")
+
+
+def _retryable(error):
+    """Whether a failed batch_write_item call may succeed when it is repeated."""
+    if isinstance(error, ClientError):
+        status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode") or 0
+        return error.response.get("Error", {}).get("Code") in RETRYABLE_ERRORS or status >= 500
+    return isinstance(error, (BotocoreConnectionError, HTTPClientError, ConnectionError))
+
+
+def _count_requests(request_items):
+    return sum(len(requests) for requests in request_items.values())
+
+
+def _unwritten(batch, request_items):
+    """Entries of `batch` whose items are among the put requests in `request_items`."""
+    remaining = {
+        table_name: [request["PutRequest"]["Item"] for request in requests]
+        for table_name, requests in request_items.items()
+    }
+    unwritten = []
+    for key, (item, buffered_at) in batch:
+        items = remaining.get(key[0], [])
+        if item in items:
+            items.remove(item)
+            unwritten.append((key, (item, buffered_at)))
+    return unwritten
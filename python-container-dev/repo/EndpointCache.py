@@ -0,0 +1,124 @@
+"""Shared TTL cache of Kinesis Video Streams data endpoints.
+
+GetDataEndpoint returns the endpoint for one stream and API (GET_MEDIA,
+PUT_MEDIA, ...), and it rarely changes. Looking it up on every start and
+reconnect adds a control-plane round trip of a few hundred milliseconds.
+EndpointCache keeps endpoints keyed by (region, stream, API name) for `ttl`
+seconds, in memory and in a JSON file shared by every script on the host (in
+a Lambda the file lives in /tmp and survives warm starts). The region comes
+from the client, since scripts pinned to different regions share the file. Callers invalidate an entry
+when connecting to its endpoint fails, so the next lookup asks KVS again.
+
+The module depends only on botocore, so it can be copied into the Lambda
+function package next to s3ToKinesis.py.
+"""
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from botocore.exceptions import ConnectionError as BotocoreConnectionError
+
+log = logging.getLogger(__name__)
+
+ENDPOINT_CACHE_PATH = os.environ.get(
+    "KVS_ENDPOINT_CACHE_PATH", os.path.join(tempfile.gettempdir(), "kvs_endpoints.json")
+)
+ENDPOINT_TTL_SECONDS = float(os.environ.get("KVS_ENDPOINT_TTL_SECONDS", "3600"))
+
+# Errors after which a cached endpoint is dropped (endpoint unreachable, connection reset, ...)
+CONNECTION_ERRORS = (BotocoreConnectionError, ConnectionError)
+
+
+class EndpointCache:
+    """Resolve KVS data endpoints through an in-memory and on-disk TTL cache."""
+
+    def __init__(self, kvs_client, path=ENDPOINT_CACHE_PATH, ttl=ENDPOINT_TTL_SECONDS):
+        """
+        Args:
+            kvs_client: boto3 "kinesisvideo" client used on a cache miss.
+            path (str): JSON file shared between processes; empty keeps the cache in memory.
+            ttl (float): Seconds an endpoint is used before it is looked up again.
+        """
+        self.kvs_client = kvs_client
+        self.region = kvs_client.meta.region_name
+        self.path = path
+        self.ttl = ttl
+        self._entries = self._load()  # "region|stream|api" -> {"endpoint", "expires_at"}
+        self._lock = threading.Lock()
+
+        # Counters for tuning
+        self.hits = 0
+        self.lookups = 0
+        self.invalidations = 0
+
+    def get(self, stream_name, api_name):
+        """Endpoint URL for an API of a stream, from the cache when it has not expired."""
+        key = _key(self.region, stream_name, api_name)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry["expires_at"] <= time.time():
+                # Another process may have looked it up in the meantime
+                entry = self._load().get(key)
+            if entry is not None and entry["expires_at"] > time.time():
+                self._entries[key] = entry
+                self.hits += 1
+                return entry["endpoint"]
+
+        response = self.kvs_client.get_data_endpoint(StreamName=stream_name, APIName=api_name)
+        endpoint = response["DataEndpoint"]
+        with self._lock:
+            self.lookups += 1
+            self._entries[key] = {"endpoint": endpoint, "expires_at": time.time() + self.ttl}
+            self._save(key)
+        log.info(f"Resolved {api_name} endpoint for {stream_name}: {endpoint}")
+        return endpoint
+
+    def invalidate(self, stream_name, api_name):
+        """Forget the endpoint of a stream and API, e.g. after failing to connect to it."""
+        key = _key(self.region, stream_name, api_name)
+        with self._lock:
+            self.invalidations += 1
+            self._entries.pop(key, None)
+            self._save(key)
+        log.info(f"Invalidated {api_name} endpoint for {stream_name}")
+
+    def stats(self):
+        return {"hits": self.hits, "lookups": self.lookups, "invalidations": self.invalidations}
+
+    def _load(self):
+        if not self.path:
+            return {}
+        try:
+            with open(self.path) as cache_file:
+                return json.load(cache_file)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, key):
+        """Write one entry (or its removal) into the shared file, keeping the other processes' entries."""
+        if not self.path:
+            return
+        entries = self._load()
+        if key in self._entries:
+            entries[key] = self._entries[key]
+        else:
+            entries.pop(key, None)
+        now = time.time()
+        entries = {name: entry for name, entry in entries.items() if entry["expires_at"] > now}
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temporary = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temporary, "w") as cache_file:
+                json.dump(entries, cache_file)
+            os.replace(temporary, self.path)
+        except OSError as e:
+            log.error(f"Error saving endpoint cache {self.path}: {e}")
+
+
+def _key(region, stream_name, api_name):
+    return f"{region}|{stream_name}|{api_name}"
@@ -0,0 +1,93 @@
+"""Frame preparation for Rekognition uploads.
+
+Frames are downscaled before encoding: to bring the smallest known face down
+to `target_face_px` (Rekognition needs roughly 40-50 px faces; more detail
+only costs upload time), and in any case to at most `max_dimension` pixels on
+the longest side. The JPEG quality is then chosen as the highest one whose
+output fits in `max_bytes`, found by binary search between `min_quality` and
+`max_quality`. If even `min_quality` does not fit, the frame is shrunk further,
+but not below `min_dimension` pixels on the shortest side; a budget that
+small raises ValueError.
+"""
+import cv2
+
+from Metrics import stage
+
+# Face attribute groups the aggregators read (AgeRange, Gender, Emotions).
+# BoundingBox, Confidence, Landmarks, Pose and Quality are always returned.
+DETECT_FACES_ATTRIBUTES = ["AGE_RANGE", "GENDER", "EMOTIONS"]
+
+# Rekognition rejects image bytes above 5 MB, and images below 80x80 pixels
+REKOGNITION_MAX_BYTES = 5 * 1024 * 1024
+REKOGNITION_MIN_DIMENSION = 80
+
+
+class FrameEncoder:
+    """Downscale and JPEG-encode BGR frames to fit an upload byte budget."""
+
+    def __init__(self, target_face_px=80, max_dimension=1280, max_bytes=200 * 1024,
+                 min_quality=40, max_quality=90, min_dimension=REKOGNITION_MIN_DIMENSION):
+        """
+        Args:
+            target_face_px (int): Size the smallest detected face is scaled down to.
+            max_dimension (int): Longest side of an uploaded frame in pixels.
+            max_bytes (int): Byte budget for one encoded frame.
+            min_quality (int): Lowest JPEG quality tried before downscaling further.
+            max_quality (int): JPEG quality used when it already fits the budget.
+            min_dimension (int): Shortest side the frame is shrunk to at most, to fit the budget.
+        """
+        self.target_face_px = target_face_px
+        self.max_dimension = max_dimension
+        self.max_bytes = min(max_bytes, REKOGNITION_MAX_BYTES)
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self.min_dimension = min_dimension
+
+    def encode(self, frame, face_boxes=None):
+        """Return JPEG bytes for a BGR frame; `face_boxes` are (x, y, w, h) of known faces."""
+        with stage("encode"):
+            return self._encode(frame, face_boxes)
+
+    def _encode(self, frame, face_boxes):
+        height, width = frame.shape[:2]
+        scale = min(1.0, self.max_dimension / float(max(height, width)))
+        if face_boxes:
+            smallest_face = min(min(w, h) for x, y, w, h in face_boxes)
+            if smallest_face > 0:
+                scale = min(scale, self.target_face_px / float(smallest_face))
+
+        while True:
+            resized = frame if scale >= 1.0 else cv2.resize(
+                frame, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA
+            )
+            encoded = self._encode_within_budget(resized)
+            if encoded is not None:
+                return encoded
+            # Even the lowest quality is over budget, shrink the frame and retry
+            scale *= 0.75
+            if min(height, width) * scale < self.min_dimension:
+                raise ValueError(
+                    f"Frame does not fit in {self.max_bytes} bytes at {self.min_dimension} px or more"
+                )
+
+    def _encode_within_budget(self, frame):
+        best = _jpeg(frame, self.max_quality)
+        if len(best) <= self.max_bytes:
+            return best
+
+        low, high, best = self.min_quality, self.max_quality - 1, None
+        while low <= high:
+            quality = (low + high) // 2
+            encoded = _jpeg(frame, quality)
+            if len(encoded) <= self.max_bytes:
+                best, low = encoded, quality + 1
+            else:
+                high = quality - 1
+        return best
+
+
+def _jpeg(frame, quality):
+    ok, buffer = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("Could not encode frame as JPEG")
+    return buffer.tobytes()
@@ -0,0 +1,45 @@
+"""Frame sampling for ProcessVI video files.
+
+Only the frames that are actually analyzed get decoded into BGR images. The
+frames in between are skipped by advancing the demuxer with grab(), by seeking
+straight to the next sample timestamp, or (keyframe mode) by telling the codec
+to drop every non-key frame before it is decoded at all. Decoding itself is
+done by one of the backends in DecodeBackend.
+"""
+import av
+import cv2
+
+from DecodeBackend import get_decode_backend
+
+SAMPLING_MODES = ("grab", "seek", "keyframe")
+
+
+def sample_frames(file_path, interval_seconds=10, mode="grab", start_ms=0, end_ms=None, backend="opencv", threads=0):
+    """Yield (frame_index, position_ms, frame) for one BGR frame per sampling interval.
+
+    `start_ms` skips straight to a position in the file (used to resume a
+    video or to start a segment); samples stay on the same interval grid as a
+    run from the start. Sampling stops at the first grid point at or after
+    `end_ms`, so adjacent segments never sample the same point twice.
+    `backend` is "opencv" or "pyav", and `threads` its decode thread cap.
+    """
+    if mode not in SAMPLING_MODES:
+        raise ValueError(f"Unknown sampling mode {mode!r}, expected one of {SAMPLING_MODES}")
+    return get_decode_backend(backend, threads).sample(file_path, interval_seconds, mode, start_ms, end_ms)
+
+
+def video_duration_ms(file_path):
+    """Length of a video in milliseconds, or None if the container does not say."""
+    cap = cv2.VideoCapture(file_path)
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        frame_count = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+        if fps > 0 and frame_count > 0:
+            return frame_count * 1000.0 / fps
+    finally:
+        cap.release()
+
+    with av.open(file_path) as container:
+        if container.duration:
+            return container.duration / 1000.0  # av.time_base is microseconds
+    return None
@@ -15,6 +15,11 @@ import sys
 import time
 import boto3
 import logging
+from DecodeBackend import get_decode_backend
+from DynamoBatchWriter import BatchWriteError, BatchWriter
+from CheckpointCommitter import CheckpointCommitter
+from EndpointCache import CONNECTION_ERRORS, EndpointCache
+from Metrics import S3_BYTES_UPLOADED, stage
 from amazon_kinesis_video_consumer_library.kinesis_video_streams_parser import KvsConsumerLibrary
 from amazon_kinesis_video_consumer_library.kinesis_video_fragment_processor import KvsFragementProcessor
 
@@ -28,6 +33,12 @@ logging.basicConfig(format="[%(name)s.%(funcName)s():%(lineno)d] - [%(levelname)
 REGION='eu-west-1'
 KVS_STREAM01_NAME = 'video-stream-1'   # Stream must be in specified region
 
+# Backend that decodes fragment frames: pyav (in memory, threaded) or opencv (via a temp file)
+DECODE_BACKEND = os.environ.get('DECODE_BACKEND', 'opencv')
+
+# Seconds between commits of the ProcessedFragments pointer (see CheckpointCommitter)
+CHECKPOINT_INTERVAL_SECONDS = float(os.environ.get('CHECKPOINT_INTERVAL_SECONDS', '10'))
+
 
 class KvsPythonConsumerExample:
     '''
@@ -46,6 +57,7 @@ class KvsPythonConsumerExample:
 
         # Create shared instance of KvsFragementProcessor
         self.kvs_fragment_processor = KvsFragementProcessor()
+        self.decode_backend = get_decode_backend(DECODE_BACKEND)
 
         # Variable to maintaun state of last good fragememt mostly for error and exception handling.
         self.last_good_fragment_tags = None
@@ -55,6 +67,7 @@ class KvsPythonConsumerExample:
         # Attach session specific configuration (such as the authentication pattern)
         self.session = boto3.Session(region_name=REGION)
         self.kvs_client = self.session.client("kinesisvideo")
+        self.endpoint_cache = EndpointCache(self.kvs_client)  # KVS data endpoints, shared with the other scripts
 
         # Initialize DynamoDB and S3 clients
         self.dynamodb_client = self.session.client('dynamodb')
@@ -62,6 +75,23 @@ class KvsPythonConsumerExample:
         self.dynamodb_table_name = 'FragmentAnalyticsData'
         self.s3_bucket_name = 'veer-processed-videos-bucket'
 
+        # Fragment rows are buffered and written with batch_write_item. Rows that share
+        # a key collapse to the latest one.
+        self.analytics_writer = BatchWriter(
+            self.dynamodb_client,
+            overwrite_by_pkeys={self.dynamodb_table_name: ['PK', 'SK']}
+        )
+
+        # The ProcessedFragments pointer is committed at most once per interval, only
+        # forward, and only after the fragment rows it covers have been written.
+        self.checkpoint_committer = CheckpointCommitter(
+            self.dynamodb_client,
+            self.dynamodb_table_name,
+            lambda stream_name: {'PK': {'S': 'ProcessedFragments'}, 'SK': {'S': 'ProcessedFragments'}},
+            interval=CHECKPOINT_INTERVAL_SECONDS,
+            before_commit=self.analytics_writer.flush
+        )
+
     ####################################################
     # Main process loop
     def service_loop(self):
@@ -69,22 +99,9 @@ class KvsPythonConsumerExample:
         ####################################################
         # Start an instance of the KvsConsumerLibrary reading in a Kinesis Video Stream
 
-        # Get the KVS Endpoint for the GetMedia Call for this stream
-        log.info(f'Getting KVS GetMedia Endpoint for stream: {KVS_STREAM01_NAME} ........') 
-        get_media_endpoint = self._get_data_endpoint(KVS_STREAM01_NAME, 'GET_MEDIA')
-        
-        # Get the KVS Media client for the GetMedia API call
-        log.info(f'Initializing KVS Media client for stream: {KVS_STREAM01_NAME}........') 
-        kvs_media_client = self.session.client('kinesis-video-media', endpoint_url=get_media_endpoint)
-
         # Make a KVS GetMedia API call with the desired KVS stream and StartSelector type and time bounding.
         log.info(f'Requesting KVS GetMedia Response for stream: {KVS_STREAM01_NAME}........') 
-        get_media_response = kvs_media_client.get_media(
-            StreamName=KVS_STREAM01_NAME,
-            StartSelector={
-                'StartSelectorType': 'NOW'
-            }
-        )
+        get_media_response = self._get_media(KVS_STREAM01_NAME, {'StartSelectorType': 'NOW'})
 
         # Initialize an instance of the KvsConsumerLibrary, provide the GetMedia response and the required call-backs
         log.info(f'Starting KvsConsumerLibrary for stream: {KVS_STREAM01_NAME}........') 
@@ -210,9 +227,9 @@ class KvsPythonConsumerExample:
             timestamp_iso = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
 
             # Store fragment tags in DynamoDB with TTL and ISO timestamp as SK
-            self.dynamodb_client.put_item(
-                TableName=self.dynamodb_table_name,
-                Item={
+            self.analytics_writer.put_item(
+                self.dynamodb_table_name,
+                {
                     'PK': {'S': timestamp_iso},
                     'FragmentNumber': {'S': self.last_good_fragment_tags['AWS_KINESISVIDEO_FRAGMENT_NUMBER']},
                     'FragmentTags': {'S': str(self.last_good_fragment_tags)},
@@ -220,14 +237,12 @@ class KvsPythonConsumerExample:
                     'TTL': {'N': str(ttl)}
                 }
             )
-            # Store fragment tags in DynamoDB with TTL
-            self.dynamodb_client.put_item(
-                TableName=self.dynamodb_table_name,
-                Item={
-                    'PK': {'S': 'ProcessedFragments'},
-                    'FragmentNumber': {'S': self.last_good_fragment_tags['AWS_KINESISVIDEO_FRAGMENT_NUMBER']},
+            # Advance the ProcessedFragments pointer, with the fragment tags and TTL
+            self.checkpoint_committer.advance(
+                stream_name,
+                self.last_good_fragment_tags['AWS_KINESISVIDEO_FRAGMENT_NUMBER'],
+                {
                     'FragmentTags': {'S': str(self.last_good_fragment_tags)},
-                    'SK': {'S': 'ProcessedFragments'},
                     'TTL': {'N': str(ttl)}
                 }
             )
@@ -235,11 +250,13 @@ class KvsPythonConsumerExample:
             # Save the Fragment to S3 as standalone MKV file
             frag_file_name = self.last_good_fragment_tags['AWS_KINESISVIDEO_FRAGMENT_NUMBER'] + '.mkv'
             mkv_s3_key = f'mkv/{frag_file_name}'
-            self.s3_client.put_object(
-                Bucket=self.s3_bucket_name,
-                Key=mkv_s3_key,
-                Body=fragment_bytes
-            )
+            with stage('s3_upload'):
+                self.s3_client.put_object(
+                    Bucket=self.s3_bucket_name,
+                    Key=mkv_s3_key,
+                    Body=fragment_bytes
+                )
+            S3_BYTES_UPLOADED.inc(len(fragment_bytes))
 
             # Save Frames from Fragment to S3 as JPGs
             one_in_frames_ratio = 5
@@ -247,12 +264,13 @@ class KvsPythonConsumerExample:
             jpg_s3_key_base = f'jpg/{jpg_file_base_name}/'
             jpeg_paths = self.kvs_fragment_processor.save_frames_as_jpeg(fragment_bytes, one_in_frames_ratio, '/tmp/')
             for i, jpeg_path in enumerate(jpeg_paths):
-                with open(jpeg_path, 'rb') as jpeg_file:
+                with open(jpeg_path, 'rb') as jpeg_file, stage('s3_upload'):
                     self.s3_client.put_object(
                         Bucket=self.s3_bucket_name,
                         Key=jpg_s3_key_base + f'frame-{i}.jpg',
                         Body=jpeg_file
                     )
+                S3_BYTES_UPLOADED.inc(os.path.getsize(jpeg_path))
 
             ###########################################
             # 4) Extract Frames from Fragment as ndarrays:
@@ -263,7 +281,8 @@ class KvsPythonConsumerExample:
             one_in_frames_ratio = 5
             log.info('')
             log.info(f'#######  Reading 1 in {one_in_frames_ratio} Frames from fragment as ndarray:')
-            ndarray_frames = self.kvs_fragment_processor.get_frames_as_ndarray(fragment_bytes, one_in_frames_ratio)
+            with stage('decode'):
+                ndarray_frames = self.decode_backend.fragment_frames(fragment_bytes, one_in_frames_ratio)
             for i in range(len(ndarray_frames)):
                 ndarray_frame = ndarray_frames[i]
                 log.info(f'Frame-{i} Shape: {ndarray_frame.shape}')
@@ -328,6 +347,7 @@ class KvsPythonConsumerExample:
         '''
 
         # Do something here to tell the application that reading from the stream ended gracefully.
+        self._flush_fragments()
         print(f'Read Media on stream: {stream_name} Completed successfully - Last Fragment Tags: {self.last_good_fragment_tags}')
 
     def on_stream_read_exception(self, stream_name, error):
@@ -356,20 +376,51 @@ class KvsPythonConsumerExample:
         #    'AfterFragmentNumber': self.last_good_fragment_tags['AWS_KINESISVIDEO_CONTINUATION_TOKEN'],
         #}
 
-        # Here we just log the error 
+        # Here we just log the error and write out what was buffered before it
+        if isinstance(error, CONNECTION_ERRORS):
+            # Resolve the endpoint again when the stream is restarted
+            self.endpoint_cache.invalidate(stream_name, 'GET_MEDIA')
+        self._flush_fragments()
         print(f'####### ERROR: Exception on read stream: {stream_name}\n####### Fragment Tags:\n{self.last_good_fragment_tags}\nError Message:{error}')
 
+    def _flush_fragments(self):
+        '''
+        Write the buffered fragment rows, then commit the ProcessedFragments pointer.
+        The pointer is left where it is if rows could not be written.
+        '''
+        try:
+            self.analytics_writer.flush()
+            self.checkpoint_committer.flush()
+        except BatchWriteError as err:
+            log.error(f'Fragment rows not written, ProcessedFragments not advanced: {err}')
+
     ####################################################
     # KVS Helpers
     def _get_data_endpoint(self, stream_name, api_name):
         '''
-        Convenience method to get the KVS client endpoint for specific API calls. 
+        Convenience method to get the KVS client endpoint for specific API calls (cached, see EndpointCache).
         '''
-        response = self.kvs_client.get_data_endpoint(
-            StreamName=stream_name,
-            APIName=api_name
-        )
-        return response['DataEndpoint']
+        return self.endpoint_cache.get(stream_name, api_name)
+
+    def _get_media(self, stream_name, start_selector):
+        '''
+        GetMedia call on the stream's cached endpoint. If the endpoint can't be reached
+        it is resolved again and the call retried once.
+        '''
+        for attempt in range(2):
+            # Get the KVS Endpoint for the GetMedia Call for this stream
+            log.info(f'Getting KVS GetMedia Endpoint for stream: {stream_name} ........')
+            get_media_endpoint = self._get_data_endpoint(stream_name, 'GET_MEDIA')
+
+            # Get the KVS Media client for the GetMedia API call
+            log.info(f'Initializing KVS Media client for stream: {stream_name}........')
+            kvs_media_client = self.session.client('kinesis-video-media', endpoint_url=get_media_endpoint)
+            try:
+                return kvs_media_client.get_media(StreamName=stream_name, StartSelector=start_selector)
+            except CONNECTION_ERRORS:
+                self.endpoint_cache.invalidate(stream_name, 'GET_MEDIA')
+                if attempt:
+                    raise
 
 if __name__ == "__main__":
     '''
@@ -1,27 +1,62 @@
 import boto3
+import os
 import time
 import json
-import uuid
 from botocore.exceptions import ClientError
+from CheckpointCommitter import CheckpointCommitter
+from DecodeBackend import get_decode_backend
+from EndpointCache import CONNECTION_ERRORS, EndpointCache
+from Metrics import DYNAMODB_ITEMS_WRITTEN, stage
+from MotionGate import MotionGate
+from RekognitionDispatcher import NO_RETRY_CONFIG, RekognitionDispatcher
 
 # Initialize clients
 kinesis_video_client = boto3.client('kinesisvideo', region_name='eu-west-1')
 kinesis_video_media_client = None
-rekognition_client = boto3.client('rekognition', region_name='eu-west-1')
+endpoint_cache = EndpointCache(kinesis_video_client)  # KVS data endpoints, shared with the other scripts
+rekognition_client = boto3.client('rekognition', region_name='eu-west-1', config=NO_RETRY_CONFIG)
+rekognition_dispatcher = RekognitionDispatcher(rekognition_client)  # Handles throttling and concurrency
 dynamodb_client = boto3.client('dynamodb', region_name='eu-west-1')
 
 # DynamoDB table to store the processed data
 DYNAMODB_TABLE = 'FragmentAnalyticsData'
 
+# The ProcessedFragments pointer is committed at most once per interval, and only forward
+PROCESSED_FRAGMENTS_KEY = {'PK': {'S': 'ProcessedFragments'}, 'SK': {'S': 'ProcessedFragments'}}
+CHECKPOINT_INTERVAL_SECONDS = float(os.environ.get('CHECKPOINT_INTERVAL_SECONDS', '10'))
+checkpoint_committer = CheckpointCommitter(
+    dynamodb_client, DYNAMODB_TABLE, lambda stream_name: PROCESSED_FRAGMENTS_KEY,
+    interval=CHECKPOINT_INTERVAL_SECONDS
+)
+
+# A fragment whose sampled frames show the same scene as the last analyzed one reuses
+# its analytics instead of starting another Rekognition job (0 disables)
+MOTION_THRESHOLD = float(os.environ.get('MOTION_THRESHOLD', '0.01'))
+FRAGMENT_SAMPLE_RATIO = 5  # Every 5th frame of a fragment is compared
+motion_gate = MotionGate(MOTION_THRESHOLD)
+decode_backend = get_decode_backend(os.environ.get('DECODE_BACKEND', 'opencv'))
+
+# Optional hourly Parquet copy of the analytics: s3://bucket/prefix or a local directory.
+# pyarrow (requirements-parquet.txt) is only needed when it is enabled.
+ANALYTICS_PARQUET_URL = os.environ.get('ANALYTICS_PARQUET_URL', '')
+parquet_sink = None
+if ANALYTICS_PARQUET_URL:
+    import pyarrow as pa
+    from ParquetSink import ParquetSink
+
+    ANALYTICS_SCHEMA = pa.schema([
+        ('fragment_number', pa.string()),
+        ('age_group', pa.string()),
+        ('sex', pa.string()),
+        ('mood', pa.string()),
+    ])
+    parquet_sink = ParquetSink(ANALYTICS_PARQUET_URL, ANALYTICS_SCHEMA, boto3.client('s3', region_name='eu-west-1'))
+
 # Function to get Kinesis Video Stream media client
 def get_media_client(stream_name):
     global kinesis_video_media_client
     try:
-        response = kinesis_video_client.get_data_endpoint(
-            StreamName=stream_name,
-            APIName='GET_MEDIA'
-        )
-        endpoint_url = response['DataEndpoint']
+        endpoint_url = endpoint_cache.get(stream_name, 'GET_MEDIA')
         kinesis_video_media_client = boto3.client('kinesis-video-media', endpoint_url=endpoint_url, region_name='eu-west-1')
     except Exception as e:
         print(f"Error getting media client: {e}")
@@ -97,6 +132,12 @@ def get_fragment_number_and_data(stream_name, start_selector=None):
 
         return fragment_number, fragment_data
 
+    except CONNECTION_ERRORS as e:
+        # The endpoint may have moved; resolve it again on the next attempt
+        print(f"Error connecting to the media endpoint: {e}")
+        endpoint_cache.invalidate(stream_name, 'GET_MEDIA')
+        kinesis_video_media_client = None
+        return None, None
     except Exception as e:
         print(f"Error retrieving fragment: {e}")
         return None, None
@@ -127,10 +168,33 @@ def list_fragments(stream_name):
         return None
 
 
+# Function to check whether a fragment shows a different scene than the last analyzed one
+def fragment_changed(fragment_bytes):
+    """
+    Runs the sampled frames of a fragment through the motion gate.
+
+    Returns:
+        bool: True if any frame changed enough, or if the fragment could not be decoded.
+    """
+    if MOTION_THRESHOLD <= 0:
+        return True
+    try:
+        with stage('decode'):
+            frames = decode_backend.fragment_frames(fragment_bytes, FRAGMENT_SAMPLE_RATIO)
+    except Exception as e:
+        print(f"Error decoding fragment for the motion gate: {e}")
+        return True
+    changed = not frames
+    for frame in frames:
+        # Every frame goes through the gate, so the reference is the last one that changed
+        changed = motion_gate.should_analyze(frame) or changed
+    return changed
+
 # Function to call Rekognition to process video data (e.g., face analysis, labels)
 def analyze_video_with_rekognition(video_stream):
     try:
-        response = rekognition_client.start_faces_detection(
+        response = rekognition_dispatcher.call(
+            'start_faces_detection',
             Video={'Bytes': video_stream},
             # NotificationChannel={'RoleArn': 'arn:aws:iam::your-account-id:role/rekognition-role', 'SNSTopicArn': 'arn:aws:sns:us-east-1:your-account-id:rekognition-topic'}
         )
@@ -143,14 +207,14 @@ def analyze_video_with_rekognition(video_stream):
 # Function to get the Rekognition analysis results
 def get_rekognition_results(job_id):
     try:
-        response = rekognition_client.get_faces_detection(JobId=job_id)
+        response = rekognition_dispatcher.call('get_faces_detection', JobId=job_id)
         return response['Faces']
     except ClientError as e:
         print(f"Error getting Rekognition results: {e}")
         return None
 
 # Function to store analytics data in DynamoDB
-def store_analytics_data(fragment_number, analytics_data):
+def store_analytics_data(fragment_number, analytics_data, stream_name=None):
     try:
         # Format analytics data for DynamoDB
         item = {
@@ -160,10 +224,14 @@ def store_analytics_data(fragment_number, analytics_data):
         }
 
         # Store the data in DynamoDB
-        dynamodb_client.put_item(
-            TableName=DYNAMODB_TABLE,
-            Item=item
-        )
+        with stage('dynamodb_write'):
+            dynamodb_client.put_item(
+                TableName=DYNAMODB_TABLE,
+                Item=item
+            )
+        DYNAMODB_ITEMS_WRITTEN.inc(table=DYNAMODB_TABLE)
+        if parquet_sink is not None:
+            parquet_sink.put(stream_name or 'unknown', dict(analytics_data, fragment_number=str(fragment_number)))
         print(f"Stored analytics data for fragment: {fragment_number}")
     except ClientError as e:
         print(f"Error storing analytics data in DynamoDB: {e}")
@@ -222,30 +290,44 @@ def process_video_stream(stream_name, start_timestamp=None):
         start_selector = {'StartSelectorType': 'NOW'}
 
     # Continuously process the stream
+    last_analytics_data = None
     while True:
         # Retrieve the fragment and its data
         fragment_number, fragment_data = get_fragment_number_and_data(stream_name, start_selector)
         
-        if fragment_data:
-            # Analyze the fragment with Rekognition
-            job_id = analyze_video_with_rekognition(fragment_data)
-            if job_id:
-                print(f"Analyzing fragment: {fragment_number} with Rekognition Job ID: {job_id}")
-
-                # Wait for the Rekognition results
-                time.sleep(10)  # Adjust the sleep time for your processing
-                results = get_rekognition_results(job_id)
-
-                # Extract analytics data (e.g., age, sex, mood, etc.)
-                analytics_data = extract_analytics_data(results)
-
-                # Store the analytics data in DynamoDB
-                store_analytics_data(fragment_number, analytics_data)
-                update_last_processed_fragment(fragment_number)
-                # Update start_selector to the next fragment for continuous processing
-                start_selector = {'StartSelectorType': 'FRAGMENT_NUMBER', 'FragmentNumber': str(int(fragment_number) + 1)}
-
-        time.sleep(5)  # Adjust the polling interval as necessary
+        if not fragment_data:
+            time.sleep(5)  # No new fragment yet; adjust the polling interval as necessary
+            continue
+
+        fragment_bytes = fragment_data.read() if hasattr(fragment_data, 'read') else fragment_data
+        if not fragment_changed(fragment_bytes) and last_analytics_data is not None:
+            # Same scene as the last analyzed fragment, no Rekognition job needed; go straight to the next one
+            print(f"Fragment {fragment_number} unchanged, reusing the last analytics ({motion_gate.stats()})")
+            store_analytics_data(fragment_number, last_analytics_data, stream_name)
+            update_last_processed_fragment(fragment_number)
+            start_selector = {'StartSelectorType': 'FRAGMENT_NUMBER', 'FragmentNumber': str(int(fragment_number) + 1)}
+            continue
+
+        # Analyze the fragment with Rekognition
+        job_id = analyze_video_with_rekognition(fragment_bytes)
+        if not job_id:
+            time.sleep(5)  # Retry the same fragment after a pause
+            continue
+        print(f"Analyzing fragment: {fragment_number} with Rekognition Job ID: {job_id}")
+
+        # Wait for the Rekognition results
+        time.sleep(10)  # Adjust the sleep time for your processing
+        results = get_rekognition_results(job_id)
+
+        # Extract analytics data (e.g., age, sex, mood, etc.)
+        analytics_data = extract_analytics_data(results)
+        last_analytics_data = analytics_data
+
+        # Store the analytics data in DynamoDB
+        store_analytics_data(fragment_number, analytics_data, stream_name)
+        update_last_processed_fragment(fragment_number)
+        # Update start_selector to the next fragment for continuous processing
+        start_selector = {'StartSelectorType': 'FRAGMENT_NUMBER', 'FragmentNumber': str(int(fragment_number) + 1)}
 
 # Example function to extract analytics data (simplified)
 def extract_analytics_data(results):
@@ -268,35 +350,26 @@ def extract_analytics_data(results):
 
 def update_last_processed_fragment(fragment_number):
     """
-    Updates the last processed fragment information in DynamoDB.
+    Advances the last processed fragment; checkpoint_committer writes it to DynamoDB.
 
     Parameters:
         fragment_number (str): The fragment number to update in the table.
 
     Returns:
-        bool: True if the update was successful, False otherwise.
+        bool: True if the fragment number was accepted, False otherwise.
     """
     try:
         # Current timestamp
         current_timestamp = int(time.time())
 
-        # Item to update in DynamoDB
-        item = {
-            'PK': {'S': 'ProcessedFragments'},
-            'SK': {'S': 'ProcessedFragments'},
-            'FragmentNumber': {'S': fragment_number},
-            'Timestamp': {'N': str(current_timestamp)}
-        }
-
-        # Put the item into the table
-        dynamodb_client.put_item(
-            TableName=DYNAMODB_TABLE,
-            Item=item
+        checkpoint_committer.advance(
+            'ProcessedFragments',
+            fragment_number,
+            {'Timestamp': {'N': str(current_timestamp)}}
         )
-        print(f"Successfully updated fragment number {fragment_number} in DynamoDB.")
         return True
 
-    except ClientError as e:
+    except ValueError as e:
         print(f"Error updating fragment number in DynamoDB: {e}")
         return False
     
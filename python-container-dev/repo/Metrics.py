@@ -0,0 +1,380 @@
+"""Hot-path counters and histograms in Prometheus text format.
+
+The metrics are plain in-process objects: an observation is a bisect into
+the bucket bounds and a few additions under a lock, so instrumenting every
+frame costs next to nothing. There is no prometheus_client dependency.
+
+ProcessVI and the KVS consumers run in other processes (and pool workers)
+than the Flask app that serves /metrics. With METRICS_DIR set, every process
+writes a JSON snapshot of its metrics to METRICS_DIR/metrics-<pid>-<start>.json
+every few seconds, and render() adds all snapshots in the directory to the
+local values. <start> is the process start time, so a reused pid gets a new
+file. When render() finds the snapshot of a process that is no longer
+running, it folds the counters and histograms into metrics-exited.json and
+deletes the snapshot: totals keep counting the work of exited processes, and
+their gauges are dropped.
+"""
+import bisect
+import fcntl
+import glob
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+METRICS_DIR = os.environ.get("METRICS_DIR", "")
+SNAPSHOT_INTERVAL_SECONDS = 10
+SNAPSHOT_NAME = re.compile(r"metrics-(\d+)(?:-(\d+))?\.json")  # Without a start time: from an older version
+EXITED_SNAPSHOT = "metrics-exited.json"
+EXITED_LOCK = ".metrics-exited.lock"
+
+# Seconds; from fast in-memory encodes up to slow network calls with retries
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter:
+    """A monotonically increasing value per label set."""
+
+    type = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labels, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return {json.dumps(key): value for key, value in self._values.items()}
+
+    def samples(self, values):
+        for key, value in sorted(values.items()):
+            yield self.name + "_total", key, value
+
+
+class Gauge(Counter):
+    """A value per label set that can go up and down.
+
+    Snapshots of several processes are added up like counters, so label sets
+    should be owned by one process (a stream is supervised by one process).
+    """
+
+    type = "gauge"
+
+    def set(self, value, **labels):
+        key = _label_key(self.labels, labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self, values):
+        for key, value in sorted(values.items()):
+            yield self.name, key, value
+
+
+class Histogram:
+    """Observation counts per bucket plus their sum, per label set."""
+
+    type = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}  # label key -> [count per bucket (+Inf last), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labels, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of a with-block, also when it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def time_iter(self, iterable, **labels):
+        """Yield from `iterable`, observing how long each item took to produce."""
+        iterator = iter(iterable)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.observe(time.perf_counter() - started, **labels)
+            yield item
+
+    def snapshot(self):
+        with self._lock:
+            return {json.dumps(key): [list(counts), total] for key, (counts, total) in self._values.items()}
+
+    def samples(self, values):
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield self.name + "_bucket", key + (("le", le),), cumulative
+            yield self.name + "_sum", key, total
+            yield self.name + "_count", key, cumulative
+
+
+class Registry:
+    """The set of metrics a process exposes."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def snapshot(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+    def render(self, directory=METRICS_DIR):
+        """Prometheus text exposition of this process's metrics plus the snapshots in `directory`."""
+        merged = {name: _decode(values) for name, values in self.snapshot().items()}
+        with self._lock:
+            metrics = dict(self._metrics)
+        if directory:
+            own = _snapshot_path(directory)
+            for path in glob.glob(os.path.join(directory, "metrics-*.json")):
+                match = SNAPSHOT_NAME.fullmatch(os.path.basename(path))
+                if path == own or match is None:
+                    continue
+                if not _running(int(match.group(1)), match.group(2) and int(match.group(2))):
+                    self._fold_exited(directory, path, metrics)
+                    continue
+                snapshot = _load(path)
+                for name, values in (snapshot or {}).items():
+                    _merge(merged.setdefault(name, {}), _decode(values))
+            for name, values in (_load(os.path.join(directory, EXITED_SNAPSHOT)) or {}).items():
+                _merge(merged.setdefault(name, {}), _decode(values))
+
+        lines = []
+        for name, values in sorted(merged.items()):
+            metric = metrics.get(name)
+            if metric is None:
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for sample_name, key, value in metric.samples(values):
+                lines.append(f"{sample_name}{_format_labels(key)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def write_snapshot(self, directory=METRICS_DIR):
+        """Atomically write this process's snapshot into `directory`."""
+        if not directory:
+            return
+        os.makedirs(directory, exist_ok=True)
+        _write(_snapshot_path(directory), self.snapshot())
+
+    def _fold_exited(self, directory, path, metrics):
+        """Add an exited process's counters and histograms to the exited snapshot and delete its file."""
+        with open(os.path.join(directory, EXITED_LOCK), "w") as lock_file:
+            # Renderers in several processes may find the same exited snapshot
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            snapshot = _load(path)
+            if snapshot is None:
+                if not os.path.exists(path):
+                    return  # Folded by another renderer
+                snapshot = {}  # Unreadable; dropped
+            exited_path = os.path.join(directory, EXITED_SNAPSHOT)
+            exited = {name: _decode(values) for name, values in (_load(exited_path) or {}).items()}
+            for name, values in snapshot.items():
+                metric = metrics.get(name)
+                if metric is not None and metric.type == "gauge":
+                    continue
+                _merge(exited.setdefault(name, {}), _decode(values))
+            _write(exited_path, {name: _encode(values) for name, values in exited.items()})
+            os.remove(path)
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help_text, labels=()):
+    return REGISTRY.register(Counter(name, help_text, labels))
+
+
+def gauge(name, help_text, labels=()):
+    return REGISTRY.register(Gauge(name, help_text, labels))
+
+
+def histogram(name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, help_text, labels, buckets))
+
+
+def render(directory=METRICS_DIR):
+    return REGISTRY.render(directory)
+
+
+def write_snapshot(directory=METRICS_DIR):
+    REGISTRY.write_snapshot(directory)
+
+
+# Shared hot-path metrics. Stages: decode, encode, rekognition, dynamodb_write, s3_upload.
+STAGE_SECONDS = histogram("vi_stage_seconds", "Time spent in a hot-path stage per call.", ("stage",))
+STAGE_ERRORS = counter("vi_stage_errors", "Calls of a hot-path stage that failed.", ("stage",))
+REKOGNITION_CALLS = counter("vi_rekognition_calls", "Rekognition API calls by operation and outcome.",
+                            ("operation", "outcome"))
+DYNAMODB_ITEMS_WRITTEN = counter("vi_dynamodb_items_written", "Items written to DynamoDB.", ("table",))
+DYNAMODB_ITEMS_DROPPED = counter("vi_dynamodb_items_dropped", "Items DynamoDB rejected or that were never written.",
+                                 ("table",))
+S3_BYTES_UPLOADED = counter("vi_s3_bytes_uploaded", "Bytes uploaded to S3.")
+MOTION_GATE_FRAMES = counter("vi_motion_gate_frames", "Sampled frames the motion gate sent on or skipped.",
+                             ("outcome",))
+VISITOR_FALLBACKS = counter("vi_visitor_fallbacks", "Face collection lookups on a visitor index miss, by outcome.",
+                            ("outcome",))
+
+# Per-stream metrics published by StreamSupervisor. Declared here so that every
+# process that renders /metrics knows them, not only the supervisor.
+STREAM_RECORDS = counter("vi_stream_records", "Rekognition result records handled per stream.", ("stream",))
+STREAM_LAG_SECONDS = gauge("vi_stream_lag_seconds", "How far a stream's result reader is behind.", ("stream",))
+STREAM_RESTARTS = counter("vi_stream_restarts", "Stream worker restarts after a failure.", ("stream",))
+
+
+@contextmanager
+def stage(name):
+    """Time a stage call into STAGE_SECONDS and count it in STAGE_ERRORS if it raises."""
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(stage=name)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage=name)
+
+
+def _label_key(names, labels):
+    return tuple((name, str(labels.get(name, ""))) for name in names)
+
+
+def _decode(values):
+    return {tuple(tuple(pair) for pair in json.loads(key)): value for key, value in values.items()}
+
+
+def _encode(values):
+    return {json.dumps(key): value for key, value in values.items()}
+
+
+def _load(path):
+    try:
+        with open(path) as snapshot_file:
+            return json.load(snapshot_file)
+    except (OSError, ValueError):
+        return None  # Gone, being replaced right now, or from an unrelated writer
+
+
+def _write(path, snapshot):
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "w") as snapshot_file:
+        json.dump(snapshot, snapshot_file)
+    os.replace(temporary, path)
+
+
+def _merge(total, other):
+    for key, value in other.items():
+        if key not in total:
+            total[key] = value
+        elif isinstance(value, list):
+            counts, other_sum = value
+            total_counts, total_sum = total[key]
+            total[key] = [[a + b for a, b in zip(total_counts, counts)], total_sum + other_sum]
+        else:
+            total[key] += value
+
+
+def _format_labels(key):
+    if not key:
+        return ""
+    pairs = (f'{name}="{_escape(value)}"' for name, value in key)
+    return "{" + ",".join(pairs) + "}"
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _snapshot_path(directory):
+    pid = os.getpid()
+    return os.path.join(directory, f"metrics-{pid}-{_own_start(pid)}.json")
+
+
+_own_starts = {}  # pid -> start time; forked children get their own entry
+
+
+def _own_start(pid):
+    if pid not in _own_starts:
+        start = _process_start(pid)
+        _own_starts[pid] = start if start is not None else time.time_ns()
+    return _own_starts[pid]
+
+
+def _process_start(pid):
+    """Start time of a running process in clock ticks since boot (Linux), or None."""
+    try:
+        with open(f"/proc/{pid}/stat") as stat_file:
+            # The command name in parentheses may contain spaces; starttime is field 22
+            return int(stat_file.read().rsplit(")", 1)[1].split()[19])
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def _running(pid, start):
+    """Whether the process that wrote a snapshot is still running (not just its pid)."""
+    if start is None:
+        return False
+    if os.path.isdir("/proc"):
+        return _process_start(pid) == start
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _write_snapshots_periodically(directory, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            write_snapshot(directory)
+        except OSError:
+            pass
+
+
+if METRICS_DIR:
+    threading.Thread(
+        target=_write_snapshots_periodically, args=(METRICS_DIR, SNAPSHOT_INTERVAL_SECONDS),
+        name="metrics-snapshot", daemon=True
+    ).start()
@@ -0,0 +1,71 @@
+"""Scene-change gate in front of Rekognition.
+
+Each sampled frame is reduced to a small grayscale thumbnail and compared
+with the thumbnail of the last frame that was sent for analysis. The score is
+the fraction of thumbnail pixels whose brightness changed by more than
+`pixel_delta`; frames scoring below `threshold` are skipped and the caller
+reuses the previous analysis result. Decisions are counted in the
+vi_motion_gate_frames metric as well as in stats().
+"""
+import cv2
+import numpy as np
+
+from Metrics import MOTION_GATE_FRAMES
+
+
+class MotionGate:
+    """Decide per sampled frame whether it differs enough from the last analyzed one."""
+
+    def __init__(self, threshold=0.01, pixel_delta=25, thumbnail_size=(64, 36)):
+        """
+        Args:
+            threshold (float): Minimum fraction of changed thumbnail pixels, 0 disables gating.
+            pixel_delta (int): Grayscale difference (0-255) for a pixel to count as changed.
+            thumbnail_size (tuple): (width, height) frames are downscaled to before comparing.
+        """
+        self.threshold = threshold
+        self.pixel_delta = pixel_delta
+        self.thumbnail_size = thumbnail_size
+        self._reference = None
+
+        # Counters for tuning the threshold
+        self.sent = 0
+        self.skipped = 0
+
+    def thumbnail(self, frame):
+        """Downscaled grayscale copy of a BGR frame."""
+        small = cv2.resize(frame, self.thumbnail_size, interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return small
+
+    def score(self, thumbnail):
+        """Fraction of pixels that changed against the reference thumbnail (1.0 without one)."""
+        if self._reference is None:
+            return 1.0
+        diff = np.abs(thumbnail.astype(np.int16) - self._reference)
+        return float(np.count_nonzero(diff > self.pixel_delta)) / diff.size
+
+    def should_analyze(self, frame):
+        """True if the frame should go to Rekognition; it then becomes the new reference."""
+        thumbnail = self.thumbnail(frame)
+        if self.score(thumbnail) >= self.threshold:
+            self._reference = thumbnail.astype(np.int16)
+            self.sent += 1
+            MOTION_GATE_FRAMES.inc(outcome="sent")
+            return True
+        self.skipped += 1
+        MOTION_GATE_FRAMES.inc(outcome="skipped")
+        return False
+
+    def reset(self):
+        """Forget the reference frame, e.g. when moving on to another video."""
+        self._reference = None
+
+    def stats(self):
+        total = self.sent + self.skipped
+        return {
+            "sent": self.sent,
+            "skipped": self.skipped,
+            "skip_ratio": self.skipped / total if total else 0.0,
+        }
@@ -0,0 +1,216 @@
+"""Columnar analytics sink writing hourly-partitioned Parquet files.
+
+Records are buffered per (stream, date, hour) of their event time and written
+as one Parquet file per buffer to
+
+    <url>/stream=<stream>/date=<YYYY-MM-DD>/hour=<HH>/part-<written>-<uuid>.parquet
+
+where `url` is either s3://bucket/prefix or a local directory (a stand-in for
+S3 when testing). The Hive-style partition names let Athena or Spark prune a
+month-long report down to the hours it needs, instead of scanning the
+one-row-per-frame DynamoDB tables.
+
+A buffer is written once its hour has ended, when it reaches `max_rows`, when
+its oldest record is `max_age` seconds old, and on flush()/close()/interpreter
+exit, so an hour may consist of several files. Nested values (dicts, lists)
+are stored as JSON strings. Pass the producer's `schema` so every file of the
+dataset has the same columns and types; without one the types are inferred
+per file, and a column that happens to be all null in one file won't match.
+"""
+import atexit
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from decimal import Decimal
+
+import boto3
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from Metrics import S3_BYTES_UPLOADED, stage
+
+log = logging.getLogger(__name__)
+
+
+class ParquetSink:
+    """Buffer analytics records and write them as partitioned Parquet files."""
+
+    def __init__(self, url, schema=None, s3_client=None, max_rows=100000, max_age=900.0, check_interval=30.0,
+                 compression="snappy"):
+        """
+        Args:
+            url (str): s3://bucket/prefix, or a local directory to write into.
+            schema (pyarrow.Schema): Columns written; other record keys are dropped.
+            s3_client: boto3 S3 client for s3:// urls (created when not given).
+            max_rows (int): Records per file before a buffer is written early.
+            max_age (float): Maximum age in seconds of a buffered record.
+            check_interval (float): Seconds between checks for buffers to write.
+            compression (str): Parquet compression codec.
+        """
+        if url.startswith("s3://"):
+            self.bucket, _, self.prefix = url[len("s3://"):].partition("/")
+            self.directory = None
+            self.s3_client = s3_client or boto3.client("s3")
+        else:
+            self.bucket, self.prefix = None, ""
+            self.directory = url
+            self.s3_client = None
+        self.prefix = self.prefix.strip("/")
+        self.schema = schema
+        self.max_rows = max_rows
+        self.max_age = max_age
+        self.check_interval = check_interval
+        self.compression = compression
+
+        self._buffers = {}  # (stream, date, hour) -> ([records], buffered_at)
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._closed = threading.Event()
+
+        # Counters for tuning
+        self.records_written = 0
+        self.files_written = 0
+
+        self._writer = threading.Thread(target=self._write_periodically, name="parquet-sink", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def put(self, stream, record, event_time=None):
+        """Buffer a record (a dict) of `stream` observed at `event_time` (epoch seconds, default now)."""
+        if event_time is None:
+            event_time = time.time()
+        moment = datetime.fromtimestamp(float(event_time), timezone.utc)
+        partition = (str(stream), moment.strftime("%Y-%m-%d"), moment.strftime("%H"))
+        row = {name: _column_value(value) for name, value in record.items()}
+
+        full = None
+        with self._lock:
+            buffer = self._buffers.get(partition)
+            if buffer is None:
+                buffer = self._buffers[partition] = ([], time.monotonic())
+            buffer[0].append(row)
+            if len(buffer[0]) >= self.max_rows:
+                full = self._buffers.pop(partition)[0]
+
+        if full is not None:
+            try:
+                self._write(partition, full)
+            except Exception as e:
+                log.error(f"Error writing {len(full)} analytics records for {partition}: {e}")
+                self._restore(partition, full)
+
+    def flush(self, completed_only=False):
+        """Write buffered records; with `completed_only` only buffers that are due."""
+        now = time.monotonic()
+        current_hour = datetime.now(timezone.utc).strftime("%Y-%m-%d %H")
+        with self._lock:
+            due = [
+                partition for partition, (rows, buffered_at) in self._buffers.items()
+                if not completed_only
+                or f"{partition[1]} {partition[2]}" < current_hour
+                or now - buffered_at >= self.max_age
+            ]
+            batches = [(partition, self._buffers.pop(partition)[0]) for partition in due]
+
+        for partition, rows in batches:
+            try:
+                self._write(partition, rows)
+            except Exception as e:
+                log.error(f"Error writing {len(rows)} analytics records for {partition}: {e}")
+                self._restore(partition, rows)
+
+    def close(self):
+        """Stop the background writer and write what is left."""
+        self._closed.set()
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            buffered = sum(len(rows) for rows, _ in self._buffers.values())
+        return {"buffered": buffered, "records_written": self.records_written, "files_written": self.files_written}
+
+    def _write(self, partition, rows):
+        stream, date, hour = partition
+        name = f"part-{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex}.parquet"
+        key = "/".join(part for part in (self.prefix, f"stream={stream}", f"date={date}", f"hour={hour}", name) if part)
+
+        table = _to_table(rows, self.schema)
+        with self._write_lock:
+            if self.directory is not None:
+                path = os.path.join(self.directory, *key.split("/"))
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # Written next to the target and renamed, so readers never see a partial file
+                temporary = f"{path}.tmp"
+                pq.write_table(table, temporary, compression=self.compression)
+                os.replace(temporary, path)
+            else:
+                with tempfile.NamedTemporaryFile(suffix=".parquet", delete=False) as temporary:
+                    pass
+                try:
+                    pq.write_table(table, temporary.name, compression=self.compression)
+                    size = os.path.getsize(temporary.name)
+                    with stage("s3_upload"):
+                        self.s3_client.upload_file(temporary.name, self.bucket, key)
+                    S3_BYTES_UPLOADED.inc(size)
+                finally:
+                    os.unlink(temporary.name)
+            self.records_written += len(rows)
+            self.files_written += 1
+        log.info(f"Wrote {len(rows)} analytics records to {key}")
+
+    def _restore(self, partition, rows):
+        """Put rows that failed to write back in front of newer ones."""
+        with self._lock:
+            newer = self._buffers.pop(partition, None)
+            if newer is None:
+                self._buffers[partition] = (rows, time.monotonic())
+            else:
+                self._buffers[partition] = (rows + newer[0], newer[1])
+
+    def _write_periodically(self):
+        while not self._closed.wait(self.check_interval):
+            try:
+                self.flush(completed_only=True)
+            except Exception as e:
+                log.error(f"Error writing analytics files: {e}")
+
+
+def _column_value(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (dict, list, tuple, set)):
+        return json.dumps(value, default=_json_default, sort_keys=True)
+    return value
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, set):
+        return sorted(value)
+    return str(value)
+
+
+def _to_table(rows, schema=None):
+    if schema is not None:
+        fields = [(field.name, field.type) for field in schema]
+    else:
+        # Columns of every row, in first-seen order; rows without one get nulls
+        fields = [(name, None) for name in dict.fromkeys(name for row in rows for name in row)]
+
+    arrays = {}
+    for name, type_ in fields:
+        values = [row.get(name) for row in rows]
+        try:
+            arrays[name] = pa.array(values, type_)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            if type_ is not None and not pa.types.is_string(type_):
+                raise
+            # Values of different types, kept as strings
+            arrays[name] = pa.array([None if value is None else str(value) for value in values], pa.string())
+    return pa.table(arrays, schema=schema)
@@ -0,0 +1,79 @@
+"""Producer/consumer stages on threads, connected by bounded queues.
+
+Each stage runs an iterable on its own thread and puts the items it yields on
+a bounded queue; the iterator returned by stage() reads them back in the same
+order. Stages chain by passing one stage's iterator into the next one's
+iterable, so a slow stage makes the ones before it block instead of buffering
+without limit. An exception raised in a stage is re-raised in whoever consumes
+its output. OpenCV and network calls release the GIL, so stages overlap.
+"""
+import queue
+import threading
+
+_END = object()
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+class Pipeline:
+    """A set of stage threads that can be stopped together."""
+
+    def __init__(self, poll_interval=0.1):
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._threads = []
+
+    def stage(self, name, items, maxsize):
+        """Run `items` on a thread and return an iterator over what it yields."""
+        output = queue.Queue(maxsize=maxsize)
+
+        def run():
+            try:
+                for item in items:
+                    if not self._put(output, item):
+                        return
+                self._put(output, _END)
+            except BaseException as e:
+                self._put(output, _Failure(e))
+            finally:
+                # Release e.g. a generator's open video capture right away
+                close = getattr(items, "close", None)
+                if close is not None:
+                    close()
+
+        thread = threading.Thread(target=run, name=name, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        return self._drain(output)
+
+    def close(self):
+        """Stop all stages, e.g. after the consumer failed, and wait for their threads."""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+
+    def _put(self, output, item):
+        while not self._stop.is_set():
+            try:
+                output.put(item, timeout=self.poll_interval)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _drain(self, output):
+        while True:
+            try:
+                item = output.get(timeout=self.poll_interval)
+            except queue.Empty:
+                if self._stop.is_set():
+                    return
+                continue
+            if item is _END:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
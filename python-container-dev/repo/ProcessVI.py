@@ -1,13 +1,37 @@
 import os
+import argparse
 import cv2
 import boto3
-import json
+import numpy as np
+import math
+import threading
+import time
 import uuid
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from itertools import chain
+from multiprocessing.util import Finalize
 from datetime import datetime
+from CheckpointStore import CheckpointStore, clear_progress, load_progress, save_progress
+from DirectoryWatcher import DirectoryWatcher
+from DynamoBatchWriter import BatchWriter
+from FacePreDetector import FacePreDetector
+from FrameEncoder import DETECT_FACES_ATTRIBUTES, FrameEncoder
+from FrameSampler import sample_frames, video_duration_ms
+import Metrics
+from MotionGate import MotionGate
+from Pipeline import Pipeline
+from ResultCache import ResultCache, content_digest
+from botocore.exceptions import ClientError
+from RekognitionDispatcher import NO_RETRY_CONFIG, RekognitionDispatcher
+from VisitorIndex import SFACE_COSINE_THRESHOLD, FaceEmbedder, RateLimiter, VisitorIndex, aligned_face
+from VisitorStateCache import VisitorStateCache
+from WindowAggregator import WindowAggregator, summarize_faces
 
 # Initialize AWS resources
 dynamodb = boto3.resource('dynamodb')
-rekognition = boto3.client('rekognition')
+rekognition = boto3.client('rekognition', config=NO_RETRY_CONFIG)  # Throttling is handled by the dispatcher
+rekognition_dispatcher = RekognitionDispatcher(rekognition)
 
 # DynamoDB table for analytics data
 table_name = "ExhibitionAnalytics"  # Replace with your table name
@@ -21,162 +45,619 @@ checkpoint_table = dynamodb.Table(checkpoint_table_name)
 VIDEO_DIR = "./videos"  # Directory containing .mkv files
 IMAGE_DIR = "./images"  # Directory containing .jpg files
 
+# Local journal and index of completed files (see CheckpointStore)
+CHECKPOINT_PATH = os.environ.get("CHECKPOINT_PATH", "./checkpoints/processvi")
+
+# Video sampling
+SAMPLE_INTERVAL_SECONDS = 10  # Analyze one frame every 10 seconds
+SAMPLING_MODE = os.environ.get("SAMPLING_MODE", "grab")  # grab, seek or keyframe
+DECODE_BACKEND = os.environ.get("DECODE_BACKEND", "opencv")  # pyav or opencv, see DecodeBackend
+DECODE_THREADS = int(os.environ.get("DECODE_THREADS", "0"))  # 0: one per core, or shared out among pool workers
+
+# Seconds of video between saved resume markers for an in-progress file
+PROGRESS_INTERVAL_SECONDS = int(os.environ.get("PROGRESS_INTERVAL_SECONDS", "300"))
+
+# Number of files processed concurrently, one worker process per file
+WORKERS = int(os.environ.get("PROCESSVI_WORKERS", os.cpu_count() or 1))
+
+# Time segments each video is split into, analyzed by separate workers (1 disables).
+# Only used with more than one worker.
+VIDEO_SEGMENTS = int(os.environ.get("VIDEO_SEGMENTS", "1"))
+
+# Watch mode: seconds a file's size and mtime must stay unchanged before it is processed
+WATCH_SETTLE_SECONDS = float(os.environ.get("WATCH_SETTLE_SECONDS", "10"))
+
+# Sampled frames allowed to wait on Rekognition before decoding pauses
+MAX_PENDING_FRAMES = 32
+
+# Decoded frames allowed to wait for the encode stage
+DECODE_QUEUE_SIZE = 4
+
+# Fraction of thumbnail pixels that must change before a frame is re-analyzed (0 disables)
+MOTION_THRESHOLD = float(os.environ.get("MOTION_THRESHOLD", "0.01"))
+
+# Optional OpenCV face check: frames without a candidate face skip Rekognition,
+# and with FACE_CROP=1 only the region around the faces is uploaded
+FACE_PREDETECTION = os.environ.get("FACE_PREDETECTION", "0") == "1"
+FACE_CROP = os.environ.get("FACE_CROP", "0") == "1"
+face_predetector = FacePreDetector(crop=FACE_CROP) if FACE_PREDETECTION else None
+
+# Frames are downscaled and JPEG quality is picked to fit this upload budget
+FRAME_MAX_BYTES = int(os.environ.get("FRAME_MAX_BYTES", str(200 * 1024)))
+TARGET_FACE_PX = int(os.environ.get("TARGET_FACE_PX", "80"))
+frame_encoder = FrameEncoder(target_face_px=TARGET_FACE_PX, max_bytes=FRAME_MAX_BYTES)
+
+# Opt-in cache of Rekognition responses for frames analyzed before, e.g. when a
+# video is reprocessed; keyed by a digest of the exact pixels
+RESULT_CACHE_PATH = os.environ.get("RESULT_CACHE_PATH", "")
+RESULT_CACHE_TTL_SECONDS = int(os.environ.get("RESULT_CACHE_TTL_SECONDS", "3600"))
+result_cache = (
+    ResultCache(RESULT_CACHE_PATH, ttl=RESULT_CACHE_TTL_SECONDS, namespace=",".join(DETECT_FACES_ATTRIBUTES))
+    if RESULT_CACHE_PATH else None
+)
+
 # DynamoDB table for visitor tracking
 visitor_table_name = "VisitorTracking"  # Replace with your visitor table name
 visitor_table = dynamodb.Table(visitor_table_name)
 
-def load_checkpoint():
-    """Load the processing checkpoint from DynamoDB."""
+# Faces are matched by their SFace embedding against recently seen visitors
+# locally; only on a miss is the Rekognition face collection searched (empty
+# VISITOR_COLLECTION_ID disables it). Without the model file visitors are not tracked.
+VISITOR_EMBEDDING_MODEL = os.environ.get("VISITOR_EMBEDDING_MODEL", "models/face_recognition_sface_2021dec.onnx")
+VISITOR_MATCH_THRESHOLD = float(os.environ.get("VISITOR_MATCH_THRESHOLD", str(SFACE_COSINE_THRESHOLD)))
+VISITOR_TTL_SECONDS = int(os.environ.get("VISITOR_TTL_SECONDS", "600"))
+VISITOR_COLLECTION_ID = os.environ.get("VISITOR_COLLECTION_ID", "")
+# Index misses per second that may search (and index into) the collection, over all cameras
+VISITOR_FALLBACK_RATE = float(os.environ.get("VISITOR_FALLBACK_RATE", "2"))
+visitor_indexes = {}  # camera -> VisitorIndex
+visitor_indexes_lock = threading.Lock()  # Pipeline and merger threads look up indexes concurrently
+visitor_fallback_limiter = RateLimiter(VISITOR_FALLBACK_RATE)
+face_embedder = None
+if os.path.exists(VISITOR_EMBEDDING_MODEL):
+    face_embedder = FaceEmbedder(VISITOR_EMBEDDING_MODEL)
+else:
+    print(f"Visitor tracking disabled: no face embedding model at {VISITOR_EMBEDDING_MODEL}")
+
+# Visitor counters are coalesced in memory and written as UpdateItem ADDs
+visitor_state = VisitorStateCache(visitor_table)
+
+# Analytics rows are written through a shared batch writer
+analytics_writer = BatchWriter(dynamodb)
+
+# Frames are folded into one ExhibitionAnalytics row per camera per window.
+# Videos use their playback position as event time (one camera per video_id),
+# images the wall clock under the "images" camera.
+AGGREGATION_WINDOW_SECONDS = int(os.environ.get("AGGREGATION_WINDOW_SECONDS", "60"))
+IMAGE_CAMERA_ID = "images"
+
+def store_window(record):
+    """Write a finished aggregation window to the analytics table."""
+    if record["camera_id"] == IMAGE_CAMERA_ID:
+        # Image windows are flushed per file, so several rows may share a window
+        record["id"] = f"{IMAGE_CAMERA_ID}#{record['window_start']}#{uuid.uuid4()}"
+    else:
+        # Deterministic, so a re-emitted window overwrites instead of duplicating
+        record["id"] = f"{record['camera_id']}#{record['window_start']}"
+        record["video_id"] = record["camera_id"]
+    analytics_writer.put_item(table_name, record)
+
+window_aggregator = WindowAggregator(store_window, AGGREGATION_WINDOW_SECONDS)
+
+# Optional columnar copy of the per-frame analytics for reporting queries:
+# s3://bucket/prefix or a local directory (see ParquetSink), empty disables.
+# pyarrow (requirements-parquet.txt) is only needed when it is enabled.
+ANALYTICS_PARQUET_URL = os.environ.get("ANALYTICS_PARQUET_URL", "")
+parquet_sink = None
+if ANALYTICS_PARQUET_URL:
+    import pyarrow as pa
+    from ParquetSink import ParquetSink
+
+    FRAME_ANALYTICS_SCHEMA = pa.schema([
+        ("camera_id", pa.string()),
+        ("position_ms", pa.float64()),
+        ("analyzed_at", pa.string()),
+        ("foot_impressions", pa.int64()),
+        ("age_min", pa.int64()),
+        ("age_max", pa.int64()),
+        ("gender_distribution", pa.string()),  # JSON
+        ("emotion_counts", pa.string()),       # JSON
+        ("visitor_ids", pa.string()),          # JSON
+    ])
+    parquet_sink = ParquetSink(ANALYTICS_PARQUET_URL, FRAME_ANALYTICS_SCHEMA)
+
+def search_visitor_collection(crop):
+    """Return the visitor id of the best collection match for a face crop, or None."""
     try:
-        response = checkpoint_table.get_item(Key={"id": "checkpoint"})
-        return response.get("Item", {"videos": [], "images": []})
-    except Exception as e:
-        print(f"Error loading checkpoint: {e}")
-        return {"videos": [], "images": []}
+        response = rekognition_dispatcher.call(
+            "search_faces_by_image",
+            CollectionId=VISITOR_COLLECTION_ID,
+            Image={"Bytes": encode_frame(crop)},
+            FaceMatchThreshold=90,
+            MaxFaces=1,
+        )
+    except ClientError as e:
+        # InvalidParameterException: Rekognition found no face in the crop
+        print(f"Error searching visitor collection: {e}")
+        return None
+    matches = response.get("FaceMatches", [])
+    return matches[0]["Face"].get("ExternalImageId") if matches else None
 
-def save_checkpoint(checkpoint):
-    """Save the processing checkpoint to DynamoDB."""
+def index_visitor(crop, visitor_id):
+    """Add a new visitor's face to the collection under their visitor id."""
     try:
-        checkpoint_table.put_item(Item={"id": "checkpoint", **checkpoint})
-    except Exception as e:
-        print(f"Error saving checkpoint: {e}")
+        rekognition_dispatcher.call(
+            "index_faces",
+            CollectionId=VISITOR_COLLECTION_ID,
+            Image={"Bytes": encode_frame(crop)},
+            ExternalImageId=visitor_id,
+            MaxFaces=1,
+        )
+    except ClientError as e:
+        print(f"Error indexing visitor: {e}")
 
-def process_video(file_path):
-    """Process a video file for visitor analytics."""
+def get_visitor_index(camera_id):
+    """Return the visitor index of a camera, creating it on first use."""
+    with visitor_indexes_lock:
+        if camera_id not in visitor_indexes:
+            visitor_indexes[camera_id] = VisitorIndex(
+                face_embedder,
+                threshold=VISITOR_MATCH_THRESHOLD,
+                ttl=VISITOR_TTL_SECONDS,
+                fallback=search_visitor_collection if VISITOR_COLLECTION_ID else None,
+                register=index_visitor if VISITOR_COLLECTION_ID else None,
+                limiter=visitor_fallback_limiter,
+            )
+        return visitor_indexes[camera_id]
+
+def load_checkpoint():
+    """Open the per-file checkpoint store, rebuilding the local index from DynamoDB if needed."""
+    return CheckpointStore(dynamodb, checkpoint_table_name, CHECKPOINT_PATH)
+
+def start_video(file_path):
+    """Return (video_id, start_ms) for a video, resuming from its last saved position."""
+    progress = load_progress(checkpoint_table, file_path)
+    if progress:
+        print(f"Resuming video: {file_path} at {progress['position_ms'] / 1000:.0f}s")
+        return progress["video_id"], progress["position_ms"]
     print(f"Processing video: {file_path}")
-    cap = cv2.VideoCapture(file_path)
-    frame_rate = int(cap.get(cv2.CAP_PROP_FPS))
-    frame_interval = frame_rate * 10  # Process every 10 seconds
+    return str(uuid.uuid4()), 0
+
+def process_video(file_path):
+    """Process a video file for visitor analytics, resuming from its last saved position."""
+    video_id, start_ms = start_video(file_path)
+    record_video(file_path, video_id, start_ms, analyze_video(file_path, start_ms))
+
+def process_video_segments(pool, file_path, segments):
+    """Process a video as time segments analyzed in parallel by `pool`.
+
+    The segments' results are recorded here, in timestamp order, so windows,
+    visitor matching and progress markers see the same sequence as with
+    process_video.
+    """
+    video_id, start_ms = start_video(file_path)
+    futures = [
+        pool.submit(analyze_segment, file_path, segment_start, segment_end)
+        for segment_start, segment_end in plan_segments(file_path, start_ms, segments)
+    ]
+    try:
+        results = chain.from_iterable(future.result() for future in futures)
+        record_video(file_path, video_id, start_ms, results)
+    finally:
+        for future in futures:
+            future.cancel()
+    analytics_writer.flush()
+    visitor_state.flush()
+
+def plan_segments(file_path, start_ms, segments):
+    """Split a video from `start_ms` into up to `segments` (start_ms, end_ms) ranges; the last end is None.
+
+    Bounds are multiples of both the sample interval and the aggregation
+    window, so sampling stays on the global grid and no window spans two
+    segments.
+    """
+    duration_ms = video_duration_ms(file_path)
+    if segments <= 1 or not duration_ms or duration_ms <= start_ms:
+        return [(start_ms, None)]
+
+    align_ms = math.lcm(SAMPLE_INTERVAL_SECONDS * 1000, AGGREGATION_WINDOW_SECONDS * 1000)
+    span_ms = (duration_ms - start_ms) / segments
+    step_ms = max(align_ms, math.ceil(span_ms / align_ms) * align_ms)
 
-    frame_count = 0
-    video_id = str(uuid.uuid4())
+    bounds = []
+    segment_start = start_ms
+    while segment_start < duration_ms:
+        segment_end = segment_start + step_ms
+        bounds.append((segment_start, segment_end if segment_end < duration_ms else None))
+        segment_start = segment_end
+    return bounds
 
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
+def analyze_segment(file_path, start_ms, end_ms):
+    """Analyze one time segment of a video in a pool worker and return its results as a list."""
+    print(f"Analyzing segment {start_ms / 1000:.0f}s-{'end' if end_ms is None else f'{end_ms / 1000:.0f}s'} of {file_path}")
+    return list(analyze_video(file_path, start_ms, end_ms))
 
-        if frame_count % frame_interval == 0:
-            # Save frame as image for analysis
-            frame_path = f"frame_{video_id}_{frame_count}.jpg"
-            cv2.imwrite(frame_path, frame)
-            analyze_frame(frame_path, video_id)
-            os.remove(frame_path)  # Clean up frame
+def analyze_video(file_path, start_ms=0, end_ms=None):
+    """Yield (position_ms, response, face crops) for the sampled frames of a video, in order.
 
-        frame_count += 1
+    `response` is None for frames whose analysis failed.
+    """
+    # The video runs as a pipeline: a decode thread (only the sampled frames
+    # are decoded, see FrameSampler), an encode thread (motion gate,
+    # pre-detection, cache lookup, JPEG encoding and Rekognition submission)
+    # and the consuming thread, which waits for the responses. Each stage
+    # hands over in order through a bounded queue, so results come out in
+    # frame order while the stages overlap.
+    motion_gate = MotionGate(MOTION_THRESHOLD)
+    pipeline = Pipeline()
+    try:
+        frames = pipeline.stage(
+            "decode",
+            Metrics.STAGE_SECONDS.time_iter(sample_frames(
+                file_path, SAMPLE_INTERVAL_SECONDS, SAMPLING_MODE, start_ms, end_ms, DECODE_BACKEND, DECODE_THREADS
+            ), stage="decode"),
+            DECODE_QUEUE_SIZE
+        )
+        submissions = pipeline.stage("encode", submit_frames(frames, motion_gate), MAX_PENDING_FRAMES)
+        for position_ms, (future, image) in submissions:
+            try:
+                response = future.result()
+            except Exception as e:
+                print(f"Error analyzing frame: {e}")
+                yield position_ms, None, []
+                continue
+            yield position_ms, response, face_crops(response.get("FaceDetails", []), image)
+    finally:
+        pipeline.close()
+
+    print(f"Motion gate for {file_path}: {motion_gate.stats()}")
+    if face_predetector is not None:
+        print(f"Face pre-detector: {face_predetector.stats()}")
+    if result_cache is not None:
+        print(f"Result cache: {result_cache.stats()}")
+
+def record_video(file_path, video_id, start_ms, results):
+    """Record (position_ms, response, face crops) results of a video in order and keep its resume marker."""
+    interval_ms = SAMPLE_INTERVAL_SECONDS * 1000
+    window_ms = AGGREGATION_WINDOW_SECONDS * 1000
+    saved_ms = start_ms
+
+    for position_ms, response, crops in results:
+        if response is not None:
+            try:
+                record_analysis(response, video_id, position_ms, crops=crops)
+            except Exception as e:
+                print(f"Error analyzing frame: {e}")
+        # Resume from the grid point after the last sample that was recorded.
+        # Markers are only placed on window boundaries so a resumed run never
+        # re-emits (and overwrites) a window with part of its frames.
+        next_ms = (position_ms // interval_ms + 1) * interval_ms
+        if next_ms - saved_ms >= PROGRESS_INTERVAL_SECONDS * 1000 and next_ms % window_ms == 0:
+            window_aggregator.flush(video_id)
+            analytics_writer.flush()
+            visitor_state.flush()
+            save_progress(checkpoint_table, file_path, video_id, next_ms)
+            saved_ms = next_ms
+
+    # Visitor positions are only comparable within one video
+    with visitor_indexes_lock:
+        visitor_index = visitor_indexes.pop(video_id, None)
+    if visitor_index is not None:
+        print(f"Visitor index: {visitor_index.stats()}")
+    window_aggregator.flush(video_id)
+    if saved_ms > 0:
+        analytics_writer.flush()
+        clear_progress(checkpoint_table, file_path)
 
-    cap.release()
+def submit_frames(frames, motion_gate):
+    """Submit sampled (frame_index, position_ms, frame) tuples and yield (position_ms, submission).
+
+    Frames that look like the last analyzed one reuse its submission instead
+    of calling Rekognition again.
+    """
+    last_submission = None
+    for frame_index, position_ms, frame in frames:
+        # The first frame always passes since the gate has no reference yet
+        if motion_gate.should_analyze(frame):
+            last_submission = submit_frame(frame)
+        yield position_ms, last_submission
 
 def process_image(file_path):
     """Process a single image for demographics analytics."""
     print(f"Processing image: {file_path}")
     analyze_frame(file_path)
+    # Images are independent files, so the window is not kept open past the
+    # file: a worker may exit before a later image would close it
+    window_aggregator.flush(IMAGE_CAMERA_ID)
+
+def encode_frame(frame, face_boxes=None):
+    """Encode a BGR frame as JPEG bytes in memory, sized for the Rekognition upload budget."""
+    return frame_encoder.encode(frame, face_boxes)
+
+def load_image_bytes(image, face_boxes=None):
+    """Return encoded image bytes for a file path, encoded bytes or an ndarray frame.
 
-def analyze_frame(image_path, video_id=None):
-    """Analyze a frame or image using AWS Rekognition and remove PII."""
+    Files and bytes within the upload budget are sent as they are; larger ones
+    are re-encoded like video frames.
+    """
+    if isinstance(image, str):
+        with open(image, 'rb') as image_file:
+            image = image_file.read()
+    if isinstance(image, (bytes, bytearray)):
+        if len(image) <= frame_encoder.max_bytes:
+            return bytes(image)
+        image = load_image_array(image)
+    return encode_frame(image, face_boxes)
+
+def load_image_array(image):
+    """Return a BGR ndarray for a file path, encoded bytes or an ndarray frame."""
+    if isinstance(image, np.ndarray):
+        return image
+    if isinstance(image, str):
+        return cv2.imread(image)
+    return cv2.imdecode(np.frombuffer(image, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+def completed_future(response):
+    """A future that already holds `response`, for frames that skip Rekognition."""
+    future = Future()
+    future.set_result(response)
+    return future
+
+def submit_frame(image):
+    """Queue a Rekognition detect_faces call for a frame.
+
+    `image` may be a file path, JPEG/PNG bytes or a BGR ndarray frame. Returns
+    (future of the response, image the response refers to), as the bounding
+    boxes are relative to the face crop when one was sent.
+    """
+    face_boxes = None
+    if face_predetector is not None:
+        image, face_boxes = face_predetector.prepare(load_image_array(image))
+        if image is None:
+            return completed_future({"FaceDetails": []}), None
+
+    if result_cache is not None:
+        digest = content_digest(load_image_array(image))
+        cached = result_cache.get(digest)
+        if cached is not None:
+            return completed_future(cached), image
+
+    future = rekognition_dispatcher.submit(
+        "detect_faces",
+        Image={"Bytes": load_image_bytes(image, face_boxes)},
+        Attributes=DETECT_FACES_ATTRIBUTES
+    )
+    if result_cache is not None:
+        def cache_response(done):
+            if done.exception() is None:
+                result_cache.put(digest, done.result())
+        future.add_done_callback(cache_response)
+    return future, image
+
+def complete_frame(submission, video_id=None, position_ms=None):
+    """Wait for a frame returned by submit_frame and record its analytics."""
+    future, image = submission
     try:
-        with open(image_path, 'rb') as image_file:
-            response = rekognition.detect_faces(
-                Image={"Bytes": image_file.read()},
-                Attributes=["ALL"]
-            )
+        record_analysis(future.result(), video_id, position_ms, image)
+    except Exception as e:
+        print(f"Error analyzing frame: {e}")
 
-        # Aggregate demographic data
-        age_ranges = []
-        gender_counts = {"Male": 0, "Female": 0, "Unknown": 0}
-        emotion_counts = {}
-
-        for face in response.get("FaceDetails", []):
-            # Aggregate age ranges
-            if "AgeRange" in face:
-                age_ranges.append(face["AgeRange"])
-
-            # Count gender distribution
-            gender = face.get("Gender", {}).get("Value", "Unknown")
-            gender_counts[gender] += 1
-
-            # Count emotions
-            for emotion in face.get("Emotions", []):
-                emotion_name = emotion.get("Type")
-                if emotion_name:
-                    emotion_counts[emotion_name] = emotion_counts.get(emotion_name, 0) + 1
-
-        # Compute overall age range (min and max)
-        overall_age_range = {
-            "Min": min(age["Low"] for age in age_ranges) if age_ranges else None,
-            "Max": max(age["High"] for age in age_ranges) if age_ranges else None,
-        }
-
-        # Analyze foot impressions and visitor tracking
-        foot_impressions = len(response.get("FaceDetails", []))
-        visitor_id = str(uuid.uuid4())  # Generate unique ID for each visitor (replace with actual logic if needed)
-        timestamp = datetime.utcnow().isoformat()
-
-        # Update visitor tracking data
-        visitor_data = visitor_table.get_item(Key={"visitor_id": visitor_id}).get("Item")
-        if visitor_data:
-            visit_count = visitor_data.get("visit_count", 0) + 1
-            dwell_time = visitor_data.get("dwell_time", 0) + 10  # Assuming 10 seconds per frame
-        else:
-            visit_count = 1
-            dwell_time = 10
-
-        visitor_table.put_item(Item={
-            "visitor_id": visitor_id,
-            "last_seen": timestamp,
-            "visit_count": visit_count,
-            "dwell_time": dwell_time
-        })
+def analyze_frame(image, video_id=None):
+    """Analyze a frame or image using AWS Rekognition and remove PII.
 
-        # Sanitize and save data
-        data = {
-            "id": str(uuid.uuid4()),
-            "timestamp": timestamp,
-            "video_id": video_id,
-            "demographics": {
-                "overall_age_range": overall_age_range,
-                "gender_distribution": gender_counts,
-                "emotion_counts": emotion_counts,
-            },
-            "foot_impressions": foot_impressions,
-            "visitor_id": visitor_id,
-            "visit_count": visit_count,
-            "dwell_time": dwell_time,
-        }
-
-        # Store in DynamoDB
-        table.put_item(Item=data)
+    `image` may be a file path, JPEG/PNG bytes or a BGR ndarray frame.
+    """
+    try:
+        complete_frame(submit_frame(image), video_id)
     except Exception as e:
         print(f"Error analyzing frame: {e}")
 
-def main():
-    checkpoint = load_checkpoint()
-    processed_videos = set(checkpoint.get("videos", []))
-    processed_images = set(checkpoint.get("images", []))
+def face_crops(face_details, image):
+    """Aligned face (None where not possible) of each detected face in the image the response refers to."""
+    frame = load_image_array(image) if face_embedder is not None and image is not None and face_details else None
+    if frame is None:
+        return [None] * len(face_details)
+    return [aligned_face(frame, face) for face in face_details]
+
+def record_analysis(response, video_id=None, position_ms=None, image=None, crops=None):
+    """Update visitor tracking and fold a detect_faces response into its aggregation window.
+
+    `image` is the frame the response refers to, or `crops` the faces already
+    cut out of it (see face_crops); without either, or without the face
+    embedding model, faces cannot be re-identified and no visitor rows are written.
+    """
+    face_details = response.get("FaceDetails", [])
+    summary = summarize_faces(face_details)
+    if crops is None:
+        crops = face_crops(face_details, image)
+    if video_id is not None and position_ms is not None:
+        camera_id, event_time = video_id, position_ms / 1000.0
+    else:
+        camera_id, event_time = IMAGE_CAMERA_ID, time.time()
+
+    visitor_ids = set()
+    for crop in crops:
+        if crop is None:
+            continue
+        visitor_id, new_visit = get_visitor_index(camera_id).identify(crop, event_time)
+        if visitor_id in visitor_ids:
+            continue
+        visitor_ids.add(visitor_id)
+        track_visitor(visitor_id, new_visit)
+
+    summary["visitor_ids"] = visitor_ids
+    window_aggregator.add(camera_id, event_time, summary)
+
+    if parquet_sink is not None:
+        # Partitioned by when the frame was analyzed; videos keep their position as a column
+        parquet_sink.put("images" if camera_id == IMAGE_CAMERA_ID else "videos", {
+            "camera_id": camera_id,
+            "position_ms": position_ms,
+            "analyzed_at": datetime.utcnow().isoformat(),
+            "foot_impressions": summary["foot_impressions"],
+            "age_min": summary["overall_age_range"]["Min"],
+            "age_max": summary["overall_age_range"]["Max"],
+            "gender_distribution": summary["gender_distribution"],
+            "emotion_counts": summary["emotion_counts"],
+            "visitor_ids": sorted(visitor_ids),
+        })
+
+def track_visitor(visitor_id, new_visit):
+    """Count a sighting of a visitor: a visit when they (re)appear, dwell time for every sampled frame."""
+    visitor_state.increment(
+        visitor_id,
+        visit_count=1 if new_visit else 0,
+        dwell_time=SAMPLE_INTERVAL_SECONDS,  # Assuming one sample interval per frame
+        last_seen=datetime.utcnow().isoformat(),
+    )
+
+def init_worker(workers=1):
+    """Set up a pool worker process.
+
+    Workers are spawned, so each one imports this module and creates its own
+    boto3 resources exactly once. OpenCV is limited to one thread per worker
+    and the codec threads are shared out so N workers decoding N files don't
+    oversubscribe the container's cores.
+    """
+    global DECODE_THREADS
+    cv2.setNumThreads(1)
+    if DECODE_THREADS == 0:
+        DECODE_THREADS = max(1, (os.cpu_count() or 1) // workers)
+    if parquet_sink is not None:
+        # The sink writes on its own age and size thresholds across files. Workers
+        # exit without running atexit hooks, so a multiprocessing finalizer writes
+        # what is still buffered when the pool shuts down.
+        Finalize(parquet_sink, parquet_sink.close, exitpriority=10)
+
+def process_file(kind, file_path):
+    """Process one pending file; `kind` is "videos" or "images" as in the checkpoint."""
+    if kind == "videos":
+        process_video(file_path)
+    else:
+        process_image(file_path)
+    # Pool workers exit without running atexit hooks, and a file only counts
+    # as processed once its rows are written. The Parquet copy is left to
+    # its sink's thresholds, so files aren't split into one object each.
+    analytics_writer.flush()
+    visitor_state.flush()
+    Metrics.write_snapshot()
+
+def list_pending_files(checkpoint):
+    """Return (kind, path) pairs for every file not yet recorded in the checkpoint."""
+    pending = []
 
-    # Process videos
     for video_file in os.listdir(VIDEO_DIR):
         video_path = os.path.join(VIDEO_DIR, video_file)
-        if video_file.endswith(".mkv") and video_path not in processed_videos:
-            try:
-                process_video(video_path)
-                processed_videos.add(video_path)
-                checkpoint["videos"] = list(processed_videos)
-                save_checkpoint(checkpoint)
-            except Exception as e:
-                print(f"Error processing video {video_file}: {e}")
+        if video_file.endswith(".mkv") and not checkpoint.is_done("videos", video_path):
+            pending.append(("videos", video_path))
 
-    # Process images
     for image_file in os.listdir(IMAGE_DIR):
         image_path = os.path.join(IMAGE_DIR, image_file)
-        if image_file.endswith(".jpg") and image_path not in processed_images:
-            try:
-                process_image(image_path)
-                processed_images.add(image_path)
-                checkpoint["images"] = list(processed_images)
-                save_checkpoint(checkpoint)
-            except Exception as e:
-                print(f"Error processing image {image_file}: {e}")
+        if image_file.endswith(".jpg") and not checkpoint.is_done("images", image_path):
+            pending.append(("images", image_path))
+
+    return pending
+
+def record_completion(checkpoint, future, kind, file_path):
+    """Mark a file done once its pool future finished without error."""
+    try:
+        future.result()
+        checkpoint.mark_done(kind, file_path)
+    except Exception as e:
+        print(f"Error processing {file_path}: {e}")
+
+def submit_file(pool, merger, kind, file_path, segments=1):
+    """Queue a file on the pool and return its future.
+
+    With `segments` > 1 a video's segments are queued on the pool and its
+    results are merged and recorded by a `merger` thread in this process.
+    """
+    if kind == "videos" and segments > 1:
+        return merger.submit(process_video_segments, pool, file_path, segments)
+    return pool.submit(process_file, kind, file_path)
+
+def create_pool(workers):
+    mp_context = multiprocessing.get_context("spawn")
+    return ProcessPoolExecutor(max_workers=workers, mp_context=mp_context, initializer=init_worker, initargs=(workers,))
+
+def main(workers=WORKERS, segments=VIDEO_SEGMENTS):
+    checkpoint = load_checkpoint()
+    try:
+        pending = list_pending_files(checkpoint)
+
+        if workers <= 1:
+            for kind, file_path in pending:
+                try:
+                    process_file(kind, file_path)
+                    checkpoint.mark_done(kind, file_path)
+                except Exception as e:
+                    print(f"Error processing {file_path}: {e}")
+            return
+
+        # Files are processed in worker processes; completions flow back here and
+        # only the parent touches the checkpoint
+        with create_pool(workers) as pool, ThreadPoolExecutor(workers, thread_name_prefix="segments") as merger:
+            futures = {
+                submit_file(pool, merger, kind, file_path, segments): (kind, file_path) for kind, file_path in pending
+            }
+            for future in as_completed(futures):
+                record_completion(checkpoint, future, *futures[future])
+    finally:
+        checkpoint.close()
+
+def watch(workers=WORKERS, segments=VIDEO_SEGMENTS):
+    """Keep processing files as they appear or change in VIDEO_DIR and IMAGE_DIR, until interrupted.
+
+    Files already in the checkpoint are skipped on start-up; after that only
+    new or changed files are queued, once they have stopped growing.
+    """
+    kinds = {VIDEO_DIR: "videos", IMAGE_DIR: "images"}
+    checkpoint = load_checkpoint()
+    watcher = DirectoryWatcher(
+        {VIDEO_DIR: ".mkv", IMAGE_DIR: ".jpg"},
+        settle_seconds=WATCH_SETTLE_SECONDS,
+        already_done=lambda directory, path: checkpoint.is_done(kinds[directory], path),
+    )
+    print(f"Watching {VIDEO_DIR} and {IMAGE_DIR} ({watcher.mode})")
+
+    pool = create_pool(workers) if workers > 1 else None
+    merger = ThreadPoolExecutor(workers, thread_name_prefix="segments") if pool is not None else None
+    futures = {}
+    try:
+        while True:
+            for directory, file_path in watcher.poll(timeout=1.0):
+                kind = kinds[directory]
+                if pool is None:
+                    try:
+                        process_file(kind, file_path)
+                        checkpoint.mark_done(kind, file_path)
+                    except Exception as e:
+                        print(f"Error processing {file_path}: {e}")
+                else:
+                    futures[submit_file(pool, merger, kind, file_path, segments)] = (kind, file_path)
+
+            for future in [future for future in futures if future.done()]:
+                record_completion(checkpoint, future, *futures.pop(future))
+    except KeyboardInterrupt:
+        print("Stopping watch mode")
+    finally:
+        if pool is not None:
+            # Mergers wait on segments in the pool, so they go first
+            merger.shutdown(wait=True)
+            pool.shutdown(wait=True)
+            for future, (kind, file_path) in futures.items():
+                record_completion(checkpoint, future, kind, file_path)
+        watcher.close()
+        checkpoint.close()
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Visitor analytics for recorded videos and images")
+    parser.add_argument("--watch", action="store_true", help="keep running and process new files as they arrive")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="files processed in parallel")
+    parser.add_argument("--segments", type=int, default=VIDEO_SEGMENTS,
+                        help="time segments each video is split into across workers")
+    args = parser.parse_args()
+
+    if args.watch:
+        watch(args.workers, args.segments)
+    else:
+        main(args.workers, args.segments)
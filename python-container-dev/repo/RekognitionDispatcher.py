@@ -0,0 +1,145 @@
+"""Shared, throttling-aware dispatcher for Amazon Rekognition calls.
+
+Calls are submitted as futures and run on a thread pool, so callers can keep
+decoding frames while analysis is pending. The number of requests in flight
+is bounded by a limit that adapts AIMD-style: it grows by roughly one slot per
+round of successful calls and is halved when Rekognition reports throttling.
+Throttled calls are retried with exponential backoff.
+
+Clients passed in should have botocore's own retries turned off (see
+NO_RETRY_CONFIG), otherwise throttling is hidden inside botocore and the
+limit never learns about it.
+"""
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+from Metrics import REKOGNITION_CALLS, STAGE_ERRORS, STAGE_SECONDS
+
+log = logging.getLogger(__name__)
+
+THROTTLING_ERRORS = ("ProvisionedThroughputExceededException", "ThrottlingException")
+
+# Client config for Rekognition clients used with a dispatcher
+NO_RETRY_CONFIG = Config(retries={"mode": "standard", "max_attempts": 1})
+
+
+class RekognitionDispatcher:
+    """Run Rekognition client calls concurrently under an adaptive concurrency limit."""
+
+    def __init__(self, client, max_concurrency=16, initial_concurrency=4, min_concurrency=1,
+                 max_retries=6, base_backoff=0.2, max_backoff=10.0):
+        self.client = client
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="rekognition")
+        self._condition = threading.Condition()
+        self._limit = float(max(min_concurrency, min(initial_concurrency, max_concurrency)))
+        self._in_flight = 0
+        self._last_decrease = 0.0
+
+        # Counters for tuning
+        self.calls = 0
+        self.throttles = 0
+        self.errors = 0
+
+    @property
+    def limit(self):
+        """Current number of requests allowed in flight."""
+        return int(self._limit)
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def submit(self, operation, **kwargs):
+        """Queue `client.<operation>(**kwargs)` and return a Future of its response."""
+        return self._executor.submit(self._call, operation, kwargs)
+
+    def call(self, operation, **kwargs):
+        """Blocking convenience wrapper around submit()."""
+        return self.submit(operation, **kwargs).result()
+
+    def close(self):
+        """Wait for pending calls and stop the worker threads."""
+        self._executor.shutdown(wait=True)
+
+    def _call(self, operation, kwargs):
+        method = getattr(self.client, operation)
+        attempt = 0
+        while True:
+            self._acquire()
+            started = time.perf_counter()
+            try:
+                response = method(**kwargs)
+            except ClientError as e:
+                STAGE_SECONDS.observe(time.perf_counter() - started, stage="rekognition")
+                code = e.response.get("Error", {}).get("Code")
+                if code not in THROTTLING_ERRORS:
+                    REKOGNITION_CALLS.inc(operation=operation, outcome="error")
+                    STAGE_ERRORS.inc(stage="rekognition")
+                    self._on_error()
+                    raise
+                REKOGNITION_CALLS.inc(operation=operation, outcome="throttled")
+                self._on_throttle()
+                if attempt >= self.max_retries:
+                    raise
+                time.sleep(self._backoff(attempt))
+                attempt += 1
+                continue
+            except Exception:
+                STAGE_SECONDS.observe(time.perf_counter() - started, stage="rekognition")
+                REKOGNITION_CALLS.inc(operation=operation, outcome="error")
+                STAGE_ERRORS.inc(stage="rekognition")
+                self._on_error()
+                raise
+            STAGE_SECONDS.observe(time.perf_counter() - started, stage="rekognition")
+            REKOGNITION_CALLS.inc(operation=operation, outcome="ok")
+            self._on_success()
+            return response
+
+    def _backoff(self, attempt):
+        # Full jitter keeps retrying threads from hitting the quota in lockstep
+        return random.uniform(0, min(self.max_backoff, self.base_backoff * (2 ** attempt)))
+
+    def _acquire(self):
+        with self._condition:
+            while self._in_flight >= int(self._limit):
+                self._condition.wait()
+            self._in_flight += 1
+
+    def _on_error(self):
+        with self._condition:
+            self._in_flight -= 1
+            self.errors += 1
+            self._condition.notify()
+
+    def _on_success(self):
+        with self._condition:
+            self._in_flight -= 1
+            self.calls += 1
+            # Additive increase: about +1 slot once a full window of calls succeeded
+            self._limit = min(self.max_concurrency, self._limit + 1.0 / self._limit)
+            self._condition.notify_all()
+
+    def _on_throttle(self):
+        with self._condition:
+            self._in_flight -= 1
+            self.throttles += 1
+            now = time.monotonic()
+            # Multiplicative decrease, at most once per second so a burst of
+            # throttled responses from the same window only halves the limit once
+            if now - self._last_decrease >= 1.0:
+                self._limit = max(self.min_concurrency, self._limit / 2)
+                self._last_decrease = now
+                log.info(f"Rekognition throttled, concurrency limit now {self.limit}")
+            self._condition.notify()
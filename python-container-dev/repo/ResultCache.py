@@ -0,0 +1,130 @@
+"""Content-addressed cache of Rekognition responses.
+
+Frames are keyed by a 128-bit digest of their exact pixels, so a response is
+only reused for a frame identical to the one it was computed for, e.g. when a
+video or image is processed again. Near-duplicates are deliberately not
+matched: a small change such as a visitor far from the camera can leave a
+perceptual hash unchanged and would be served another frame's faces. Skipping
+frames that barely changed is the motion gate's job.
+
+Lookups go to an in-memory LRU first, then to an SQLite file that keeps
+responses across runs and worker processes until they are `ttl` seconds old.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+
+def content_digest(frame):
+    """Digest of a frame's exact pixel content."""
+    return hashlib.blake2b(np.ascontiguousarray(frame).data, digest_size=16).hexdigest()
+
+
+class ResultCache:
+    """Two-tier (memory LRU + SQLite) cache of responses keyed by content digest."""
+
+    def __init__(self, path, capacity=4096, ttl=3600, namespace=""):
+        """
+        Args:
+            path (str): SQLite file for the on-disk tier.
+            capacity (int): Entries kept in the in-memory LRU.
+            ttl (float): Seconds a response stays valid.
+            namespace (str): Part of the key, e.g. the requested attributes, so
+                responses to different requests are never mixed up.
+        """
+        self.capacity = capacity
+        self.ttl = ttl
+        self.namespace = namespace
+        self._memory = OrderedDict()  # digest -> (stored_at, response)
+        self._lock = threading.Lock()
+
+        # Counters for tuning
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # Not "results": that table of older versions is keyed by perceptual hash
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, stored_at REAL, response TEXT)"
+        )
+        self.evict_expired()
+
+    def get(self, digest):
+        """Return the cached response for a frame's content digest, or None."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(digest)
+            if entry is not None and now - entry[0] < self.ttl:
+                self._memory.move_to_end(digest)
+                self.hits += 1
+                return entry[1]
+
+            try:
+                row = self._db.execute(
+                    "SELECT stored_at, response FROM responses WHERE key = ?", (self._key(digest),)
+                ).fetchone()
+            except sqlite3.Error as e:
+                log.error(f"Error reading result cache: {e}")
+                row = None
+            if row is not None and now - row[0] < self.ttl:
+                response = json.loads(row[1])
+                self._remember(digest, row[0], response)
+                self.hits += 1
+                return response
+
+            self.misses += 1
+            return None
+
+    def put(self, digest, response):
+        """Store a response in both tiers."""
+        response = {k: v for k, v in response.items() if k != "ResponseMetadata"}
+        stored_at = time.time()
+        with self._lock:
+            self._remember(digest, stored_at, response)
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, stored_at, response) VALUES (?, ?, ?)",
+                    (self._key(digest), stored_at, json.dumps(response)),
+                )
+                self._db.commit()
+            except sqlite3.Error as e:
+                log.error(f"Error writing result cache: {e}")
+            self._puts += 1
+
+        if self._puts % 1000 == 0:
+            self.evict_expired()
+
+    def evict_expired(self):
+        """Delete on-disk entries older than the TTL."""
+        with self._lock:
+            try:
+                self._db.execute("DELETE FROM responses WHERE stored_at < ?", (time.time() - self.ttl,))
+                self._db.commit()
+            except sqlite3.Error as e:
+                log.error(f"Error evicting result cache: {e}")
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "memory_entries": len(self._memory)}
+
+    def _key(self, digest):
+        return f"{self.namespace}:{digest}"
+
+    def _remember(self, digest, stored_at, response):
+        self._memory[digest] = (stored_at, response)
+        self._memory.move_to_end(digest)
+        while len(self._memory) > self.capacity:
+            self._memory.popitem(last=False)
@@ -0,0 +1,387 @@
+"""Consume a Kinesis Data Stream with one reader thread per shard.
+
+Each reader loops over GetRecords with up to `batch_size` records per call
+and hands every non-empty batch to `handler(shard_id, records)`. Only after
+the handler returns is the batch's last sequence number checkpointed, so a
+restart resumes AFTER_SEQUENCE_NUMBER of the last handled batch and no
+record is lost (a batch may be handled twice after a crash). A batch the
+handler keeps failing on is retried `max_handler_retries` times; then it is
+logged, appended to a dead-letter file if `dead_letter_dir` is set, passed
+to `on_skip`, and skipped, so one bad batch cannot stall its shard. A reader only
+sleeps when a call returned nothing, for `idle_sleep` seconds (GetRecords
+allows 5 calls per second per shard), so new records are handed over within
+a fraction of a second.
+
+The shard list is refreshed every `refresh_interval` seconds. After a
+reshard, a child shard is only read once its parent has been read to the end,
+which keeps the records of a partition key in order.
+
+FileKinesis is a local, file-backed stand-in for the Kinesis client that
+implements the calls used here plus create_stream/put_record, so consumers
+can be exercised offline.
+"""
+import base64
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from botocore.exceptions import ClientError
+
+log = logging.getLogger(__name__)
+
+THROUGHPUT_ERRORS = {"ProvisionedThroughputExceededException", "LimitExceededException"}
+
+
+class ShardCheckpoints:
+    """Last handled sequence number per shard, one item per shard in a DynamoDB table."""
+
+    def __init__(self, table, stream_name, key_name="StreamName", committer=None):
+        """
+        Args:
+            table: boto3 DynamoDB Table resource.
+            stream_name (str): Data stream whose shards are checkpointed.
+            key_name (str): Partition key attribute of the table.
+            committer (CheckpointCommitter): Coalesces the writes (pointer attribute
+                "SequenceNumber" on the same table); without one every put is written.
+        """
+        self.table = table
+        self.stream_name = stream_name
+        self.key_name = key_name
+        self.committer = committer
+
+    def get(self, shard_id):
+        if self.committer is not None:
+            # A restarted reader must not go back to an older committed position
+            position = self.committer.position(self._key(shard_id))
+            if position is not None:
+                return position
+        item = self.table.get_item(Key={self.key_name: self._key(shard_id)}).get("Item")
+        return item.get("SequenceNumber") if item else None
+
+    def put(self, shard_id, sequence_number):
+        if self.committer is not None:
+            self.committer.advance(self._key(shard_id), sequence_number,
+                                   {"LastUpdated": datetime.now(timezone.utc).isoformat()})
+            return
+        self.table.put_item(Item={
+            self.key_name: self._key(shard_id),
+            "SequenceNumber": sequence_number,
+            "LastUpdated": datetime.now(timezone.utc).isoformat(),
+        })
+
+    def _key(self, shard_id):
+        return f"{self.stream_name}#{shard_id}"
+
+
+class ShardConsumer:
+    """Read every shard of a stream in its own thread and pass record batches to a handler."""
+
+    def __init__(self, kinesis, stream_name, handler, checkpoints, batch_size=1000, idle_sleep=0.2,
+                 initial_position="TRIM_HORIZON", refresh_interval=30.0, max_backoff=5.0,
+                 max_handler_retries=5, dead_letter_dir=None, on_skip=None):
+        """
+        Args:
+            kinesis: boto3 Kinesis client (or FileKinesis).
+            stream_name (str): Data stream to consume.
+            handler: Called as handler(shard_id, records) with the records of one GetRecords call.
+            checkpoints: Object with get(shard_id) and put(shard_id, sequence_number).
+            batch_size (int): Limit per GetRecords call, at most 10000.
+            idle_sleep (float): Seconds to wait after a call that returned no records.
+            initial_position (str): Iterator type for shards without a checkpoint,
+                "TRIM_HORIZON" or "LATEST".
+            refresh_interval (float): Seconds between shard list refreshes.
+            max_backoff (float): Longest wait after a throttled call or a failing handler.
+            max_handler_retries (int): Retries of a batch the handler fails on before it is skipped.
+            dead_letter_dir (str): Directory for skipped batches, as <stream>-<shard>.jsonl;
+                None only logs them.
+            on_skip: Called as on_skip(shard_id, records) for a skipped batch, e.g. to
+                discard what the handler buffered for it.
+        """
+        self.kinesis = kinesis
+        self.stream_name = stream_name
+        self.handler = handler
+        self.checkpoints = checkpoints
+        self.batch_size = min(batch_size, 10000)
+        self.idle_sleep = idle_sleep
+        self.initial_position = initial_position
+        self.refresh_interval = refresh_interval
+        self.max_backoff = max_backoff
+        self.max_handler_retries = max_handler_retries
+        self.dead_letter_dir = dead_letter_dir
+        self.on_skip = on_skip
+
+        self._readers = {}     # shard_id -> Thread
+        self._finished = set()  # shards read to their end
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+        # Counters for tuning and lag reporting
+        self.records_handled = 0
+        self.batches_handled = 0
+        self.batches_skipped = 0
+        self.millis_behind = {}  # shard_id -> MillisBehindLatest of the last call
+
+    def start(self):
+        """Start readers for the current shards and a thread that picks up new ones."""
+        self.refresh_shards()
+        threading.Thread(target=self._refresh_periodically, name=f"shards-{self.stream_name}", daemon=True).start()
+
+    def run(self):
+        """Consume until stop() is called (or KeyboardInterrupt), then wait for the readers."""
+        self.start()
+        try:
+            while not self._stopped.wait(1.0):
+                pass
+        finally:
+            self.stop()
+
+    def stop(self, timeout=None):
+        """Stop the readers after their current batch and wait for them."""
+        self._stopped.set()
+        with self._lock:
+            readers = list(self._readers.values())
+        for reader in readers:
+            reader.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            active = sorted(shard_id for shard_id, reader in self._readers.items() if reader.is_alive())
+            millis_behind = dict(self.millis_behind)
+        return {"active_shards": active, "records_handled": self.records_handled,
+                "batches_handled": self.batches_handled, "batches_skipped": self.batches_skipped,
+                "millis_behind": millis_behind}
+
+    def refresh_shards(self):
+        """Start a reader for every shard that is ready to be read and has none yet."""
+        shards = self._list_shards()
+        listed = {shard["ShardId"] for shard in shards}
+        with self._lock:
+            for shard in shards:
+                shard_id = shard["ShardId"]
+                if shard_id in self._readers or self._stopped.is_set():
+                    continue
+                parents = [shard.get("ParentShardId"), shard.get("AdjacentParentShardId")]
+                if any(parent in listed and parent not in self._finished for parent in parents if parent):
+                    continue  # Wait until the parents have been read to the end
+                reader = threading.Thread(target=self._read_shard, args=(shard_id,),
+                                          name=f"shard-{shard_id}", daemon=True)
+                self._readers[shard_id] = reader
+                reader.start()
+                log.info(f"Started reader for {self.stream_name}/{shard_id}")
+
+    def _list_shards(self):
+        shards = []
+        kwargs = {"StreamName": self.stream_name}
+        while True:
+            response = self.kinesis.list_shards(**kwargs)
+            shards.extend(response.get("Shards", []))
+            if not response.get("NextToken"):
+                return shards
+            kwargs = {"NextToken": response["NextToken"]}
+
+    def _refresh_periodically(self):
+        while not self._stopped.wait(self.refresh_interval):
+            try:
+                self.refresh_shards()
+            except Exception as e:
+                log.error(f"Error refreshing shards of {self.stream_name}: {e}")
+
+    def _shard_iterator(self, shard_id, sequence_number):
+        kwargs = {"StreamName": self.stream_name, "ShardId": shard_id}
+        if sequence_number:
+            kwargs.update(ShardIteratorType="AFTER_SEQUENCE_NUMBER", StartingSequenceNumber=sequence_number)
+        else:
+            kwargs["ShardIteratorType"] = self.initial_position
+        return self.kinesis.get_shard_iterator(**kwargs)["ShardIterator"]
+
+    def _read_shard(self, shard_id):
+        try:
+            sequence_number = self.checkpoints.get(shard_id)
+            iterator = self._shard_iterator(shard_id, sequence_number)
+            failures = 0
+            handler_failures = 0
+            while iterator and not self._stopped.is_set():
+                try:
+                    response = self.kinesis.get_records(ShardIterator=iterator, Limit=self.batch_size)
+                except ClientError as e:
+                    code = e.response.get("Error", {}).get("Code")
+                    if code == "ExpiredIteratorException":
+                        iterator = self._shard_iterator(shard_id, sequence_number)
+                        continue
+                    if code not in THROUGHPUT_ERRORS:
+                        raise
+                    failures += 1
+                    self._stopped.wait(self._backoff(failures))
+                    continue
+
+                records = response.get("Records", [])
+                with self._lock:
+                    self.millis_behind[shard_id] = response.get("MillisBehindLatest", 0)
+                if records:
+                    if not self._handle(shard_id, records):
+                        handler_failures += 1
+                        if handler_failures <= self.max_handler_retries:
+                            self._stopped.wait(self._backoff(handler_failures))
+                            continue  # Same iterator, so the batch is handed over again
+                        self._skip(shard_id, records)
+                    handler_failures = 0
+                    sequence_number = records[-1]["SequenceNumber"]
+                    self.checkpoints.put(shard_id, sequence_number)
+                failures = 0
+                iterator = response.get("NextShardIterator")
+                if not records and iterator:
+                    self._stopped.wait(self.idle_sleep)
+
+            if iterator is None:
+                log.info(f"Shard {self.stream_name}/{shard_id} is closed and fully read")
+                with self._lock:
+                    self._finished.add(shard_id)
+                self.refresh_shards()  # Its children can start now
+        except Exception as e:
+            log.error(f"Reader for {self.stream_name}/{shard_id} failed: {e}")
+            with self._lock:
+                self._readers.pop(shard_id, None)  # Restarted by the next refresh
+
+    def _handle(self, shard_id, records):
+        try:
+            self.handler(shard_id, records)
+        except Exception as e:
+            log.error(f"Error handling {len(records)} records from {self.stream_name}/{shard_id}: {e}")
+            return False
+        with self._lock:
+            self.records_handled += len(records)
+            self.batches_handled += 1
+        return True
+
+    def _skip(self, shard_id, records):
+        """Give up on a batch: log it and append it to the shard's dead-letter file."""
+        first, last = records[0]["SequenceNumber"], records[-1]["SequenceNumber"]
+        log.error(f"Skipping {len(records)} records {first}..{last} of {self.stream_name}/{shard_id} "
+                  f"after {self.max_handler_retries} retries")
+        with self._lock:
+            self.batches_skipped += 1
+        if self.on_skip is not None:
+            try:
+                self.on_skip(shard_id, records)
+            except Exception as e:
+                log.error(f"Error in skip callback of {self.stream_name}/{shard_id}: {e}")
+        if not self.dead_letter_dir:
+            return
+        try:
+            os.makedirs(self.dead_letter_dir, exist_ok=True)
+            path = os.path.join(self.dead_letter_dir, f"{self.stream_name}-{shard_id}.jsonl")
+            with open(path, "a") as dead_letter_file:
+                for record in records:
+                    arrived = record.get("ApproximateArrivalTimestamp")
+                    dead_letter_file.write(json.dumps({
+                        "SequenceNumber": record["SequenceNumber"],
+                        "PartitionKey": record.get("PartitionKey"),
+                        "Data": base64.b64encode(record["Data"]).decode("ascii"),
+                        "ApproximateArrivalTimestamp": arrived.isoformat() if arrived else None,
+                    }) + "\n")
+        except OSError as e:
+            log.error(f"Error writing dead-letter records of {self.stream_name}/{shard_id}: {e}")
+
+    def _backoff(self, failures):
+        return min(self.max_backoff, self.idle_sleep * (2 ** failures))
+
+
+class FileKinesis:
+    """Kinesis client stand-in keeping each shard as a JSON-lines file under `directory`.
+
+    A record's sequence number is its zero-padded byte offset in the shard
+    file, so iterators can start at any record without scanning the file.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    def create_stream(self, StreamName, ShardCount=1):
+        os.makedirs(self._stream_dir(StreamName), exist_ok=True)
+        for index in range(ShardCount):
+            open(self._shard_path(StreamName, f"shardId-{index:012d}"), "a").close()
+        return {}
+
+    def list_shards(self, StreamName=None, NextToken=None, **kwargs):
+        stream_dir = self._stream_dir(StreamName or NextToken)
+        if not os.path.isdir(stream_dir):
+            raise ClientError({"Error": {"Code": "ResourceNotFoundException", "Message": stream_dir}}, "ListShards")
+        shard_ids = sorted(name[:-len(".jsonl")] for name in os.listdir(stream_dir) if name.endswith(".jsonl"))
+        return {"Shards": [{"ShardId": shard_id} for shard_id in shard_ids]}
+
+    def put_record(self, StreamName, Data, PartitionKey, **kwargs):
+        shards = self.list_shards(StreamName)["Shards"]
+        digest = int(hashlib.md5(PartitionKey.encode("utf-8")).hexdigest(), 16)
+        shard_id = shards[digest % len(shards)]["ShardId"]
+        data = Data.encode("utf-8") if isinstance(Data, str) else Data
+        line = json.dumps({
+            "Data": base64.b64encode(data).decode("ascii"),
+            "PartitionKey": PartitionKey,
+            "ApproximateArrivalTimestamp": time.time(),
+        }) + "\n"
+        with self._lock, open(self._shard_path(StreamName, shard_id), "a") as shard_file:
+            offset = shard_file.tell()
+            shard_file.write(line)
+        return {"ShardId": shard_id, "SequenceNumber": _sequence_number(offset)}
+
+    def get_shard_iterator(self, StreamName, ShardId, ShardIteratorType, StartingSequenceNumber=None, **kwargs):
+        path = self._shard_path(StreamName, ShardId)
+        if ShardIteratorType == "TRIM_HORIZON":
+            offset = 0
+        elif ShardIteratorType == "LATEST":
+            offset = os.path.getsize(path)
+        elif ShardIteratorType == "AT_SEQUENCE_NUMBER":
+            offset = int(StartingSequenceNumber)
+        elif ShardIteratorType == "AFTER_SEQUENCE_NUMBER":
+            with open(path, "rb") as shard_file:
+                shard_file.seek(int(StartingSequenceNumber))
+                shard_file.readline()
+                offset = shard_file.tell()
+        else:
+            raise ValueError(f"Unsupported shard iterator type {ShardIteratorType!r}")
+        return {"ShardIterator": json.dumps([StreamName, ShardId, offset])}
+
+    def get_records(self, ShardIterator, Limit=10000):
+        stream_name, shard_id, offset = json.loads(ShardIterator)
+        records = []
+        with open(self._shard_path(stream_name, shard_id), "rb") as shard_file:
+            shard_file.seek(offset)
+            while len(records) < Limit:
+                line = shard_file.readline()
+                if not line.endswith(b"\n"):
+                    break  # End of file, or a record still being written
+                entry = json.loads(line)
+                records.append({
+                    "SequenceNumber": _sequence_number(offset),
+                    "Data": base64.b64decode(entry["Data"]),
+                    "PartitionKey": entry["PartitionKey"],
+                    "ApproximateArrivalTimestamp": datetime.fromtimestamp(entry["ApproximateArrivalTimestamp"],
+                                                                          timezone.utc),
+                })
+                offset += len(line)
+            size = os.fstat(shard_file.fileno()).st_size
+
+        millis_behind = 0
+        if records and offset < size:
+            arrived = records[-1]["ApproximateArrivalTimestamp"].timestamp()
+            millis_behind = max(0, int((time.time() - arrived) * 1000))
+        return {
+            "Records": records,
+            "NextShardIterator": json.dumps([stream_name, shard_id, offset]),
+            "MillisBehindLatest": millis_behind,
+        }
+
+    def _stream_dir(self, stream_name):
+        return os.path.join(self.directory, stream_name)
+
+    def _shard_path(self, stream_name, shard_id):
+        return os.path.join(self._stream_dir(stream_name), f"{shard_id}.jsonl")
+
+
+def _sequence_number(offset):
+    return f"{offset:020d}"
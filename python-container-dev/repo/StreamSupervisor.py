@@ -0,0 +1,256 @@
+"""Run the VideoProcessor pipeline for many camera streams in one process.
+
+The streams come from a JSON config file:
+
+    {
+        "report_interval": 60,
+        "streams": [
+            {"stream_name": "booth-01", "processor_name": "booth-01-faces"},
+            {"stream_name": "booth-02", "processor_name": "booth-02-faces",
+             "results_stream": "booth-02-results", "start_timestamp": 1700000000}
+        ]
+    }
+
+Every stream gets a worker thread that starts its Rekognition stream processor
+and consumes the processor's output data stream with a ShardConsumer. A
+processor reads one video stream, so no two streams may share one; without a
+processor_name a stream uses "<STREAM_PROCESSOR_NAME>-<stream_name>". All
+workers use VideoProcessor's module-level clients and StreamMetadataTable, so
+dozens of cameras share one set of connection pools instead of running one
+container each. Each worker has its own analytics writer, so rows one stream
+cannot write never fail another stream's batches.
+
+While running, a worker checks every `health_interval` seconds that its
+stream processor has not gone FAILED or STOPPED and that its consumer still
+has a live shard reader (readers that died are restarted by the consumer's
+shard refresh; after `reader_grace` seconds without one the worker gives up).
+A failed check fails the worker.
+
+A worker that fails is restarted after min(max_backoff, base_backoff *
+2 ** failures) seconds; its failure count resets once it has stayed up for
+`stable_seconds`. Every `report_interval` seconds the supervisor logs each
+stream's throughput (records/s) and lag (the largest MillisBehindLatest over
+its shards) and publishes them as metrics.
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+import VideoProcessor
+from DynamoBatchWriter import BatchWriteError, BatchWriter
+from Metrics import STREAM_LAG_SECONDS, STREAM_RECORDS, STREAM_RESTARTS
+
+log = logging.getLogger(__name__)
+
+STREAMS_CONFIG = os.environ.get("STREAMS_CONFIG", "streams.json")
+
+# Stream processor states after which the worker is restarted (which starts the processor again)
+FAILED_PROCESSOR_STATES = {"FAILED", "STOPPED"}
+
+
+def load_config(path):
+    """Return (streams, report_interval) from a supervisor config file."""
+    with open(path) as config_file:
+        config = json.load(config_file)
+    streams = config.get("streams", [])
+    names = [stream["stream_name"] for stream in streams]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate stream_name in {path}")
+    processors = [stream.get("processor_name") or default_processor_name(stream["stream_name"]) for stream in streams]
+    if len(set(processors)) != len(processors):
+        raise ValueError(f"Duplicate processor_name in {path}")
+    return streams, config.get("report_interval", 60)
+
+
+def default_processor_name(stream_name):
+    """Name of a stream's own Rekognition stream processor when the config names none."""
+    return f"{VideoProcessor.STREAM_PROCESSOR_NAME}-{stream_name}"
+
+
+class StreamWorker:
+    """Rekognition processor plus result consumer for one camera stream."""
+
+    def __init__(self, stream_name, processor_name=None, results_stream=None, start_timestamp=None,
+                 health_interval=10.0, reader_grace=60.0):
+        self.stream_name = stream_name
+        self.processor_name = processor_name or default_processor_name(stream_name)
+        self.results_stream = results_stream
+        self.start_timestamp = start_timestamp
+        self.health_interval = health_interval
+        self.reader_grace = reader_grace
+        self.consumer = None
+        self.writer = BatchWriter(VideoProcessor.dynamodb)
+        self._readers_down_since = None
+
+        # Supervisor bookkeeping
+        self.failures = 0
+        self.restarts = 0
+        self.last_error = None
+        self._records_before = 0  # Handled by consumers of earlier runs
+        self._reported_records = 0
+
+    def run(self, stopped):
+        """Start the processor and consume its results until `stopped` is set."""
+        VideoProcessor.start_stream_processor(self.stream_name, self.processor_name, self.start_timestamp)
+        results_stream = self.results_stream or VideoProcessor.get_results_stream_name(self.processor_name)
+        self.consumer = VideoProcessor.create_results_consumer(self.stream_name, results_stream, writer=self.writer)
+        log.info(f"Consuming Rekognition results for {self.stream_name} from {results_stream}")
+        self.consumer.start()
+        self._readers_down_since = None
+        try:
+            while not stopped.wait(self.health_interval):
+                self.check_health()
+        finally:
+            self.consumer.stop()
+            self._records_before += self.consumer.records_handled
+            self.consumer = None
+
+    def check_health(self):
+        """Raise if the stream processor failed or the consumer has had no live shard reader for too long."""
+        try:
+            status = VideoProcessor.get_stream_processor_status(self.processor_name)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") == "ResourceNotFoundException":
+                raise
+            # Throttled or unavailable; checked again next time
+            log.warning(f"Could not check stream processor {self.processor_name}: {e}")
+            status = None
+        if status in FAILED_PROCESSOR_STATES:
+            raise RuntimeError(f"Stream processor {self.processor_name} is {status}")
+
+        if self.consumer.stats()["active_shards"]:
+            self._readers_down_since = None
+            return
+        now = time.monotonic()
+        if self._readers_down_since is None:
+            self._readers_down_since = now
+        elif now - self._readers_down_since >= self.reader_grace:
+            raise RuntimeError(f"No shard reader of {self.consumer.stream_name} alive for {self.reader_grace:.0f}s")
+
+    def stats(self):
+        consumer = self.consumer
+        stats = consumer.stats() if consumer else {"records_handled": 0, "millis_behind": {}}
+        return {
+            "records_handled": self._records_before + stats["records_handled"],
+            "lag_ms": max(stats["millis_behind"].values(), default=0),
+            "restarts": self.restarts,
+            "last_error": self.last_error,
+        }
+
+
+class StreamSupervisor:
+    """Run a StreamWorker per stream in threads, restarting failed ones with backoff."""
+
+    def __init__(self, workers, report_interval=60, base_backoff=1.0, max_backoff=300.0, stable_seconds=300.0):
+        """
+        Args:
+            workers (list): StreamWorker per stream.
+            report_interval (float): Seconds between throughput and lag reports.
+            base_backoff (float): Wait before the first restart of a failed worker.
+            max_backoff (float): Longest wait between restarts.
+            stable_seconds (float): Uptime after which a worker's failure count resets.
+        """
+        self.workers = workers
+        self.report_interval = report_interval
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.stable_seconds = stable_seconds
+
+        self._threads = []
+        self._stopped = threading.Event()
+        self._reported_at = time.monotonic()
+
+    @classmethod
+    def from_config(cls, path, **kwargs):
+        streams, report_interval = load_config(path)
+        workers = [StreamWorker(**stream) for stream in streams]
+        return cls(workers, report_interval=report_interval, **kwargs)
+
+    def start(self):
+        self._reported_at = time.monotonic()
+        for worker in self.workers:
+            thread = threading.Thread(target=self._supervise, args=(worker,),
+                                      name=f"stream-{worker.stream_name}", daemon=True)
+            self._threads.append(thread)
+            thread.start()
+        log.info(f"Supervising {len(self.workers)} streams")
+
+    def run(self):
+        """Run until stop() is called (or KeyboardInterrupt), reporting every report_interval."""
+        self.start()
+        try:
+            while not self._stopped.wait(self.report_interval):
+                self.report()
+        finally:
+            self.stop()
+
+    def stop(self, timeout=None):
+        """Stop every worker and write what their consumers have buffered."""
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        for worker in self.workers:
+            try:
+                worker.writer.flush()
+            except BatchWriteError as e:
+                # The pointers were only advanced for batches that were written, so they are still committed
+                log.error(f"Analytics rows of {worker.stream_name} left unwritten on stop: {e}")
+        VideoProcessor.checkpoint_committer.flush()
+        VideoProcessor.shard_committer.flush()
+
+    def report(self):
+        """Log and publish throughput and lag per stream; returns them by stream name."""
+        now = time.monotonic()
+        elapsed = max(now - self._reported_at, 1e-9)
+        self._reported_at = now
+
+        report = {}
+        for worker in self.workers:
+            stats = worker.stats()
+            records = stats["records_handled"] - worker._reported_records
+            worker._reported_records = stats["records_handled"]
+
+            STREAM_RECORDS.inc(records, stream=worker.stream_name)
+            STREAM_LAG_SECONDS.set(stats["lag_ms"] / 1000.0, stream=worker.stream_name)
+            report[worker.stream_name] = dict(stats, records_per_second=records / elapsed)
+            log.info(
+                f"{worker.stream_name}: {records / elapsed:.1f} records/s, lag {stats['lag_ms']} ms, "
+                f"{worker.restarts} restarts"
+            )
+        return report
+
+    def _supervise(self, worker):
+        while not self._stopped.is_set():
+            started = time.monotonic()
+            try:
+                worker.run(self._stopped)
+            except Exception as e:
+                worker.last_error = str(e)
+                log.error(f"Worker for {worker.stream_name} failed: {e}")
+            if self._stopped.is_set():
+                return
+
+            if time.monotonic() - started >= self.stable_seconds:
+                worker.failures = 0
+            delay = min(self.max_backoff, self.base_backoff * (2 ** worker.failures))
+            worker.failures += 1
+            worker.restarts += 1
+            STREAM_RESTARTS.inc(stream=worker.stream_name)
+            log.info(f"Restarting worker for {worker.stream_name} in {delay:.1f}s")
+            self._stopped.wait(delay)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rekognition stream processing for many camera streams")
+    parser.add_argument("--config", default=STREAMS_CONFIG, help="JSON file listing the streams")
+    args = parser.parse_args()
+
+    try:
+        StreamSupervisor.from_config(args.config).run()
+    except KeyboardInterrupt:
+        log.info("Stopping stream supervisor")
@@ -1,24 +1,76 @@
 import boto3
-import time
+import json
+import os
 from datetime import datetime, timezone
+from decimal import Decimal
 import logging
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from CheckpointCommitter import CheckpointCommitter
+from DynamoBatchWriter import BatchWriter
+from EndpointCache import EndpointCache
+from ShardConsumer import FileKinesis, ShardCheckpoints, ShardConsumer
+
+STREAM_PROCESSOR_NAME = "YourRekognitionStreamProcessor"  # Replace with your processor name
+# Output data stream of the processor; looked up with describe_stream_processor when unset
+RESULTS_STREAM_NAME = os.environ.get("RESULTS_STREAM_NAME", "")
+# Directory of a FileKinesis stand-in to read results from instead of Kinesis (offline testing)
+KINESIS_LOCAL_DIR = os.environ.get("KINESIS_LOCAL_DIR", "")
+# Directory for result batches the handler keeps failing on; they are skipped after a few retries.
+# Relative paths are resolved once at import, so the working directory cannot move it later.
+SHARD_DEAD_LETTER_DIR = os.path.abspath(os.environ.get(
+    "SHARD_DEAD_LETTER_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "dead-letter")
+))
+# Connections per client; StreamSupervisor runs every stream's shard readers on these clients
+MAX_POOL_CONNECTIONS = int(os.environ.get("MAX_POOL_CONNECTIONS", "50"))
+client_config = Config(max_pool_connections=MAX_POOL_CONNECTIONS)
 
 # AWS clients
-rekognition_client = boto3.client("rekognition")
+rekognition_client = boto3.client("rekognition", config=client_config)
 kvs_client = boto3.client("kinesisvideo")
-dynamodb = boto3.resource("dynamodb")
+endpoint_cache = EndpointCache(kvs_client)  # KVS data endpoints, shared with the other scripts
+kinesis_client = (
+    FileKinesis(KINESIS_LOCAL_DIR) if KINESIS_LOCAL_DIR else boto3.client("kinesis", config=client_config)
+)
+dynamodb = boto3.resource("dynamodb", config=client_config)
 analytics_table = dynamodb.Table("BoothAnalyticsTable")
 metadata_table = dynamodb.Table("StreamMetadataTable")
+analytics_writer = BatchWriter(dynamodb)  # Batches analytics rows with batch_write_item
+
+# Stream and shard pointers are committed at most once per interval, and only forward
+CHECKPOINT_INTERVAL_SECONDS = float(os.environ.get("CHECKPOINT_INTERVAL_SECONDS", "10"))
+checkpoint_committer = CheckpointCommitter(
+    dynamodb, metadata_table.name, lambda stream_name: {"StreamName": stream_name},
+    pointer_attribute="LastProcessedFragment", interval=CHECKPOINT_INTERVAL_SECONDS
+)
+shard_committer = CheckpointCommitter(
+    dynamodb, metadata_table.name, lambda shard_key: {"StreamName": shard_key},
+    pointer_attribute="SequenceNumber", interval=CHECKPOINT_INTERVAL_SECONDS
+)
+
+# Optional hourly Parquet copy of the analytics: s3://bucket/prefix or a local directory.
+# pyarrow is only needed when it is enabled.
+ANALYTICS_PARQUET_URL = os.environ.get("ANALYTICS_PARQUET_URL", "")
+parquet_sink = None
+if ANALYTICS_PARQUET_URL:
+    import pyarrow as pa
+    from ParquetSink import ParquetSink
+
+    ANALYTICS_SCHEMA = pa.schema([
+        ("Timestamp", pa.float64()),
+        ("Face", pa.string()),      # JSON
+        ("AgeGroup", pa.string()),
+        ("Gender", pa.string()),
+        ("Emotions", pa.string()),  # JSON
+    ])
+    parquet_sink = ParquetSink(ANALYTICS_PARQUET_URL, ANALYTICS_SCHEMA)
 
 # Logger setup
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 def get_data_endpoint(stream_name):
-    response = kvs_client.get_data_endpoint(
-        StreamName=stream_name, APIName="GET_MEDIA_FOR_FRAGMENT_LIST"
-    )
-    return response["DataEndpoint"]
+    return endpoint_cache.get(stream_name, "GET_MEDIA_FOR_FRAGMENT_LIST")
 
 def get_last_processed_fragment(stream_name):
     """Fetch the last processed fragment or timestamp from the metadata table."""
@@ -30,108 +82,152 @@ def get_last_processed_fragment(stream_name):
         return None
 
 def update_last_processed_fragment(stream_name, fragment_number):
-    """Update the metadata table with the last processed fragment."""
+    """Advance the last processed fragment; committed to the metadata table by checkpoint_committer."""
     try:
-        metadata_table.put_item(
-            Item={
-                "StreamName": stream_name,
-                "LastProcessedFragment": fragment_number,
-                "LastUpdated": datetime.now(timezone.utc).isoformat(),
-            }
+        checkpoint_committer.advance(
+            stream_name, fragment_number, {"LastUpdated": datetime.now(timezone.utc).isoformat()}
         )
-        logger.info(f"Updated last processed fragment: {fragment_number}")
     except Exception as e:
         logger.error(f"Error updating metadata: {e}")
 
-def process_video_with_rekognition(stream_name, start_timestamp=None):
-    """Process video using Amazon Rekognition, starting from a specific timestamp or the last processed fragment."""
-    try:
-        last_fragment = get_last_processed_fragment(stream_name)
-        start_selector = (
-            {"StartSelectorType": "FRAGMENT_NUMBER", "AfterFragmentNumber": last_fragment}
-            if last_fragment
-            else {"StartSelectorType": "PRODUCER_TIMESTAMP", "StartTimestamp": start_timestamp}
-            if start_timestamp
-            else {"StartSelectorType": "NOW"}
-        )
-        
-        logger.info(f"Starting Rekognition with selector: {start_selector}")
+def get_results_stream_name(processor_name):
+    """Name of the Kinesis Data Stream a stream processor writes its results to."""
+    response = rekognition_client.describe_stream_processor(Name=processor_name)
+    stream_arn = response["Output"]["KinesisDataStream"]["Arn"]
+    return stream_arn.split(":stream/", 1)[1]
+
+def get_stream_processor_status(processor_name):
+    """Status of a stream processor: STARTING, RUNNING, FAILED, STOPPED, ..."""
+    return rekognition_client.describe_stream_processor(Name=processor_name)["Status"]
+
+def start_stream_processor(stream_name, processor_name=STREAM_PROCESSOR_NAME, start_timestamp=None):
+    """Start a stream processor at a specific timestamp or after the last processed fragment."""
+    last_fragment = get_last_processed_fragment(stream_name)
+    start_selector = (
+        {"StartSelectorType": "FRAGMENT_NUMBER", "AfterFragmentNumber": last_fragment}
+        if last_fragment
+        else {"StartSelectorType": "PRODUCER_TIMESTAMP", "StartTimestamp": start_timestamp}
+        if start_timestamp
+        else {"StartSelectorType": "NOW"}
+    )
 
-        response = rekognition_client.start_stream_processor(
-            Name="YourRekognitionStreamProcessor",  # Replace with your processor name
+    logger.info(f"Starting Rekognition with selector: {start_selector}")
+
+    try:
+        rekognition_client.start_stream_processor(
+            Name=processor_name,
             StartSelector=start_selector,
         )
-        logger.info(f"Started Rekognition Stream Processor for {stream_name}")
-
-        while True:
-            # Pseudocode to fetch analytics results
-            analytics, last_fragment_number = get_rekognition_results()  # Replace with actual implementation
-            if analytics:
-                store_analytics(analytics)
-                update_last_processed_fragment(stream_name, last_fragment_number)
-            time.sleep(5)  # Poll every 5 seconds
-    except Exception as e:
-        logger.error(f"Failed to process video with Rekognition: {e}")
-
-def store_analytics(analytics):
-    """Store analytics data in DynamoDB."""
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") != "ResourceInUseException":
+            raise
+        logger.info(f"Rekognition Stream Processor {processor_name} is already running")
+        return
+    logger.info(f"Started Rekognition Stream Processor for {stream_name}")
+
+def process_video_with_rekognition(stream_name, start_timestamp=None, processor_name=STREAM_PROCESSOR_NAME,
+                                   results_stream=None):
+    """Process video using Amazon Rekognition, starting from a specific timestamp or the last processed fragment."""
     try:
-        analytics_table.put_item(Item=analytics)
-        logger.info(f"Stored analytics: {analytics}")
+        start_stream_processor(stream_name, processor_name, start_timestamp)
+        results_stream = results_stream or RESULTS_STREAM_NAME or get_results_stream_name(processor_name)
+        consume_rekognition_results(stream_name, results_stream)
     except Exception as e:
-        logger.error(f"Failed to store analytics in DynamoDB: {e}")
+        logger.error(f"Failed to process video with Rekognition: {e}")
 
-def get_rekognition_results():
-    """Fetches the analysis results from Amazon Rekognition and returns them."""
-    try:
-        # Example stream processor name (replace with your actual stream processor)
-        stream_processor_name = "YourRekognitionStreamProcessor"
+def create_results_consumer(stream_name, results_stream, kinesis=None, writer=None):
+    """ShardConsumer storing the results a stream processor writes to its output data stream.
+
+    Every shard of `results_stream` is read by its own thread, and a batch is
+    written to DynamoDB before its shard checkpoint and the stream's last
+    processed fragment move past it. If the write fails the handler raises, so
+    neither pointer moves and the consumer hands the batch over again, until
+    it gives up, dead-letters the batch to SHARD_DEAD_LETTER_DIR and discards
+    its buffered rows. Pass each stream its own `writer` so that rows one
+    stream cannot write do not fail the others' flushes.
+    """
+    writer = analytics_writer if writer is None else writer
+    buffered = {}  # shard_id -> (last sequence number, writer keys) of a batch whose rows are still buffered
+
+    def handle_records(shard_id, records):
+        analytics, last_fragment_number = parse_rekognition_records(records)
+        if analytics:
+            last_sequence = records[-1]["SequenceNumber"]
+            if buffered.get(shard_id, (None,))[0] != last_sequence:
+                # A retried batch's rows are still in the writer, so they are only buffered once
+                buffered[shard_id] = (last_sequence, store_analytics(analytics, stream_name, writer))
+            # Raises BatchWriteError while rows are unwritten; the pointers stay behind them
+            writer.flush()
+            buffered.pop(shard_id, None)
+        if last_fragment_number:
+            update_last_processed_fragment(stream_name, last_fragment_number)
+
+    def discard_records(shard_id, records):
+        _, keys = buffered.pop(shard_id, (None, []))
+        writer.discard(keys)
+
+    return ShardConsumer(
+        kinesis or kinesis_client,
+        results_stream,
+        handle_records,
+        ShardCheckpoints(metadata_table, results_stream, committer=shard_committer),
+        dead_letter_dir=SHARD_DEAD_LETTER_DIR,
+        on_skip=discard_records,
+    )
 
-        # Fetch the current status of the stream processor
-        response = rekognition_client.describe_stream_processor(
-            StreamProcessorName=stream_processor_name
-        )
+def consume_rekognition_results(stream_name, results_stream, kinesis=None):
+    """Store the stream processor's results as they arrive, until interrupted."""
+    logger.info(f"Consuming Rekognition results for {stream_name} from {results_stream}")
+    create_results_consumer(stream_name, results_stream, kinesis).run()
 
-        status = response['StreamProcessor']['Status']
-        
-        if status == 'RUNNING':
-            # If the processor is running, attempt to get the results from the processor
-            results_response = rekognition_client.get_stream_processor(
-                StreamProcessorName=stream_processor_name
-            )
-            
-            # Process the results from the stream processor (e.g., face detection, age, mood, etc.)
-            # Assuming you're interested in face analysis and associated data like age, gender, mood
-            # Example logic for processing Rekognition results
-            analytics = []
-            fragments = results_response.get('VideoAnalytics', [])
-            
-            for fragment in fragments:
-                for face in fragment.get('Faces', []):
-                    # Extract face metadata (age group, gender, emotion, etc.)
-                    analytics.append({
-                        'Timestamp': fragment['Timestamp'],
-                        'Face': face['Face'],
-                        'AgeGroup': face.get('AgeRange', 'Unknown'),
-                        'Gender': face.get('Gender', {}).get('Value', 'Unknown'),
-                        'Emotions': face.get('Emotions', []),
-                    })
-            
-            # Determine the last fragment number (for updating in metadata)
-            last_fragment_number = results_response.get('LastFragmentNumber', None)
-
-            return analytics, last_fragment_number
-
-        elif status == 'FAILED':
-            logger.error(f"Stream Processor {stream_processor_name} failed.")
-            return [], None
-        else:
-            logger.info(f"Stream Processor {stream_processor_name} not yet running.")
-            return [], None
+def store_analytics(analytics, stream_name=None, writer=None):
+    """Buffer analytics data (one result or a list of results) for DynamoDB and the Parquet sink.
 
+    Returns the writer keys of the buffered rows.
+    """
+    writer = analytics_writer if writer is None else writer
+    keys = []
+    try:
+        records = analytics if isinstance(analytics, list) else [analytics]
+        for record in records:
+            keys.append(writer.put_item(analytics_table.name, record))
+            if parquet_sink is not None:
+                timestamp = record.get("Timestamp")
+                parquet_sink.put(
+                    stream_name or "unknown", record,
+                    timestamp if isinstance(timestamp, (int, float, Decimal)) else None
+                )
+        logger.info(f"Stored analytics: {analytics}")
     except Exception as e:
-        logger.error(f"Error getting Rekognition results: {e}")
-        return [], None
+        logger.error(f"Failed to store analytics in DynamoDB: {e}")
+    return keys
+
+def parse_rekognition_records(records):
+    """Turn stream processor output records into analytics rows and the last fragment number."""
+    analytics = []
+    last_fragment_number = None
+    for record in records:
+        try:
+            # Decimal instead of float, as the DynamoDB resource requires
+            result = json.loads(record["Data"], parse_float=Decimal)
+        except ValueError as e:
+            logger.error(f"Skipping malformed Rekognition record {record.get('SequenceNumber')}: {e}")
+            continue
+
+        fragment = result.get("InputInformation", {}).get("KinesisVideo", {})
+        for face in result.get("FaceSearchResponse", []):
+            detected = face.get("DetectedFace", {})
+            # Extract face metadata (age group, gender, emotion, etc.)
+            analytics.append({
+                'Timestamp': fragment.get('ProducerTimestamp', fragment.get('ServerTimestamp')),
+                'Face': detected,
+                'AgeGroup': detected.get('AgeRange', 'Unknown'),
+                'Gender': detected.get('Gender', {}).get('Value', 'Unknown'),
+                'Emotions': detected.get('Emotions', []),
+            })
+        last_fragment_number = fragment.get("FragmentNumber", last_fragment_number)
+
+    return analytics, last_fragment_number
 
 # Entry point
 if __name__ == "__main__":
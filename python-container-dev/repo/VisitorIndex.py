@@ -0,0 +1,196 @@
+"""Re-identification of visitors across sampled frames.
+
+Each face Rekognition reports is aligned to a 112x112 crop with its landmarks
+and embedded with OpenCV's SFace face recognition model (FaceRecognizerSF),
+a 128-d vector trained so that faces of the same person are close in cosine
+similarity. Embeddings of recently seen visitors live in a fixed-size NumPy
+array, so matching a face is one matrix-vector product against it. Entries
+not seen for `ttl` seconds expire, and when the array is full the least
+recently seen entry is replaced.
+
+On a local miss an optional `fallback` is asked before a new visitor is
+created, e.g. a Rekognition face collection search, so a visitor who returns
+after expiring from the local index keeps their id. New visitors are handed
+to `register` so the fallback can find them later. Both are remote calls, so
+a miss only uses them while the shared `limiter` has a token; otherwise the
+face becomes a new visitor locally.
+"""
+import threading
+import time
+import uuid
+
+import cv2
+import numpy as np
+
+from Metrics import VISITOR_FALLBACKS
+
+EMBEDDING_SIZE = 128
+ALIGNED_SIZE = 112
+# Cosine similarity at which SFace embeddings are the same person, as
+# calibrated for the model on LFW (OpenCV's face recognition sample)
+SFACE_COSINE_THRESHOLD = 0.363
+
+# Where SFace expects the eyes, nose tip and mouth corners in its 112x112 input
+SFACE_LANDMARKS = np.array([
+    [38.2946, 51.6963], [73.5318, 51.5014], [56.0252, 71.7366], [41.5493, 92.3655], [70.7299, 92.2041]
+], dtype=np.float32)
+REKOGNITION_LANDMARKS = ("eyeLeft", "eyeRight", "nose", "mouthLeft", "mouthRight")
+
+
+def face_crop(frame, bounding_box):
+    """Crop a BGR frame to a Rekognition BoundingBox (ratios of the frame size), or None if empty."""
+    height, width = frame.shape[:2]
+    left = max(0, int(bounding_box.get("Left", 0) * width))
+    top = max(0, int(bounding_box.get("Top", 0) * height))
+    right = min(width, int((bounding_box.get("Left", 0) + bounding_box.get("Width", 0)) * width))
+    bottom = min(height, int((bounding_box.get("Top", 0) + bounding_box.get("Height", 0)) * height))
+    if right - left < 2 or bottom - top < 2:
+        return None
+    return frame[top:bottom, left:right]
+
+
+def aligned_face(frame, face_detail):
+    """112x112 face of a Rekognition FaceDetail, aligned by its landmarks, or None if empty.
+
+    Without all five landmarks the BoundingBox crop is resized instead.
+    """
+    landmarks = {landmark.get("Type"): landmark for landmark in face_detail.get("Landmarks", [])}
+    if all(name in landmarks for name in REKOGNITION_LANDMARKS):
+        height, width = frame.shape[:2]
+        points = np.array(
+            [[landmarks[name]["X"] * width, landmarks[name]["Y"] * height] for name in REKOGNITION_LANDMARKS],
+            dtype=np.float32
+        )
+        transform, _ = cv2.estimateAffinePartial2D(points, SFACE_LANDMARKS, method=cv2.LMEDS)
+        if transform is not None:
+            return cv2.warpAffine(frame, transform, (ALIGNED_SIZE, ALIGNED_SIZE))
+    crop = face_crop(frame, face_detail.get("BoundingBox", {}))
+    if crop is None:
+        return None
+    return cv2.resize(crop, (ALIGNED_SIZE, ALIGNED_SIZE), interpolation=cv2.INTER_AREA)
+
+
+class FaceEmbedder:
+    """SFace face embeddings (face_recognition_sface_2021dec.onnx from the OpenCV model zoo)."""
+
+    def __init__(self, model_path):
+        self._model = cv2.FaceRecognizerSF.create(model_path, "")
+        self._lock = threading.Lock()  # One network, not safe for concurrent forward passes
+
+    def embed(self, face):
+        """Unit-length embedding of an aligned BGR face (see aligned_face)."""
+        if face.shape[:2] != (ALIGNED_SIZE, ALIGNED_SIZE):
+            face = cv2.resize(face, (ALIGNED_SIZE, ALIGNED_SIZE), interpolation=cv2.INTER_AREA)
+        if face.ndim == 2:
+            face = cv2.cvtColor(face, cv2.COLOR_GRAY2BGR)
+        with self._lock:
+            vector = self._model.feature(np.ascontiguousarray(face)).astype(np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+
+class RateLimiter:
+    """Token bucket: `rate` acquisitions per second on average, bursts of up to `burst`."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        """Take a token if one is available, without waiting."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class VisitorIndex:
+    """In-memory cosine-similarity index of recently seen face embeddings."""
+
+    def __init__(self, embedder, capacity=1024, threshold=SFACE_COSINE_THRESHOLD, ttl=600, fallback=None,
+                 register=None, limiter=None, dimension=EMBEDDING_SIZE):
+        """
+        Args:
+            embedder (FaceEmbedder): Turns aligned faces into unit-length embeddings.
+            capacity (int): Visitors kept in the index.
+            threshold (float): Minimum cosine similarity for a match.
+            ttl (float): Seconds (of the caller's clock) after which an unseen visitor expires.
+            fallback (callable): face -> visitor id or None, asked on a local miss.
+            register (callable): (face, visitor id) for visitors neither lookup found.
+            limiter (RateLimiter): Bounds how often a miss may use fallback and register,
+                shared by the indexes that use the same remote service. None: always.
+        """
+        self.embedder = embedder
+        self.capacity = capacity
+        self.threshold = threshold
+        self.ttl = ttl
+        self.fallback = fallback
+        self.register = register
+        self.limiter = limiter
+
+        self._vectors = np.zeros((capacity, dimension), dtype=np.float32)
+        self._last_seen = np.full(capacity, -np.inf)
+        self._ids = [None] * capacity
+        self._lock = threading.Lock()
+
+        # Counters for tuning
+        self.local_hits = 0
+        self.fallback_hits = 0
+        self.fallbacks_skipped = 0
+        self.new_visitors = 0
+
+    def identify(self, face, now):
+        """Return (visitor_id, new_visit) for an aligned face seen at time `now`.
+
+        `new_visit` is True when the visitor was not in the local index, i.e.
+        they are new or return after expiring.
+        """
+        embedding = self.embedder.embed(face)
+        with self._lock:
+            active = now - self._last_seen <= self.ttl
+            if active.any():
+                similarities = np.where(active, self._vectors @ embedding, -1.0)
+                slot = int(np.argmax(similarities))
+                if similarities[slot] >= self.threshold:
+                    # Follow gradual changes in pose and lighting
+                    blended = self._vectors[slot] + embedding
+                    self._vectors[slot] = blended / (np.linalg.norm(blended) or 1.0)
+                    self._last_seen[slot] = now
+                    self.local_hits += 1
+                    return self._ids[slot], False
+
+        visitor_id = None
+        remote = self.fallback is not None or self.register is not None
+        if remote and self.limiter is not None and not self.limiter.try_acquire():
+            remote = False
+            self.fallbacks_skipped += 1
+            VISITOR_FALLBACKS.inc(outcome="rate_limited")
+        if remote and self.fallback is not None:
+            visitor_id = self.fallback(face)
+            VISITOR_FALLBACKS.inc(outcome="matched" if visitor_id is not None else "unmatched")
+        if visitor_id is not None:
+            self.fallback_hits += 1
+        else:
+            visitor_id = str(uuid.uuid4())
+            self.new_visitors += 1
+            if remote and self.register is not None:
+                self.register(face, visitor_id)
+
+        with self._lock:
+            # Expired or least recently seen slot
+            slot = int(np.argmin(self._last_seen))
+            self._vectors[slot] = embedding
+            self._last_seen[slot] = now
+            self._ids[slot] = visitor_id
+        return visitor_id, True
+
+    def stats(self):
+        return {"local_hits": self.local_hits, "fallback_hits": self.fallback_hits,
+                "fallbacks_skipped": self.fallbacks_skipped, "new_visitors": self.new_visitors}
@@ -0,0 +1,110 @@
+"""Write-behind buffer of per-visitor counters in DynamoDB.
+
+Increments of visit_count and dwell_time are coalesced per visitor and
+written every `flush_interval` seconds (and on close()/interpreter exit) as
+one UpdateItem each, using ADD so that updates from concurrent workers add up
+instead of overwriting each other. Since ADD needs no read of the current
+row, the hot path never reads the table.
+"""
+import atexit
+import logging
+import threading
+
+from Metrics import DYNAMODB_ITEMS_WRITTEN, stage
+
+log = logging.getLogger(__name__)
+
+COUNTERS = ("visit_count", "dwell_time")
+
+
+class VisitorStateCache:
+    """Coalesce visitor counter increments and write them in the background."""
+
+    def __init__(self, table, key_name="visitor_id", flush_interval=5.0):
+        """
+        Args:
+            table: boto3 DynamoDB Table resource.
+            key_name (str): Partition key attribute of the table.
+            flush_interval (float): Maximum age in seconds of a pending increment.
+        """
+        self.table = table
+        self.key_name = key_name
+        self.flush_interval = flush_interval
+
+        self._pending = {}  # visitor_id -> {"visit_count", "dwell_time", "last_seen"}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._closed = threading.Event()
+
+        # Counters for tuning
+        self.increments = 0
+        self.updates_written = 0
+
+        self._flusher = threading.Thread(target=self._flush_periodically, name="visitor-state", daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+
+    def increment(self, visitor_id, visit_count=0, dwell_time=0, last_seen=None):
+        """Add to a visitor's counters; written on the next flush."""
+        with self._lock:
+            pending = self._pending.setdefault(visitor_id, {"visit_count": 0, "dwell_time": 0, "last_seen": None})
+            pending["visit_count"] += visit_count
+            pending["dwell_time"] += dwell_time
+            if last_seen is not None:
+                pending["last_seen"] = last_seen
+            self.increments += 1
+
+    def flush(self):
+        """Write all pending increments."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+
+            for visitor_id, delta in pending.items():
+                try:
+                    self._update(visitor_id, delta)
+                except Exception as e:
+                    log.error(f"Error updating visitor {visitor_id}: {e}")
+                    self._restore(visitor_id, delta)
+                    continue
+                self.updates_written += 1
+
+    def close(self):
+        """Stop the background flusher and write what is left."""
+        self._closed.set()
+        self.flush()
+
+    def stats(self):
+        return {"increments": self.increments, "updates_written": self.updates_written}
+
+    def _update(self, visitor_id, delta):
+        expression = "ADD visit_count :visit_count, dwell_time :dwell_time"
+        values = {":visit_count": delta["visit_count"], ":dwell_time": delta["dwell_time"]}
+        if delta["last_seen"] is not None:
+            expression = "SET last_seen = :last_seen " + expression
+            values[":last_seen"] = delta["last_seen"]
+        with stage("dynamodb_write"):
+            self.table.update_item(
+                Key={self.key_name: visitor_id},
+                UpdateExpression=expression,
+                ExpressionAttributeValues=values,
+            )
+        DYNAMODB_ITEMS_WRITTEN.inc(table=self.table.name)
+
+    def _restore(self, visitor_id, delta):
+        """Put a failed delta back in front of newer increments."""
+        with self._lock:
+            newer = self._pending.get(visitor_id)
+            if newer is not None:
+                for name in COUNTERS:
+                    delta[name] += newer[name]
+                delta["last_seen"] = newer["last_seen"] or delta["last_seen"]
+            self._pending[visitor_id] = delta
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                log.error(f"Error flushing visitor state: {e}")
+
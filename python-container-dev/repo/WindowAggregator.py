@@ -0,0 +1,137 @@
+"""Tumbling-window aggregation of per-frame demographics.
+
+Per-frame summaries are folded into one record per camera per window (for
+example one minute) and handed to `emit` when the window closes: when a frame
+from a later window arrives for the same camera, or on flush(). Each record
+carries the overall age range (min of lows, max of highs), gender and emotion
+counts, impressions, the number of frames it covers and, when frames carry
+visitor ids, the number of distinct visitors.
+"""
+import threading
+from datetime import datetime
+
+
+def summarize_faces(face_details):
+    """Per-frame summary of a Rekognition FaceDetails list."""
+    age_ranges = [face["AgeRange"] for face in face_details if "AgeRange" in face]
+    gender_counts = {"Male": 0, "Female": 0, "Unknown": 0}
+    emotion_counts = {}
+
+    for face in face_details:
+        gender = face.get("Gender", {}).get("Value", "Unknown")
+        gender_counts[gender] = gender_counts.get(gender, 0) + 1
+
+        for emotion in face.get("Emotions", []):
+            emotion_name = emotion.get("Type")
+            if emotion_name:
+                emotion_counts[emotion_name] = emotion_counts.get(emotion_name, 0) + 1
+
+    return {
+        "overall_age_range": {
+            "Min": min(age["Low"] for age in age_ranges) if age_ranges else None,
+            "Max": max(age["High"] for age in age_ranges) if age_ranges else None,
+        },
+        "gender_distribution": gender_counts,
+        "emotion_counts": emotion_counts,
+        "foot_impressions": len(face_details),
+    }
+
+
+class WindowAggregator:
+    """Fold per-frame summaries into per-camera tumbling windows."""
+
+    def __init__(self, emit, window_seconds=60):
+        """
+        Args:
+            emit (callable): Called with each finished window record (a dict).
+            window_seconds (int): Window length, in the units of the event times passed to add().
+        """
+        self.emit = emit
+        self.window_seconds = window_seconds
+        self._windows = {}  # camera_id -> open window
+        self._lock = threading.Lock()
+
+    def window_start(self, event_time):
+        return int(event_time // self.window_seconds * self.window_seconds)
+
+    def add(self, camera_id, event_time, summary):
+        """Add a frame summary (see summarize_faces) observed at `event_time` seconds."""
+        start = self.window_start(event_time)
+        closed = None
+        with self._lock:
+            window = self._windows.get(camera_id)
+            if window is not None and window["window_start"] != start:
+                closed = self._windows.pop(camera_id)
+                window = None
+            if window is None:
+                window = self._windows[camera_id] = _new_window(camera_id, start, self.window_seconds)
+            _fold(window, summary)
+
+        if closed is not None:
+            self.emit(_finish(closed))
+
+    def flush(self, camera_id=None):
+        """Emit the open window of one camera, or of every camera."""
+        with self._lock:
+            if camera_id is None:
+                closed = list(self._windows.values())
+                self._windows.clear()
+            else:
+                window = self._windows.pop(camera_id, None)
+                closed = [window] if window is not None else []
+
+        for window in closed:
+            self.emit(_finish(window))
+
+
+def _new_window(camera_id, start, window_seconds):
+    return {
+        "camera_id": camera_id,
+        "window_start": start,
+        "window_end": start + window_seconds,
+        "frames": 0,
+        "age_min": None,
+        "age_max": None,
+        "gender_distribution": {"Male": 0, "Female": 0, "Unknown": 0},
+        "emotion_counts": {},
+        "foot_impressions": 0,
+        "peak_impressions": 0,
+        "visitor_ids": set(),
+    }
+
+
+def _fold(window, summary):
+    window["frames"] += 1
+
+    age_range = summary["overall_age_range"]
+    if age_range["Min"] is not None:
+        window["age_min"] = age_range["Min"] if window["age_min"] is None else min(window["age_min"], age_range["Min"])
+    if age_range["Max"] is not None:
+        window["age_max"] = age_range["Max"] if window["age_max"] is None else max(window["age_max"], age_range["Max"])
+
+    for gender, count in summary["gender_distribution"].items():
+        window["gender_distribution"][gender] = window["gender_distribution"].get(gender, 0) + count
+    for emotion, count in summary["emotion_counts"].items():
+        window["emotion_counts"][emotion] = window["emotion_counts"].get(emotion, 0) + count
+
+    window["foot_impressions"] += summary["foot_impressions"]
+    window["peak_impressions"] = max(window["peak_impressions"], summary["foot_impressions"])
+    window["visitor_ids"].update(summary.get("visitor_ids", ()))
+
+
+def _finish(window):
+    return {
+        "camera_id": window["camera_id"],
+        "window_start": window["window_start"],
+        "window_end": window["window_end"],
+        "timestamp": datetime.utcnow().isoformat(),
+        "frames": window["frames"],
+        "demographics": {
+            "overall_age_range": {"Min": window["age_min"], "Max": window["age_max"]},
+            "gender_distribution": window["gender_distribution"],
+            "emotion_counts": window["emotion_counts"],
+        },
+        "foot_impressions": window["foot_impressions"],
+        "peak_impressions": window["peak_impressions"],
+        "unique_visitors": len(window["visitor_ids"]),
+    }
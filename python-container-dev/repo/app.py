@@ -1,7 +1,9 @@
 # app.py docker run -it --rm -v $(pwd):/app python-container-dev_python-dev /bin/bash
 #docker run -it --rm -v $(pwd):/app -v /Users/veer/.aws:/root/.aws python-container-dev_python-dev /bin/bash
 
-from flask import Flask
+from flask import Flask, Response
+
+from Metrics import render
 
 app = Flask(__name__)
 
@@ -9,5 +11,10 @@ app = Flask(__name__)
 def home():
     return "Hello from Flask in Docker!"
 
+@app.route("/metrics")
+def metrics():
+    # Prometheus scrape endpoint; includes the snapshots other processes write to METRICS_DIR
+    return Response(render(), mimetype="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000)
@@ -0,0 +1,61 @@
+"""Compare decode backends and sampling modes on local video files.
+
+Usage:
+    python benchmarks/decode_backends.py videos/*.mkv [--interval 10] [--repeat 3]
+
+For every backend and mode it reports the frames sampled, the best wall time
+over the repeats and how many seconds of video were sampled per second of
+decoding. Fragment extraction (every n-th frame of the whole file, as done
+for KVS fragments) is measured too.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from DecodeBackend import DECODE_BACKENDS, get_decode_backend  # noqa: E402
+from FrameSampler import SAMPLING_MODES, sample_frames, video_duration_ms  # noqa: E402
+
+
+def best_time(repeat, run):
+    best, result = None, None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = run()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("files", nargs="+", help="video files to decode")
+    parser.add_argument("--interval", type=float, default=10, help="sampling interval in seconds")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement, the best one is reported")
+    parser.add_argument("--fragment-ratio", type=int, default=5, help="keep one in n frames for fragment extraction")
+    args = parser.parse_args()
+
+    print(f"{'file':<30} {'backend':<8} {'mode':<10} {'frames':>7} {'seconds':>9} {'video x':>9}")
+    for file_path in args.files:
+        duration_s = (video_duration_ms(file_path) or 0) / 1000.0
+        name = os.path.basename(file_path)
+        for backend in DECODE_BACKENDS:
+            for mode in SAMPLING_MODES:
+                elapsed, frames = best_time(args.repeat, lambda: sum(
+                    1 for _ in sample_frames(file_path, args.interval, mode, backend=backend)
+                ))
+                speed = duration_s / elapsed if elapsed else 0.0
+                print(f"{name:<30} {backend:<8} {mode:<10} {frames:>7} {elapsed:>9.3f} {speed:>9.1f}")
+
+            with open(file_path, "rb") as video_file:
+                data = video_file.read()
+            decoder = get_decode_backend(backend)
+            elapsed, frames = best_time(args.repeat, lambda: len(decoder.fragment_frames(data, args.fragment_ratio)))
+            speed = duration_s / elapsed if elapsed else 0.0
+            print(f"{name:<30} {backend:<8} {'fragment':<10} {frames:>7} {elapsed:>9.3f} {speed:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
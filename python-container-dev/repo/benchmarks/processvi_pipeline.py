@@ -0,0 +1,289 @@
+"""Offline end-to-end benchmark of the ProcessVI pipeline.
+
+Generates synthetic videos and images in a temporary directory, replaces
+Rekognition and DynamoDB with the local stubs in benchmarks/stubs.py, runs
+ProcessVI.main over the files and writes a JSON report:
+
+    frames/s and seconds of video per second of wall time
+    Rekognition calls (per operation, per minute of video, throttled)
+    DynamoDB calls and items written
+    peak RSS
+    time spent per stage (decode, gate, submit, encode, rekognition, record, dynamodb)
+    per-operation timings of the building blocks (encode, hash, gate, signature)
+
+Usage:
+    python benchmarks/processvi_pipeline.py --videos 2 --minutes 5 --output results.json
+
+Stage times are summed over threads, so with overlapping stages they add up
+to more than the wall time. With --workers > 1 the files are processed by
+threads standing in for ProcessVI's worker processes, so the stubs and their
+counters stay shared; the numbers show scheduling effects, not multi-core
+speed-up.
+"""
+import argparse
+import contextlib
+import functools
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import av
+import cv2
+import numpy as np
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stubs import StubDynamoDB, StubRekognition  # noqa: E402
+
+
+class StageTimer:
+    """Accumulate time and call counts per stage across threads."""
+
+    def __init__(self):
+        self.seconds = {}
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, elapsed):
+        with self._lock:
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + elapsed
+            self.calls[stage] = self.calls.get(stage, 0) + 1
+
+    def wrap(self, stage, function):
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - started)
+        return timed
+
+    def wrap_generator(self, stage, function):
+        """Time each next() of the generators `function` returns."""
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            iterator = iter(function(*args, **kwargs))
+            while True:
+                started = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                self.add(stage, time.perf_counter() - started)
+                yield item
+        return timed
+
+    def report(self):
+        return {
+            stage: {"seconds": round(self.seconds[stage], 4), "calls": self.calls[stage]}
+            for stage in sorted(self.seconds)
+        }
+
+
+def make_video(path, seconds, width, height, fps, seed):
+    """Write an MKV with a static background and 'visitors' that come, stay and go.
+
+    Every other 30 s stretch has nobody moving, so the motion gate has
+    something to skip.
+    """
+    rng = np.random.default_rng(seed)
+    background = cv2.GaussianBlur(rng.integers(0, 255, (height, width, 3), dtype=np.uint8), (31, 31), 0)
+    codec = "h264" if "h264" in av.codecs_available else "mpeg4"
+    with av.open(path, "w") as container:
+        stream = container.add_stream(codec, rate=fps)
+        stream.width, stream.height, stream.pix_fmt = width, height, "yuv420p"
+        for index in range(int(seconds * fps)):
+            t = index / fps
+            frame = background.copy()
+            if int(t // 30) % 2 == 0:
+                for visitor in range(3):
+                    x = int((t * 40 + visitor * width / 3) % (width - 80))
+                    y = height // 3 + visitor * 20
+                    cv2.rectangle(frame, (x, y), (x + 60, y + 80), (200, 180, 160), -1)
+                    cv2.circle(frame, (x + 20, y + 30), 5, (40, 40, 40), -1)
+                    cv2.circle(frame, (x + 40, y + 30), 5, (40, 40, 40), -1)
+            for packet in stream.encode(av.VideoFrame.from_ndarray(frame, format="bgr24")):
+                container.mux(packet)
+        for packet in stream.encode():
+            container.mux(packet)
+
+
+def make_images(directory, count, width, height, seed):
+    rng = np.random.default_rng(seed)
+    for index in range(count):
+        image = cv2.GaussianBlur(rng.integers(0, 255, (height, width, 3), dtype=np.uint8), (15, 15), 0)
+        cv2.imwrite(os.path.join(directory, f"image-{index:04d}.jpg"), image)
+
+
+def benchmark_blocks(ProcessVI, width, height, repeat=50):
+    """Milliseconds per call of the per-frame building blocks."""
+    from MotionGate import MotionGate
+    from ResultCache import content_digest
+
+    rng = np.random.default_rng(1)
+    frame = cv2.GaussianBlur(rng.integers(0, 255, (height, width, 3), dtype=np.uint8), (15, 15), 0)
+    gate = MotionGate(ProcessVI.MOTION_THRESHOLD)
+    blocks = {
+        "encode": lambda: ProcessVI.frame_encoder.encode(frame),
+        "content_digest": lambda: content_digest(frame),
+        "motion_gate": lambda: gate.should_analyze(frame),
+    }
+    if ProcessVI.face_embedder is not None:
+        blocks["face_embedding"] = lambda: ProcessVI.face_embedder.embed(frame[: height // 4, : width // 8])
+    if ProcessVI.face_predetector is not None:
+        blocks["face_predetect"] = lambda: ProcessVI.face_predetector.detect(frame)
+
+    results = {}
+    for name, block in blocks.items():
+        started = time.perf_counter()
+        for _ in range(repeat):
+            block()
+        results[name] = round((time.perf_counter() - started) * 1000.0 / repeat, 3)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1)
+
+
+def install_stubs(ProcessVI, rekognition, dynamodb, timer):
+    """Point ProcessVI's AWS resources and pipeline stages at the stubs and timers."""
+    from DynamoBatchWriter import BatchWriter
+    from MotionGate import MotionGate
+    from RekognitionDispatcher import RekognitionDispatcher
+    from VisitorStateCache import VisitorStateCache
+
+    rekognition._call = timer.wrap("rekognition", rekognition._call)
+    dynamodb._call = timer.wrap("dynamodb", dynamodb._call)
+
+    ProcessVI.dynamodb = dynamodb
+    ProcessVI.table = dynamodb.Table(ProcessVI.table_name)
+    ProcessVI.checkpoint_table = dynamodb.Table(ProcessVI.checkpoint_table_name)
+    ProcessVI.visitor_table = dynamodb.Table(ProcessVI.visitor_table_name)
+    ProcessVI.rekognition = rekognition
+    ProcessVI.rekognition_dispatcher = RekognitionDispatcher(rekognition)
+    ProcessVI.analytics_writer = BatchWriter(dynamodb)
+    ProcessVI.visitor_state = VisitorStateCache(ProcessVI.visitor_table)
+
+    class TimedMotionGate(MotionGate):
+        should_analyze = timer.wrap("gate", MotionGate.should_analyze)
+
+    ProcessVI.MotionGate = TimedMotionGate
+    ProcessVI.sample_frames = timer.wrap_generator("decode", ProcessVI.sample_frames)
+    ProcessVI.submit_frame = timer.wrap("submit", ProcessVI.submit_frame)
+    ProcessVI.frame_encoder.encode = timer.wrap("encode", ProcessVI.frame_encoder.encode)
+    ProcessVI.record_analysis = timer.wrap("record", ProcessVI.record_analysis)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--videos", type=int, default=2, help="synthetic videos to generate")
+    parser.add_argument("--minutes", type=float, default=3.0, help="length of each video")
+    parser.add_argument("--images", type=int, default=20, help="synthetic images to generate")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--fps", type=int, default=15)
+    parser.add_argument("--workers", type=int, default=1, help="files processed concurrently (threads, see above)")
+    parser.add_argument("--segments", type=int, default=1, help="time segments per video")
+    parser.add_argument("--rekognition-latency", type=float, default=0.15, help="seconds per Rekognition call")
+    parser.add_argument("--rekognition-tps", type=float, default=None, help="throttle Rekognition above this rate")
+    parser.add_argument("--faces", type=int, default=2, help="faces returned per detect_faces call")
+    parser.add_argument("--dynamodb-latency", type=float, default=0.01, help="seconds per DynamoDB call")
+    parser.add_argument("--unprocessed-ratio", type=float, default=0.0,
+                        help="fraction of batch_write_item items returned as UnprocessedItems")
+    parser.add_argument("--cache", action="store_true", help="enable the Rekognition result cache")
+    parser.add_argument("--output", help="JSON report path (default: stdout)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="processvi-bench-")
+    video_dir = os.path.join(workdir, "videos")
+    image_dir = os.path.join(workdir, "images")
+    os.makedirs(video_dir)
+    os.makedirs(image_dir)
+
+    # ProcessVI reads these at import time
+    os.environ.setdefault("AWS_DEFAULT_REGION", "eu-west-1")
+    os.environ["CHECKPOINT_PATH"] = os.path.join(workdir, "checkpoint")
+    os.environ["RESULT_CACHE_PATH"] = os.path.join(workdir, "cache.sqlite") if args.cache else ""
+    import ProcessVI
+
+    print(f"Generating {args.videos} x {args.minutes} min videos and {args.images} images in {workdir}", file=sys.stderr)
+    for index in range(args.videos):
+        make_video(os.path.join(video_dir, f"video-{index:02d}.mkv"), args.minutes * 60,
+                   args.width, args.height, args.fps, seed=index)
+    make_images(image_dir, args.images, args.width, args.height, seed=100)
+
+    timer = StageTimer()
+    rekognition = StubRekognition(args.rekognition_latency, max_tps=args.rekognition_tps, faces_per_frame=args.faces)
+    dynamodb = StubDynamoDB(args.dynamodb_latency, args.unprocessed_ratio)
+    install_stubs(ProcessVI, rekognition, dynamodb, timer)
+    ProcessVI.VIDEO_DIR = video_dir
+    ProcessVI.IMAGE_DIR = image_dir
+    ProcessVI.create_pool = lambda workers: ThreadPoolExecutor(workers, thread_name_prefix="bench-worker")
+
+    started = time.perf_counter()
+    # ProcessVI's progress output would get mixed into the JSON on stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        ProcessVI.main(args.workers, args.segments)
+        ProcessVI.analytics_writer.flush()
+        ProcessVI.visitor_state.flush()
+    wall_seconds = time.perf_counter() - started
+
+    video_minutes = args.videos * args.minutes
+    sampled_frames = timer.calls.get("decode", 0) + args.images
+    rekognition_calls = sum(rekognition.calls.values())
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "config": vars(args),
+        "input": {"videos": args.videos, "video_minutes": video_minutes, "images": args.images,
+                  "sampled_frames": sampled_frames},
+        "wall_seconds": round(wall_seconds, 3),
+        "frames_per_second": round(sampled_frames / wall_seconds, 2),
+        "video_seconds_per_second": round(video_minutes * 60 / wall_seconds, 2),
+        "rekognition": {
+            "calls": dict(rekognition.calls),
+            "calls_per_video_minute": round(rekognition.calls["DetectFaces"] / video_minutes, 2) if video_minutes else None,
+            "total_calls": rekognition_calls,
+            "throttled": rekognition.throttled,
+            "dispatcher": {"calls": ProcessVI.rekognition_dispatcher.calls,
+                           "throttles": ProcessVI.rekognition_dispatcher.throttles,
+                           "final_limit": ProcessVI.rekognition_dispatcher.limit},
+        },
+        "dynamodb": {"calls": dict(dynamodb.calls), "items_written": dynamodb.items_written},
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": timer.report(),
+        "blocks_ms": benchmark_blocks(ProcessVI, args.width, args.height),
+    }
+
+    output = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, "w") as report_file:
+            report_file.write(output + "\n")
+        print(f"Wrote {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
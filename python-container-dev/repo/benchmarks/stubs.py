@@ -0,0 +1,189 @@
+"""Local stand-ins for Rekognition and DynamoDB used by the benchmarks.
+
+They implement just the calls ProcessVI makes, sleep for a configurable
+latency per call and count everything, so a run measures our own pipeline
+rather than the network. StubRekognition can also throttle: calls above
+`max_tps` in a one-second window raise ThrottlingException, as Rekognition
+does when an account's TPS limit is exceeded.
+"""
+import random
+import threading
+import time
+from collections import Counter, deque
+
+from botocore.exceptions import ClientError
+
+
+def _client_error(code, operation):
+    return ClientError({"Error": {"Code": code, "Message": code}}, operation)
+
+
+class StubRekognition:
+    """detect_faces and face collection calls with latency, throttling and call counts."""
+
+    def __init__(self, latency=0.15, jitter=0.05, max_tps=None, faces_per_frame=2, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.max_tps = max_tps
+        self.faces_per_frame = faces_per_frame
+        self.calls = Counter()
+        self.throttled = 0
+        self._recent = deque()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def detect_faces(self, Image, Attributes=None):
+        self._call("DetectFaces")
+        return {"FaceDetails": [self._face(i) for i in range(self.faces_per_frame)]}
+
+    def search_faces_by_image(self, CollectionId, Image, **kwargs):
+        self._call("SearchFacesByImage")
+        return {"FaceMatches": []}
+
+    def index_faces(self, CollectionId, Image, ExternalImageId=None, **kwargs):
+        self._call("IndexFaces")
+        return {"FaceRecords": [{"Face": {"FaceId": f"face-{ExternalImageId}", "ExternalImageId": ExternalImageId}}]}
+
+    def _call(self, operation):
+        with self._lock:
+            now = time.monotonic()
+            while self._recent and now - self._recent[0] >= 1.0:
+                self._recent.popleft()
+            if self.max_tps is not None and len(self._recent) >= self.max_tps:
+                self.throttled += 1
+                raise _client_error("ThrottlingException", operation)
+            self._recent.append(now)
+            self.calls[operation] += 1
+            delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+        time.sleep(delay)
+
+    def _face(self, index):
+        with self._lock:
+            low = self._random.choice((18, 25, 32, 45, 60))
+            left = self._random.uniform(0.05, 0.7)
+            top = self._random.uniform(0.05, 0.6)
+            gender = self._random.choice(("Male", "Female"))
+            emotion = self._random.choice(("HAPPY", "CALM", "SURPRISED"))
+        return {
+            "BoundingBox": {"Left": left, "Top": top, "Width": 0.12, "Height": 0.2},
+            "AgeRange": {"Low": low, "High": low + 8},
+            "Gender": {"Value": gender, "Confidence": 99.0},
+            "Emotions": [{"Type": emotion, "Confidence": 90.0}],
+        }
+
+
+class StubTable:
+    """The Table resource calls ProcessVI and its helpers make."""
+
+    def __init__(self, dynamodb, name):
+        self.dynamodb = dynamodb
+        self.name = name
+        self.items = {}
+
+    def get_item(self, Key, **kwargs):
+        self.dynamodb._call("GetItem")
+        item = self.items.get(self._key(Key))
+        return {"Item": dict(item)} if item is not None else {}
+
+    def put_item(self, Item, **kwargs):
+        self.dynamodb._call("PutItem", writes=1)
+        self.items[self._key(Item)] = dict(Item)
+        return {}
+
+    def delete_item(self, Key, **kwargs):
+        self.dynamodb._call("DeleteItem", writes=1)
+        self.items.pop(self._key(Key), None)
+        return {}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues, ExpressionAttributeNames=None,
+                    ConditionExpression=None, **kwargs):
+        self.dynamodb._call("UpdateItem", writes=1)
+        names = ExpressionAttributeNames or {}
+        current = self.items.get(self._key(Key), {})
+        if ConditionExpression and not _condition_holds(current, ConditionExpression, names,
+                                                        ExpressionAttributeValues):
+            raise _client_error("ConditionalCheckFailedException", "UpdateItem")
+        item = self.items.setdefault(self._key(Key), dict(Key))
+        # Enough of the expression grammar for "SET a = :a ADD b :b, c :c"
+        for clause in UpdateExpression.replace(" ADD ", "\nADD ").replace("SET ", "SET\n").split("\n"):
+            clause = clause.strip()
+            if clause.startswith("ADD "):
+                for part in clause[4:].split(","):
+                    name, value = part.split()
+                    name = names.get(name, name)
+                    item[name] = item.get(name, 0) + ExpressionAttributeValues[value]
+            elif clause and clause != "SET":
+                for part in clause.split(","):
+                    name, value = (side.strip() for side in part.split("="))
+                    item[names.get(name, name)] = ExpressionAttributeValues[value]
+        return {}
+
+    def scan(self, **kwargs):
+        self.dynamodb._call("Scan")
+        return {"Items": [dict(item) for item in self.items.values()]}
+
+    @staticmethod
+    def _key(item):
+        for name in ("id", "visitor_id", "PK"):
+            if name in item:
+                return (name, item[name], item.get("SK"))
+        return tuple(sorted(item.items()))
+
+
+def _condition_holds(item, expression, names, values):
+    """Enough of the condition grammar for "attribute_not_exists(a) OR a < :a"."""
+    for term in expression.split(" OR "):
+        term = term.strip()
+        if term.startswith("attribute_not_exists(") and term.endswith(")"):
+            if names.get(term[21:-1], term[21:-1]) not in item:
+                return True
+        else:
+            name, operator, value = term.split()
+            current = item.get(names.get(name, name))
+            if operator != "<":
+                raise ValueError(f"Unsupported condition {term!r}")
+            if current is not None and current < values[value]:
+                return True
+    return False
+
+
+class StubDynamoDB:
+    """A DynamoDB resource with Table() and batch_write_item, counting calls and written items."""
+
+    def __init__(self, latency=0.01, unprocessed_ratio=0.0, seed=0):
+        self.latency = latency
+        self.unprocessed_ratio = unprocessed_ratio
+        self.calls = Counter()
+        self.items_written = 0
+        self._tables = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def Table(self, name):
+        with self._lock:
+            if name not in self._tables:
+                self._tables[name] = StubTable(self, name)
+            return self._tables[name]
+
+    def batch_write_item(self, RequestItems):
+        self._call("BatchWriteItem")
+        unprocessed = {}
+        for table_name, requests in RequestItems.items():
+            table = self.Table(table_name)
+            for request in requests:
+                with self._lock:
+                    rejected = self._random.random() < self.unprocessed_ratio
+                if rejected:
+                    unprocessed.setdefault(table_name, []).append(request)
+                    continue
+                item = request["PutRequest"]["Item"]
+                table.items[table._key(item)] = dict(item)
+                with self._lock:
+                    self.items_written += 1
+        return {"UnprocessedItems": unprocessed}
+
+    def _call(self, operation, writes=0):
+        with self._lock:
+            self.calls[operation] += 1
+            self.items_written += writes
+        time.sleep(self.latency)
@@ -1,8 +1,16 @@
 import boto3
 import requests
 import os
+import sys
 import time
 
+try:
+    from EndpointCache import EndpointCache
+except ImportError:
+    # Run from the repository: the shared module lives one directory up
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    from EndpointCache import EndpointCache
+
 def main():
     # Set AWS profile and region
     os.environ['AWS_PROFILE'] = '577411803844_terraform'
@@ -15,9 +23,9 @@ def main():
     # Create Kinesis Video client
     kvs_client = boto3.client('kinesisvideo', region_name=os.environ['AWS_DEFAULT_REGION'])
 
-    # Get the endpoint for the Kinesis Video Stream
-    endpoint_response = kvs_client.get_data_endpoint(StreamName=stream_name, APIName='PUT_MEDIA')
-    endpoint = endpoint_response['DataEndpoint']
+    # Get the endpoint for the Kinesis Video Stream (cached, shared with the other scripts)
+    endpoint_cache = EndpointCache(kvs_client)
+    endpoint = endpoint_cache.get(stream_name, 'PUT_MEDIA')
     
     # Log the endpoint for debugging
     print(f"Endpoint URL for PUT_MEDIA: {endpoint}")
@@ -31,7 +39,14 @@ def main():
                 break  # End of file
             
             # Sending PUT request to the Kinesis Video endpoint
-            response = requests.put(endpoint, data=data, headers={'Content-Type': 'application/octet-stream'})
+            try:
+                response = requests.put(endpoint, data=data, headers={'Content-Type': 'application/octet-stream'})
+            except requests.exceptions.ConnectionError as e:
+                # The endpoint may have moved; resolve it again and resend the chunk once
+                print(f"Failed to connect to {endpoint}: {e}")
+                endpoint_cache.invalidate(stream_name, 'PUT_MEDIA')
+                endpoint = endpoint_cache.get(stream_name, 'PUT_MEDIA')
+                response = requests.put(endpoint, data=data, headers={'Content-Type': 'application/octet-stream'})
             if response.status_code != 200:
                 print(f"Failed to put media: {response.status_code} - {response.text}")
             else:
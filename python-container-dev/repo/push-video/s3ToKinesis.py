@@ -2,11 +2,29 @@ import json
 import boto3
 import botocore
 import os
-import time
+import sys
+
+# EndpointCache.py is next to this handler when it was copied into the Lambda
+# package, or one directory up when run from the repository. Without it every
+# invocation looks the endpoint up.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+try:
+    from EndpointCache import CONNECTION_ERRORS, EndpointCache
+except ImportError:
+    EndpointCache = None
+    CONNECTION_ERRORS = (botocore.exceptions.ConnectionError, ConnectionError)
 
 # Initialize the S3 and Kinesis Video clients
 s3_client = boto3.client("s3")
 kvs_client = boto3.client("kinesisvideo")
+# Endpoints are cached in /tmp, so warm invocations skip GetDataEndpoint
+endpoint_cache = EndpointCache(kvs_client) if EndpointCache is not None else None
+
+def get_put_media_endpoint(stream_name):
+    if endpoint_cache is None:
+        response = kvs_client.get_data_endpoint(StreamName=stream_name, APIName="PUT_MEDIA")
+        return response["DataEndpoint"]
+    return endpoint_cache.get(stream_name, "PUT_MEDIA")
 
 def lambda_handler(event, context):
     # Input parameters
@@ -25,11 +43,7 @@ def lambda_handler(event, context):
 
     # Get the Kinesis Video Stream endpoint
     try:
-        response = kvs_client.get_data_endpoint(
-            StreamName=kinesis_stream_name,
-            APIName="PUT_MEDIA"
-        )
-        endpoint_url = response["DataEndpoint"]
+        endpoint_url = get_put_media_endpoint(kinesis_stream_name)
         print(f"Endpoint URL for Kinesis Video Stream: {endpoint_url}")
     except botocore.exceptions.ClientError as e:
         print(f"Failed to get Kinesis Video Stream endpoint: {e}")
@@ -53,6 +67,12 @@ def lambda_handler(event, context):
             )
         
         print(f"Successfully streamed video to Kinesis Video Stream {kinesis_stream_name}")
+    except CONNECTION_ERRORS as e:
+        # Resolve the endpoint again on the next invocation
+        if endpoint_cache is not None:
+            endpoint_cache.invalidate(kinesis_stream_name, "PUT_MEDIA")
+        print(f"Failed to connect to Kinesis Video Stream endpoint: {e}")
+        return {"statusCode": 500, "body": json.dumps("Error streaming video to Kinesis")}
     except botocore.exceptions.ClientError as e:
         print(f"Failed to stream video to Kinesis Video Stream: {e}")
         return {"statusCode": 500, "body": json.dumps("Error streaming video to Kinesis")}
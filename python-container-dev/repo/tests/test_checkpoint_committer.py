@@ -0,0 +1,71 @@
+import os
+import sys
+import unittest
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, "benchmarks"))
+
+from CheckpointCommitter import CheckpointCommitter  # noqa: E402
+from stubs import StubDynamoDB  # noqa: E402
+
+
+class CheckpointCommitterTest(unittest.TestCase):
+    def setUp(self):
+        self.dynamodb = StubDynamoDB(latency=0)
+
+    def committer(self):
+        committer = CheckpointCommitter(self.dynamodb, "StreamMetadata", lambda stream: {"StreamName": stream},
+                                        pointer_attribute="LastProcessedFragment", interval=3600)
+        self.addCleanup(committer.close)
+        return committer
+
+    def stored(self, stream):
+        item = self.dynamodb.Table("StreamMetadata").get_item(Key={"StreamName": stream}).get("Item", {})
+        return item.get("LastProcessedFragment")
+
+    def test_only_the_newest_pending_position_is_committed(self):
+        committer = self.committer()
+        for position in ("100", "300", "200"):
+            committer.advance("booth-01", position)
+
+        committer.flush()
+
+        self.assertEqual(self.stored("booth-01"), "300")
+        self.assertEqual(committer.commits, 1)
+
+    def test_positions_behind_the_committed_one_are_ignored(self):
+        committer = self.committer()
+        committer.advance("booth-01", "300")
+        committer.flush()
+        committer.advance("booth-01", "200")
+
+        committer.flush()
+
+        self.assertEqual(self.stored("booth-01"), "300")
+        self.assertEqual(committer.position("booth-01"), "300")
+
+    def test_numeric_order_not_string_order(self):
+        committer = self.committer()
+        committer.advance("booth-01", "99")
+        committer.flush()
+        committer.advance("booth-01", "100")
+
+        committer.flush()
+
+        self.assertEqual(self.stored("booth-01"), "100")
+
+    def test_another_consumers_newer_commit_is_not_overwritten(self):
+        ahead, behind = self.committer(), self.committer()
+        ahead.advance("booth-01", "500")
+        ahead.flush()
+        behind.advance("booth-01", "400")
+
+        behind.flush()
+
+        self.assertEqual(self.stored("booth-01"), "500")
+        self.assertEqual(behind.stale_commits, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
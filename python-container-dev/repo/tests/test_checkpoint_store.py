@@ -0,0 +1,79 @@
+import os
+import sys
+import tempfile
+import unittest
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, "benchmarks"))
+
+from CheckpointStore import ITEM_PREFIX, CheckpointStore, file_digest  # noqa: E402
+from stubs import StubDynamoDB  # noqa: E402
+
+
+class CheckpointStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.dynamodb = StubDynamoDB(latency=0)
+        self.local_path = os.path.join(tempfile.mkdtemp(), "checkpoints")
+
+    def store(self, local_path=None, **kwargs):
+        store = CheckpointStore(self.dynamodb, "Checkpoints", local_path or self.local_path, **kwargs)
+        self.addCleanup(store._journal.close)
+        return store
+
+    def test_restart_replays_the_journal_without_compaction(self):
+        store = self.store()
+        store.mark_done("videos", "/videos/a.mkv")
+        store.mark_done("images", "/images/b.jpg")
+        store._journal.close()  # A crash: the journal was never compacted into the index
+
+        restarted = self.store()
+
+        self.assertTrue(restarted.is_done("videos", "/videos/a.mkv"))
+        self.assertTrue(restarted.is_done("images", "/images/b.jpg"))
+        self.assertFalse(restarted.is_done("images", "/videos/a.mkv"))
+        self.assertEqual(len(restarted), 2)
+
+    def test_compacted_index_and_journal_tail_are_both_loaded(self):
+        store = self.store(compact_every=2)
+        for name in ("a", "b", "c"):
+            store.mark_done("images", f"/images/{name}.jpg")
+        store._journal.close()
+
+        restarted = self.store()
+
+        self.assertTrue(all(restarted.is_done("images", f"/images/{name}.jpg") for name in ("a", "b", "c")))
+        self.assertEqual(len(restarted), 3)
+
+    def test_file_is_not_recorded_when_its_item_cannot_be_written(self):
+        store = self.store()
+        table = self.dynamodb.Table("Checkpoints")
+        put_item = table.put_item
+
+        def failing_put_item(**kwargs):
+            raise ConnectionError("DynamoDB unreachable")
+
+        table.put_item = failing_put_item
+        with self.assertRaises(ConnectionError):
+            store.mark_done("videos", "/videos/a.mkv")
+        self.assertFalse(store.is_done("videos", "/videos/a.mkv"))
+        store._journal.close()
+
+        table.put_item = put_item
+        restarted = self.store()
+        self.assertFalse(restarted.is_done("videos", "/videos/a.mkv"))
+
+    def test_missing_local_index_is_rebuilt_from_the_table(self):
+        store = self.store()
+        store.mark_done("videos", "/videos/a.mkv")
+        store.close()
+
+        other_host = self.store(os.path.join(tempfile.mkdtemp(), "checkpoints"))
+
+        self.assertTrue(other_host.is_done("videos", "/videos/a.mkv"))
+        item_ids = {item["id"] for item in self.dynamodb.Table("Checkpoints").items.values()}
+        self.assertEqual(item_ids, {f"{ITEM_PREFIX}{file_digest('videos', '/videos/a.mkv'):016x}"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,161 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, "benchmarks"))
+
+from botocore.exceptions import ClientError  # noqa: E402
+
+from DynamoBatchWriter import BatchWriteError, BatchWriter  # noqa: E402
+from stubs import StubDynamoDB  # noqa: E402
+
+
+def client_error(code, operation="BatchWriteItem"):
+    return ClientError({"Error": {"Code": code, "Message": code}}, operation)
+
+
+class FailingDynamoDB(StubDynamoDB):
+    """StubDynamoDB whose batch_write_item raises `throttle` errors first and rejects "poison" items."""
+
+    def __init__(self, throttle=0, unprocessed_ratio=0.0):
+        super().__init__(latency=0, unprocessed_ratio=unprocessed_ratio)
+        self.throttle = throttle
+        self.written = []  # ids in the order they were written
+
+    def batch_write_item(self, RequestItems):
+        if self.throttle:
+            self.throttle -= 1
+            raise client_error("ProvisionedThroughputExceededException")
+        for requests in RequestItems.values():
+            if any(request["PutRequest"]["Item"].get("poison") for request in requests):
+                raise client_error("ValidationException")
+        response = super().batch_write_item(RequestItems)
+        unprocessed = [request["PutRequest"]["Item"] for requests in response["UnprocessedItems"].values()
+                       for request in requests]
+        self.written.extend(request["PutRequest"]["Item"]["id"] for requests in RequestItems.values()
+                            for request in requests if request["PutRequest"]["Item"] not in unprocessed)
+        return response
+
+
+def items(dynamodb, table_name="Analytics"):
+    return sorted(item["id"] for item in dynamodb.Table(table_name).items.values())
+
+
+class BatchWriterTest(unittest.TestCase):
+    def writer(self, dynamodb, **kwargs):
+        writer = BatchWriter(dynamodb, flush_interval=3600, base_backoff=0, **kwargs)
+        self.addCleanup(writer.close)
+        return writer
+
+    def test_unprocessed_items_are_retried_until_written(self):
+        dynamodb = FailingDynamoDB(unprocessed_ratio=0.5)
+        writer = self.writer(dynamodb, max_retries=50)
+        for index in range(60):
+            writer.put_item("Analytics", {"id": index})
+
+        writer.flush()
+
+        self.assertEqual(items(dynamodb), list(range(60)))
+        self.assertEqual(writer.items_written, 60)
+        self.assertGreater(dynamodb.calls["BatchWriteItem"], 3)
+
+    def test_failed_batch_goes_back_in_front_of_newer_items(self):
+        dynamodb = FailingDynamoDB(throttle=1)
+        writer = self.writer(dynamodb, batch_size=2)
+        writer.put_item("Analytics", {"id": 0})
+        with self.assertRaises(BatchWriteError):
+            writer.flush()
+        for index in range(1, 4):
+            writer.put_item("Analytics", {"id": index})
+
+        writer.flush()
+
+        self.assertEqual(dynamodb.written, [0, 1, 2, 3])
+
+    def test_newer_item_with_the_same_key_replaces_the_buffered_one(self):
+        dynamodb = FailingDynamoDB(throttle=1)
+        writer = self.writer(dynamodb, overwrite_by_pkeys={"Analytics": ["id"]})
+        writer.put_item("Analytics", {"id": 1, "value": "first"})
+        writer.put_item("Analytics", {"id": 2, "value": "only"})
+        with self.assertRaises(BatchWriteError):
+            writer.flush()
+        writer.put_item("Analytics", {"id": 1, "value": "second"})
+        self.assertEqual(len(writer), 2)
+
+        writer.flush()
+
+        table = dynamodb.Table("Analytics").items
+        self.assertEqual(sorted(item["value"] for item in table.values()), ["only", "second"])
+        self.assertEqual(dynamodb.written, [2, 1])
+
+    def test_throttled_batch_stays_buffered_until_a_flush_succeeds(self):
+        dynamodb = FailingDynamoDB(throttle=1)
+        writer = self.writer(dynamodb)
+        for index in range(3):
+            writer.put_item("Analytics", {"id": index})
+
+        with self.assertRaises(BatchWriteError):
+            writer.flush()
+        self.assertEqual(len(writer), 3)
+        self.assertEqual(writer.items_dropped, 0)
+
+        writer.flush()
+        self.assertEqual(items(dynamodb), [0, 1, 2])
+
+    def test_poison_item_is_dropped_and_dead_lettered_without_blocking_the_rest(self):
+        dynamodb = FailingDynamoDB()
+        dead_letter_path = os.path.join(tempfile.mkdtemp(), "dead-letter.jsonl")
+        writer = self.writer(dynamodb, dead_letter_path=dead_letter_path)
+        for index in range(10):
+            writer.put_item("Analytics", {"id": index, "poison": index == 4})
+
+        writer.flush()
+
+        self.assertEqual(items(dynamodb), [0, 1, 2, 3, 5, 6, 7, 8, 9])
+        self.assertEqual(writer.items_dropped, 1)
+        with open(dead_letter_path) as dead_letter_file:
+            self.assertEqual([json.loads(line)["Item"]["id"] for line in dead_letter_file], [4])
+
+    def test_close_writes_the_buffer(self):
+        dynamodb = FailingDynamoDB()
+        writer = self.writer(dynamodb)
+        for index in range(30):
+            writer.put_item("Analytics", {"id": index})
+
+        writer.close()
+
+        self.assertEqual(items(dynamodb), list(range(30)))
+        self.assertEqual(len(writer), 0)
+
+    def test_close_drops_items_that_cannot_be_written(self):
+        writer = self.writer(FailingDynamoDB(throttle=100))
+        for index in range(3):
+            writer.put_item("Analytics", {"id": index})
+
+        writer.close()
+
+        self.assertEqual(writer.items_dropped, 3)
+        self.assertEqual(len(writer), 0)
+
+    def test_full_buffer_rejects_items_while_writes_fail(self):
+        dynamodb = FailingDynamoDB(throttle=100)
+        writer = self.writer(dynamodb, batch_size=10, max_buffered=5)
+        for index in range(5):
+            writer.put_item("Analytics", {"id": index})
+
+        with self.assertRaises(BatchWriteError):
+            writer.put_item("Analytics", {"id": 5})
+        self.assertEqual(len(writer), 5)
+
+        dynamodb.throttle = 0
+        writer.put_item("Analytics", {"id": 5})  # Makes room by writing the buffer
+        writer.flush()
+        self.assertEqual(items(dynamodb), list(range(6)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import os
+import sys
+import unittest
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from FrameEncoder import FrameEncoder  # noqa: E402
+
+
+def noisy_frame(height=720, width=1280):
+    return np.random.default_rng(0).integers(0, 255, (height, width, 3), dtype=np.uint8)
+
+
+def decoded_size(encoded):
+    height, width = cv2.imdecode(np.frombuffer(encoded, dtype=np.uint8), cv2.IMREAD_COLOR).shape[:2]
+    return width, height
+
+
+class FrameEncoderTest(unittest.TestCase):
+    def test_encoding_fits_the_byte_budget(self):
+        for max_bytes in (30 * 1024, 100 * 1024, 400 * 1024):
+            encoded = FrameEncoder(max_bytes=max_bytes).encode(noisy_frame())
+            self.assertLessEqual(len(encoded), max_bytes)
+
+    def test_longest_side_is_capped(self):
+        encoded = FrameEncoder(max_dimension=640, max_bytes=5 * 1024 * 1024).encode(noisy_frame())
+        self.assertEqual(decoded_size(encoded), (640, 360))
+
+    def test_smallest_face_is_scaled_to_the_target_size(self):
+        encoded = FrameEncoder(target_face_px=80, max_bytes=5 * 1024 * 1024).encode(
+            noisy_frame(), face_boxes=[(100, 100, 320, 320), (600, 100, 160, 160)]
+        )
+        self.assertEqual(decoded_size(encoded), (640, 360))
+
+    def test_budget_below_the_minimum_dimension_raises(self):
+        encoder = FrameEncoder(max_bytes=2 * 1024, min_dimension=200)
+        with self.assertRaises(ValueError):
+            encoder.encode(noisy_frame())
+
+    def test_shrinking_stops_at_the_minimum_dimension(self):
+        encoder = FrameEncoder(max_bytes=12 * 1024, min_dimension=80)
+        width, height = decoded_size(encoder.encode(noisy_frame()))
+        self.assertGreaterEqual(min(width, height), 80)
+
+
+if __name__ == "__main__":
+    unittest.main()
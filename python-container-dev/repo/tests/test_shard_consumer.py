@@ -0,0 +1,82 @@
+import json
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from ShardConsumer import FileKinesis, ShardConsumer  # noqa: E402
+
+
+class MemoryCheckpoints:
+    def __init__(self):
+        self.positions = {}
+
+    def get(self, shard_id):
+        return self.positions.get(shard_id)
+
+    def put(self, shard_id, sequence_number):
+        self.positions[shard_id] = sequence_number
+
+
+class ShardConsumerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.kinesis = FileKinesis(os.path.join(self.directory, "streams"))
+        self.kinesis.create_stream("results")
+
+    def consume(self, handler, until, **kwargs):
+        checkpoints = MemoryCheckpoints()
+        consumer = ShardConsumer(self.kinesis, "results", handler, checkpoints, idle_sleep=0.01,
+                                 max_backoff=0.02, **kwargs)
+        consumer.start()
+        deadline = time.monotonic() + 10
+        while not until(consumer) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        consumer.stop(timeout=5)
+        return consumer, checkpoints
+
+    def test_batch_the_handler_always_fails_on_is_dead_lettered_and_skipped(self):
+        first = self.kinesis.put_record("results", b"poison", "key")["SequenceNumber"]
+        calls = []
+
+        def handler(shard_id, records):
+            calls.append([record["SequenceNumber"] for record in records])
+            raise RuntimeError("cannot handle this batch")
+
+        skipped = []
+        dead_letter_dir = os.path.join(self.directory, "dead-letter")
+        consumer, checkpoints = self.consume(
+            handler, lambda consumer: consumer.batches_skipped, max_handler_retries=3,
+            dead_letter_dir=dead_letter_dir,
+            on_skip=lambda shard_id, records: skipped.append([record["SequenceNumber"] for record in records]),
+        )
+
+        self.assertEqual(calls, [[first]] * 4)
+        self.assertEqual(skipped, [[first]])
+        self.assertEqual(consumer.batches_skipped, 1)
+        self.assertEqual(checkpoints.positions, {"shardId-000000000000": first})
+        with open(os.path.join(dead_letter_dir, "results-shardId-000000000000.jsonl")) as dead_letter_file:
+            dead_letters = [json.loads(line) for line in dead_letter_file]
+        self.assertEqual([entry["SequenceNumber"] for entry in dead_letters], [first])
+
+    def test_records_after_a_skipped_batch_are_handled(self):
+        self.kinesis.put_record("results", b"poison", "key")
+        self.kinesis.put_record("results", b"good", "key")
+        handled = []
+
+        def handler(shard_id, records):
+            if any(record["Data"] == b"poison" for record in records):
+                raise RuntimeError("cannot handle this batch")
+            handled.extend(record["Data"] for record in records)
+
+        consumer, _ = self.consume(handler, lambda consumer: handled, batch_size=1, max_handler_retries=1)
+
+        self.assertEqual(handled, [b"good"])
+        self.assertEqual(consumer.batches_skipped, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from WindowAggregator import WindowAggregator, summarize_faces  # noqa: E402
+
+
+def face(low, high, gender="Male", emotion="HAPPY"):
+    return {"AgeRange": {"Low": low, "High": high}, "Gender": {"Value": gender},
+            "Emotions": [{"Type": emotion}]}
+
+
+class WindowAggregatorTest(unittest.TestCase):
+    def setUp(self):
+        self.emitted = []
+        self.aggregator = WindowAggregator(self.emitted.append, window_seconds=60)
+
+    def test_frame_in_the_next_window_closes_the_open_one(self):
+        self.aggregator.add("cam", 0, summarize_faces([face(20, 30)]))
+        self.aggregator.add("cam", 59.999, summarize_faces([face(40, 50, "Female"), face(25, 35)]))
+        self.assertEqual(self.emitted, [])
+
+        self.aggregator.add("cam", 60, summarize_faces([]))
+
+        [window] = self.emitted
+        self.assertEqual((window["window_start"], window["window_end"]), (0, 60))
+        self.assertEqual(window["frames"], 2)
+        self.assertEqual(window["demographics"]["overall_age_range"], {"Min": 20, "Max": 50})
+        self.assertEqual(window["demographics"]["gender_distribution"], {"Male": 2, "Female": 1, "Unknown": 0})
+        self.assertEqual(window["foot_impressions"], 3)
+        self.assertEqual(window["peak_impressions"], 2)
+
+    def test_cameras_have_their_own_windows(self):
+        self.aggregator.add("a", 10, summarize_faces([face(20, 30)]))
+        self.aggregator.add("b", 70, summarize_faces([face(20, 30)]))
+        self.assertEqual(self.emitted, [])
+
+        self.aggregator.flush("a")
+
+        self.assertEqual([(window["camera_id"], window["window_start"]) for window in self.emitted], [("a", 0)])
+
+    def test_flush_emits_every_open_window_with_distinct_visitors(self):
+        summary = summarize_faces([face(20, 30), face(20, 30)])
+        self.aggregator.add("a", 125, dict(summary, visitor_ids={"v1", "v2"}))
+        self.aggregator.add("a", 130, dict(summary, visitor_ids={"v2", "v3"}))
+        self.aggregator.add("b", 5, summarize_faces([]))
+
+        self.aggregator.flush()
+        self.aggregator.flush()
+
+        windows = {window["camera_id"]: window for window in self.emitted}
+        self.assertEqual(len(self.emitted), 2)
+        self.assertEqual(windows["a"]["window_start"], 120)
+        self.assertEqual(windows["a"]["unique_visitors"], 3)
+        self.assertEqual(windows["b"]["demographics"]["overall_age_range"], {"Min": None, "Max": None})
+
+
+if __name__ == "__main__":
+    unittest.main()